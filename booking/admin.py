@@ -1,16 +1,38 @@
 from django.contrib import admin
-from booking.models import FitnessClass, Booking
+from booking.cache import invalidate_class_listing
+from booking.models import FitnessClass, Booking, WaitlistEntry
 
 @admin.register(FitnessClass)
 class FitnessClassAdmin(admin.ModelAdmin):
-    list_display = ('name', 'start_time', 'instructor', 'available_slots', 'created_at')
+    list_display = ('name', 'start_time', 'instructor', 'available_slots', 'capacity', 'called_off_at', 'created_at')
     search_fields = ('name', 'instructor')
     list_filter = ('start_time', 'instructor')
     ordering = ('-start_time',)
+    actions = ['call_off']
+
+    @admin.action(description="Call off selected classes (cancel their bookings and waitlists)")
+    def call_off(self, request, queryset):
+        cancelled = queryset.call_off()
+        invalidate_class_listing()
+        self.message_user(request, f"{cancelled} bookings cancelled.")
 
 @admin.register(Booking)
 class BookingAdmin(admin.ModelAdmin):
-    list_display = ('client_name', 'client_email', 'fitness_class', 'booked_at')
+    list_display = ('client_name', 'client_email', 'fitness_class', 'booked_at', 'cancelled_at')
     search_fields = ('client_name', 'client_email', 'fitness_class__name')
-    list_filter = ('fitness_class', 'booked_at')
+    list_filter = ('fitness_class', 'booked_at', 'cancelled_at')
     ordering = ('-booked_at',)
+    actions = ['cancel_bookings']
+
+    @admin.action(description="Cancel selected bookings")
+    def cancel_bookings(self, request, queryset):
+        cancelled = queryset.cancel()
+        invalidate_class_listing()
+        self.message_user(request, f"{cancelled} bookings cancelled.")
+
+@admin.register(WaitlistEntry)
+class WaitlistEntryAdmin(admin.ModelAdmin):
+    list_display = ('client_name', 'client_email', 'fitness_class', 'joined_at')
+    search_fields = ('client_name', 'client_email', 'fitness_class__name')
+    list_filter = ('fitness_class',)
+    ordering = ('fitness_class', 'id')
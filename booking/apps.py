@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class BookingConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'booking'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        from .db import pool_metrics
+        from .metrics import registry
+
+        registry.add_collector(pool_metrics)
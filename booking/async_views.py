@@ -0,0 +1,253 @@
+import json
+from functools import partial
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import status
+from rest_framework.exceptions import Throttled, ValidationError
+from rest_framework.settings import api_settings
+
+from booking.batching import GroupCommitTimeout, booking_batcher
+from booking.cache import aget_upcoming_classes
+from booking.conditional import (
+    abooking_list_validators, make_etag, not_modified_response, set_validators,
+)
+from booking.idempotency import IDEMPOTENCY_HEADER, invalid_key, replayed, request_fingerprint
+from booking.pagination import BookingKeysetPagination, ClassKeysetPagination
+from booking.renderers import get_json_renderer
+from booking.routers import reads_from_replicas
+from booking.throttling import TokenBucketThrottle
+from booking.utils import CustomLogger, validate_timezone
+from .models import Booking, FitnessClass, IdempotencyKey
+from .views import abatched_booking, group_commit_timeout_response, save_booking
+from .serializers import FAST_BOOKING_VALUES, BookingRequestSerializer, BookingSerializer, fast_booking_rows
+
+logger = CustomLogger(__name__).get_custom_logger()
+
+# Parsed by Django into request.POST, like DRF's FormParser and MultiPartParser.
+FORM_CONTENT_TYPES = ('application/x-www-form-urlencoded', 'multipart/form-data')
+
+
+def json_response(data, status_code, headers=None):
+    """
+    Renders with DRF's JSONRenderer (FastJSONRenderer when BOOKING_FAST_JSON
+    is enabled) so the async endpoints return the same bytes as their
+    APIView counterparts.
+    """
+    return HttpResponse(get_json_renderer().render(data), status=status_code, content_type='application/json',
+                        headers=headers)
+
+
+def throttled(request, scope):
+    """
+    Applies the throttle_scope limits of the APIView counterparts; returns
+    the same 429 response DRF gives once they are used up, otherwise None.
+    """
+    throttle = TokenBucketThrottle()
+    if throttle.consume(scope, throttle.get_ident(request)):
+        return None
+    exc = Throttled(throttle.wait())
+    return json_response({"detail": exc.detail}, exc.status_code, headers={'Retry-After': '%d' % exc.wait})
+
+
+class AsyncClassListView(View):
+    """
+    Async version of ClassListView, enabled with BOOKING_ASYNC_VIEWS.
+    GET /classes/?timezone=Asia/Kolkata&page_size=10&cursor=<next cursor>
+    """
+
+    async def get(self, request):
+        response = throttled(request, 'classes')
+        if response is not None:
+            return response
+
+        tz_name = request.GET.get('timezone', 'Asia/Kolkata')
+
+        try:
+            tz_name = validate_timezone(tz_name)
+        except ValidationError:
+            return json_response({"error": "Invalid timezone"}, status.HTTP_400_BAD_REQUEST)
+
+        try:
+            paginator = ClassKeysetPagination(request)
+        except ValidationError as e:
+            return json_response({"error": e.detail[0]}, status.HTTP_400_BAD_REQUEST)
+
+        try:
+            entries, last_modified = await aget_upcoming_classes(tz_name)
+            etag = make_etag(tz_name, paginator.page_size, request.GET.get(paginator.cursor_query_param, ''),
+                             len(entries), last_modified)
+            not_modified = not_modified_response(request, etag, last_modified)
+            if not_modified is not None:
+                return not_modified
+
+            upcoming_classes = paginator.paginate_entries(entries)
+            logger.info("Returned %d classes for timezone %s", len(upcoming_classes), tz_name)
+
+            return set_validators(json_response({
+                "message": "Classes fetched successfully for the specified timezone.",
+                "next": paginator.get_next_link(),
+                "data": upcoming_classes
+            }, status.HTTP_200_OK), etag, last_modified)
+
+        except Exception as e:
+            logger.error("Error fetching classes for timezone: %s", tz_name, exc_info=True)
+            return json_response({
+                "message": "An error occurred while retrieving classes.",
+                "error": str(e)
+            }, status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncBookClassView(View):
+    """
+    Async version of BookClassView, enabled with BOOKING_ASYNC_VIEWS.
+    POST /book/
+    Body (JSON or form data): {fitness_class, client_name, client_email, waitlist: false}
+    The class and Idempotency-Key lookups are awaited; only the booking
+    transaction runs in a worker thread, since transactions are not yet
+    available in async code.
+    """
+
+    async def post(self, request):
+        if request.content_type in FORM_CONTENT_TYPES:
+            data = request.POST
+        elif request.content_type in ('application/json', '') or not request.body:
+            try:
+                data = json.loads(request.body or b'{}')
+            except ValueError as e:
+                return json_response({"detail": f"JSON parse error - {e}"}, status.HTTP_400_BAD_REQUEST)
+        else:
+            return json_response({"detail": f'Unsupported media type "{request.content_type}" in request.'},
+                                 status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+
+        response = throttled(request, 'book')
+        if response is not None:
+            return response
+
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        fingerprint = None
+        if key is not None:
+            error = invalid_key(key)
+            if error:
+                return json_response({"message": error}, status.HTTP_400_BAD_REQUEST)
+            fingerprint = request_fingerprint(data)
+            record = await IdempotencyKey.objects.afind(key)
+            if record is not None:
+                logger.info("Replaying booking for %s %s", IDEMPOTENCY_HEADER, key)
+                return json_response(*replayed(record, fingerprint))
+
+        serializer = BookingRequestSerializer(data=data)
+        if not serializer.is_valid():
+            logger.error("Invalid booking request: %s", serializer.errors)
+            return self.invalid(serializer.errors)
+
+        validated_data = dict(serializer.validated_data)
+        class_name = validated_data['fitness_class']
+        try:
+            validated_data['fitness_class'] = await FitnessClass.objects.aget(name=class_name)
+        except FitnessClass.DoesNotExist:
+            errors = {"fitness_class": [f"Object with name={class_name} does not exist."]}
+            logger.error("Invalid booking request: %s", errors)
+            return self.invalid(errors)
+
+        if validated_data['fitness_class'].called_off_at is not None:
+            errors = {api_settings.NON_FIELD_ERRORS_KEY: ["This class has been called off."]}
+            logger.error("Invalid booking request: %s", errors)
+            return self.invalid(errors)
+
+        if validated_data['fitness_class'].available_slots < 1 and not validated_data.get('waitlist'):
+            errors = {api_settings.NON_FIELD_ERRORS_KEY: ["No available slots for this class."]}
+            logger.error("Invalid booking request: %s", errors)
+            return self.invalid(errors)
+
+        try:
+            if key is None and booking_batcher.handles(validated_data):
+                return json_response(*await abatched_booking(validated_data))
+            return json_response(*await sync_to_async(save_booking)(
+                partial(BookingSerializer().create, validated_data), key, fingerprint
+            ))
+
+        except GroupCommitTimeout:
+            return json_response(*group_commit_timeout_response())
+
+        except ValidationError as e:
+            logger.warning("Booking rejected: %s", e.detail)
+            return self.invalid(e.detail)
+
+        except Exception as e:
+            logger.error("Error occurred during booking.", exc_info=True)
+            return json_response({
+                "message": "An error occurred while processing your booking.",
+                "error": str(e)
+            }, status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    @staticmethod
+    def invalid(errors):
+        return json_response({
+            "message": "Booking request is not valid.",
+            "errors": errors
+        }, status.HTTP_400_BAD_REQUEST)
+
+
+class AsyncBookingListView(View):
+    """
+    Async version of BookingListView, enabled with BOOKING_ASYNC_VIEWS.
+    GET /bookings/?email=client@example.com&page_size=10&cursor=<next cursor>
+    """
+
+    @reads_from_replicas
+    async def get(self, request):
+        response = throttled(request, 'bookings')
+        if response is not None:
+            return response
+
+        email = request.GET.get('email')
+        if not email:
+            logger.warning("Missing 'email' parameter in booking list request.")
+            return json_response({
+                "message": "Email parameter is required."
+            }, status.HTTP_400_BAD_REQUEST)
+
+        try:
+            paginator = BookingKeysetPagination(request)
+        except ValidationError as e:
+            return json_response({"error": e.detail[0]}, status.HTTP_400_BAD_REQUEST)
+
+        try:
+            bookings = Booking.objects.for_email(email)
+            # The validator aggregate also provides the total count. It spans
+            # cancelled bookings too, so a cancellation changes Last-Modified;
+            # so does a deletion, through its stamp.
+            last_modified, count = await abooking_list_validators(bookings, email)
+            etag = make_etag(email.lower(), paginator.page_size, request.GET.get(paginator.cursor_query_param, ''),
+                             count, last_modified)
+            not_modified = not_modified_response(request, etag, last_modified)
+            if not_modified is not None:
+                return not_modified
+
+            if getattr(settings, 'BOOKING_FAST_JSON', False):
+                page = await paginator.apaginate_queryset(bookings.active().values(*FAST_BOOKING_VALUES))
+                data = fast_booking_rows(page)
+            else:
+                page = await paginator.apaginate_queryset(bookings.active().select_related('fitness_class'))
+                data = BookingSerializer(page, many=True).data
+            logger.info("Returned %d bookings for email %s", len(page), email)
+
+            return set_validators(json_response({
+                "message": "Bookings details fetched successfully.",
+                "count": count,
+                "next": paginator.get_next_link(),
+                "data": data
+            }, status.HTTP_200_OK), etag, last_modified)
+
+        except Exception as e:
+            logger.error("Error fetching bookings for email %s", email, exc_info=True)
+            return json_response({
+                "message": "An error occurred while retrieving bookings.",
+                "error": str(e)
+            }, status.HTTP_500_INTERNAL_SERVER_ERROR)
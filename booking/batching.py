@@ -0,0 +1,136 @@
+import queue
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+from .db import serialized_writes
+from .slots import reservations
+from .utils import CustomLogger
+
+logger = CustomLogger(__name__).get_custom_logger()
+
+
+class GroupCommitTimeout(Exception):
+    """
+    A batched booking got no answer within BOOKING_GROUP_COMMIT_TIMEOUT.
+    """
+
+
+class BookingBatcher:
+    """
+    Group commit for POST /book/, enabled with BOOKING_GROUP_COMMIT. Requests
+    are queued to one worker thread per process, which collects them for up
+    to BOOKING_GROUP_COMMIT_WINDOW seconds (at most
+    BOOKING_GROUP_COMMIT_MAX_BATCH), then books the whole batch in a single
+    transaction: one query reads the slots of every class involved, one
+    UPDATE takes them and one INSERT writes the bookings. Each request then
+    gets its own result. On SQLite, where every transaction pays for a
+    write lock and an fsync, this turns N transactions into one.
+
+    Waitlist and Idempotency-Key requests are not batched, nor are classes
+    held by the slot counter (BOOKING_SLOT_COUNTER), which books them
+    without any transaction.
+    """
+
+    def __init__(self):
+        self._queue = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._worker = None
+
+    def handles(self, validated_data):
+        if not getattr(settings, 'BOOKING_GROUP_COMMIT', False) or validated_data.get('waitlist'):
+            return False
+        return not reservations.holds(validated_data['fitness_class'].id)
+
+    def submit(self, validated_data):
+        """
+        Queues a validated booking request. Returns a Future resolved with
+        its Booking, or with None when the class has no slot left for it.
+        The worker is (re)started if it is not running.
+        """
+        future = Future()
+        self._queue.put((validated_data, future))
+        if self._worker is None or not self._worker.is_alive():
+            with self._lock:
+                if self._worker is None or not self._worker.is_alive():
+                    self._worker = threading.Thread(target=self._run, name='booking-group-commit', daemon=True)
+                    self._worker.start()
+        return future
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + getattr(settings, 'BOOKING_GROUP_COMMIT_WINDOW', 0.002)
+            max_batch = getattr(settings, 'BOOKING_GROUP_COMMIT_MAX_BATCH', 256)
+            while len(batch) < max_batch:
+                try:
+                    batch.append(self._queue.get(timeout=max(deadline - time.monotonic(), 0)))
+                except queue.Empty:
+                    break
+            self.commit(batch)
+            close_old_connections()
+
+    def commit(self, batch):
+        """
+        Books a batch of (validated_data, future) requests in one
+        transaction, in arrival order, and resolves their futures. If the
+        transaction fails, every request of the batch fails with its error.
+        """
+        from .cache import invalidate_class_listing
+
+        batch = [(data, future) for data, future in batch if future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        try:
+            with serialized_writes(), transaction.atomic():
+                results = self._book([data for data, _ in batch])
+        except Exception as e:
+            logger.error("Group commit of %d bookings failed.", len(batch), exc_info=True)
+            for _, future in batch:
+                future.set_exception(e)
+            return
+
+        booked = sum(1 for booking in results if booking is not None)
+        if booked:
+            # bulk_create and update() bypass post_save.
+            invalidate_class_listing()
+        logger.info("Group commit booked %d of %d requests", booked, len(batch))
+        for (_, future), booking in zip(batch, results):
+            future.set_result(booking)
+
+    @staticmethod
+    def _book(requests):
+        from .models import Booking, FitnessClass
+
+        wanted = Counter(data['fitness_class'].id for data in requests)
+        available = dict(FitnessClass.objects.filter(pk__in=wanted).values_list('id', 'available_slots'))
+        granted = {
+            class_id: min(count, available.get(class_id, 0))
+            for class_id, count in wanted.items() if available.get(class_id)
+        }
+        if granted and not FitnessClass.objects.reserve_slots_many(granted):
+            # Slots were taken since the read (by another process, or from
+            # the slot counter): take what is left of each class instead.
+            granted = {class_id: FitnessClass.objects.reserve_up_to(class_id, count)
+                       for class_id, count in granted.items()}
+
+        results = []
+        for data in requests:
+            class_id = data['fitness_class'].id
+            if granted.get(class_id, 0) > 0:
+                granted[class_id] -= 1
+                results.append(Booking(
+                    fitness_class=data['fitness_class'], client_name=data['client_name'],
+                    client_email=data['client_email'],
+                ))
+            else:
+                results.append(None)
+        Booking.objects.bulk_create([booking for booking in results if booking is not None])
+        return results
+
+
+booking_batcher = BookingBatcher()
@@ -0,0 +1,144 @@
+import uuid
+from bisect import bisect_left
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Max
+from django.utils import timezone
+
+from .models import Deletion, FitnessClass
+from .serializers import FAST_CLASS_VALUES, FitnessClassSerializer, fast_class_rows
+
+GENERATION_KEY = 'booking:classes:generation'
+
+
+def _get_cache():
+    return caches[getattr(settings, 'BOOKING_CACHE_ALIAS', 'default')]
+
+
+def _get_generation(cache):
+    """
+    Returns the token that namespaces the cached listings. Invalidation
+    swaps the token instead of deleting keys, so every timezone variant is
+    dropped at once and an evicted token can never resurrect stale entries.
+    """
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        cache.add(GENERATION_KEY, uuid.uuid4().hex, timeout=None)
+        generation = cache.get(GENERATION_KEY)
+    return generation
+
+
+async def _aget_generation(cache):
+    generation = await cache.aget(GENERATION_KEY)
+    if generation is None:
+        await cache.aadd(GENERATION_KEY, uuid.uuid4().hex, timeout=None)
+        generation = await cache.aget(GENERATION_KEY)
+    return generation
+
+
+def invalidate_class_listing():
+    _get_cache().set(GENERATION_KEY, uuid.uuid4().hex, timeout=None)
+
+
+def _upcoming_queryset(now):
+    queryset = FitnessClass.objects.bookable().filter(start_time__gte=now).order_by('start_time', 'id')
+    if getattr(settings, 'BOOKING_FAST_JSON', False):
+        return queryset.values(*FAST_CLASS_VALUES, 'updated_at')
+    return queryset
+
+
+def _last_started_queryset(now):
+    return FitnessClass.objects.filter(start_time__lt=now)
+
+
+def _build_listing(upcoming_classes, last_started, last_deleted, tz_name):
+    """
+    Turns model instances, or `.values()` rows on the fast path, into the
+    cached (last_modified, entries) pair, where entries are
+    (start_time, id, serialized_class) tuples. A class leaving the listing
+    when it starts, or when it is deleted, counts as a modification then.
+    """
+    if getattr(settings, 'BOOKING_FAST_JSON', False):
+        items = fast_class_rows(upcoming_classes, tz_name)
+        entries = [(row['start_time'], row['id'], item) for row, item in zip(upcoming_classes, items)]
+        updated = [row['updated_at'] for row in upcoming_classes]
+    else:
+        serializer = FitnessClassSerializer(upcoming_classes, many=True, context={'timezone': tz_name})
+        entries = [
+            (fitness_class.start_time, fitness_class.id, item)
+            for fitness_class, item in zip(upcoming_classes, serializer.data)
+        ]
+        updated = [fitness_class.updated_at for fitness_class in upcoming_classes]
+
+    candidates = [value for value in (*updated, last_started, last_deleted) if value is not None]
+    return max(candidates) if candidates else None, entries
+
+
+def _roll_off(listing, now):
+    """
+    Drops entries for classes that started after the listing was cached.
+    Returns None when nothing had to be dropped.
+    """
+    last_modified, entries = listing
+    first_upcoming = bisect_left(entries, now, key=lambda entry: entry[0])
+    if not first_upcoming:
+        return None
+    last_started = entries[first_upcoming - 1][0]
+    return max(last_modified, last_started) if last_modified else last_started, entries[first_upcoming:]
+
+
+def get_upcoming_classes(tz_name):
+    """
+    Returns (entries, last_modified) for the upcoming classes rendered in
+    `tz_name`. Entries are (start_time, id, serialized_class) tuples ordered
+    by start time; last_modified is the time the listing last changed.
+    Classes that have started since the listing was cached are dropped
+    without a rebuild.
+    """
+    cache = _get_cache()
+    timeout = getattr(settings, 'BOOKING_CLASS_CACHE_TIMEOUT', 300)
+    now = timezone.now()
+    key = f'booking:classes:{_get_generation(cache)}:{tz_name}'
+
+    listing = cache.get(key)
+    if listing is None:
+        last_started = _last_started_queryset(now).aggregate(value=Max('start_time'))['value']
+        last_deleted = Deletion.objects.latest_at(Deletion.CLASSES)
+        listing = _build_listing(list(_upcoming_queryset(now)), last_started, last_deleted, tz_name)
+        cache.set(key, listing, timeout)
+    else:
+        rolled_off = _roll_off(listing, now)
+        if rolled_off is not None:
+            listing = rolled_off
+            cache.set(key, listing, timeout)
+
+    last_modified, entries = listing
+    return entries, last_modified
+
+
+async def aget_upcoming_classes(tz_name):
+    """
+    Async version of get_upcoming_classes(), built on the async cache and
+    ORM APIs so it can be awaited from async views.
+    """
+    cache = _get_cache()
+    timeout = getattr(settings, 'BOOKING_CLASS_CACHE_TIMEOUT', 300)
+    now = timezone.now()
+    key = f'booking:classes:{await _aget_generation(cache)}:{tz_name}'
+
+    listing = await cache.aget(key)
+    if listing is None:
+        last_started = (await _last_started_queryset(now).aaggregate(value=Max('start_time')))['value']
+        last_deleted = await Deletion.objects.alatest_at(Deletion.CLASSES)
+        upcoming_classes = [obj async for obj in _upcoming_queryset(now)]
+        listing = _build_listing(upcoming_classes, last_started, last_deleted, tz_name)
+        await cache.aset(key, listing, timeout)
+    else:
+        rolled_off = _roll_off(listing, now)
+        if rolled_off is not None:
+            listing = rolled_off
+            await cache.aset(key, listing, timeout)
+
+    last_modified, entries = listing
+    return entries, last_modified
@@ -0,0 +1,62 @@
+import hashlib
+
+from django.db.models import Count, Max, Q
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+
+def make_etag(*parts):
+    return '"%s"' % hashlib.md5(':'.join(str(part) for part in parts).encode()).hexdigest()
+
+
+def _latest(*values):
+    values = [value for value in values if value is not None]
+    return max(values) if values else None
+
+
+def _booking_aggregates():
+    # The class name is part of each booking's representation, so a change to
+    # a booked class counts as a change to the listing.
+    return {
+        'last_modified': Max('updated_at'),
+        'class_last_modified': Max('fitness_class__updated_at'),
+        'count': Count('id', filter=Q(cancelled_at__isnull=True)),
+    }
+
+
+def booking_list_validators(bookings, email):
+    """
+    Returns (last_modified, count) for the bookings of `email`; the count
+    only includes active bookings. Deleting one of them also counts as a
+    modification.
+    """
+    from .models import Deletion
+
+    result = bookings.aggregate(**_booking_aggregates())
+    deleted_at = Deletion.objects.latest_at(Deletion.bookings_of(email))
+    return _latest(result['last_modified'], result['class_last_modified'], deleted_at), result['count']
+
+
+async def abooking_list_validators(bookings, email):
+    from .models import Deletion
+
+    result = await bookings.aaggregate(**_booking_aggregates())
+    deleted_at = await Deletion.objects.alatest_at(Deletion.bookings_of(email))
+    return _latest(result['last_modified'], result['class_last_modified'], deleted_at), result['count']
+
+
+def not_modified_response(request, etag, last_modified):
+    """
+    Returns a 304 response when the request's If-None-Match or
+    If-Modified-Since validators still match, otherwise None.
+    """
+    return get_conditional_response(
+        request, etag=etag, last_modified=int(last_modified.timestamp()) if last_modified else None
+    )
+
+
+def set_validators(response, etag, last_modified):
+    response['ETag'] = etag
+    if last_modified:
+        response['Last-Modified'] = http_date(last_modified.timestamp())
+    return response
@@ -0,0 +1,43 @@
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connections
+
+# Reentrant, so a write path may call another one that serializes too.
+_write_lock = threading.RLock()
+
+
+@contextmanager
+def serialized_writes():
+    """
+    Runs a booking write transaction while holding the process-wide write
+    lock when BOOKING_SERIALIZE_WRITES is on. SQLite lets one writer in at
+    a time; queueing the writers of this process here, before their
+    transactions begin, makes them wait their turn instead of contending
+    for the database lock and failing with "database is locked".
+    """
+    if not getattr(settings, 'BOOKING_SERIALIZE_WRITES', False):
+        yield
+        return
+    with _write_lock:
+        yield
+
+
+def pool_metrics():
+    """
+    Yields the state of every connection pool (PostgreSQL with
+    BOOKING_DB_POOL) as booking.metrics values. A pool is saturated when it
+    has no idle connections and requests wait for one.
+    """
+    for alias in connections:
+        if not connections.settings[alias].get('OPTIONS', {}).get('pool'):
+            continue
+        stats = connections[alias].pool.get_stats()
+        labels = (('alias', alias),)
+        idle = stats.get('pool_available', 0)
+        yield 'booking_db_pool_connections', labels + (('state', 'idle'),), idle
+        yield 'booking_db_pool_connections', labels + (('state', 'in_use'),), stats.get('pool_size', 0) - idle
+        yield 'booking_db_pool_requests_waiting', labels, stats.get('requests_waiting', 0)
+        yield 'booking_db_pool_wait_seconds_total', labels, stats.get('requests_wait_ms', 0) / 1000
+        yield 'booking_db_pool_errors_total', labels, stats.get('requests_errors', 0)
@@ -0,0 +1,111 @@
+import asyncio
+import json
+import threading
+
+from django.db import transaction
+from django.utils import timezone
+
+
+class SlotSubscriber:
+    """
+    One open stream. Events are coalesced per class, so a slow client only
+    ever holds the latest slot count of each class instead of a backlog.
+    `loop` is given for subscribers consumed from an asyncio event loop.
+    """
+
+    def __init__(self, loop=None):
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._loop = loop
+        self._ready = asyncio.Event() if loop else threading.Event()
+
+    def push(self, event):
+        with self._lock:
+            self._pending[event['id']] = event
+        if self._loop:
+            self._loop.call_soon_threadsafe(self._ready.set)
+        else:
+            self._ready.set()
+
+    def drain(self):
+        with self._lock:
+            self._ready.clear()
+            events = list(self._pending.values())
+            self._pending.clear()
+        return events
+
+    def wait(self, timeout):
+        """
+        Blocks until events arrive or `timeout` seconds pass; returns the
+        pending events (possibly none).
+        """
+        self._ready.wait(timeout)
+        return self.drain()
+
+    async def await_events(self, timeout):
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return self.drain()
+
+
+class SlotEventHub:
+    """
+    In-process fan-out of available_slots changes. The booking write path
+    reports which classes changed; the hub reads their new counts with one
+    query per committed change and pushes them to every open stream, so
+    open connections never query the database themselves. Changes made by
+    other processes are not seen.
+    """
+
+    def __init__(self):
+        self._subscribers = set()
+        self._lock = threading.Lock()
+
+    def subscribe(self, loop=None):
+        subscriber = SlotSubscriber(loop)
+        with self._lock:
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    @property
+    def has_subscribers(self):
+        return bool(self._subscribers)
+
+    def publish(self, events):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for event in events:
+            for subscriber in subscribers:
+                subscriber.push(event)
+
+    def slots_changed(self, class_ids):
+        """
+        Announces that the slot counts of `class_ids` changed. Publishing
+        waits for the surrounding transaction to commit and is skipped
+        entirely while nobody is listening.
+        """
+        if self.has_subscribers:
+            transaction.on_commit(lambda: self._publish_slots(class_ids))
+
+    def _publish_slots(self, class_ids):
+        from .models import FitnessClass
+
+        if not self.has_subscribers:
+            return
+        self.publish(list(
+            FitnessClass.objects.filter(pk__in=list(class_ids), start_time__gte=timezone.now())
+            .values('id', 'available_slots')
+        ))
+
+
+slot_events = SlotEventHub()
+
+
+def format_sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
@@ -0,0 +1,32 @@
+import hashlib
+import json
+
+from rest_framework import status
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+
+
+def invalid_key(key):
+    """
+    Returns the error message for an unusable Idempotency-Key, or None.
+    """
+    if not 0 < len(key) <= MAX_KEY_LENGTH:
+        return f"{IDEMPOTENCY_HEADER} must be 1 to {MAX_KEY_LENGTH} characters long."
+    return None
+
+
+def request_fingerprint(data):
+    return hashlib.sha256(json.dumps(data, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def replayed(record, fingerprint):
+    """
+    Returns the (data, status, headers) answer to a request retried with the
+    key of `record`. Reusing a key for a different request is refused.
+    """
+    if record.fingerprint != fingerprint:
+        return {
+            "message": f"{IDEMPOTENCY_HEADER} was already used for a different request."
+        }, status.HTTP_422_UNPROCESSABLE_ENTITY, {}
+    return record.response, record.status_code, {'Idempotent-Replayed': 'true'}
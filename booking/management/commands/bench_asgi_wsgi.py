@@ -0,0 +1,75 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.test import AsyncClient, Client
+from django.test.utils import override_settings
+
+from booking.urls import async_urlpatterns, sync_urlpatterns
+
+
+class _URLConf:
+    def __init__(self, urlpatterns):
+        self.urlpatterns = urlpatterns
+
+
+def _summary(latencies, elapsed):
+    latencies = sorted(latencies)
+
+    def percentile(p):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
+
+    return (f"{len(latencies) / elapsed:>10,.0f}{percentile(0.5):>10.1f}"
+            f"{percentile(0.95):>10.1f}{percentile(0.99):>10.1f}")
+
+
+class Command(BaseCommand):
+    help = ('Load test a read endpoint in-process: the sync views behind the WSGI handler with a '
+            'fixed thread pool, and the async views behind the ASGI handler on one event loop. '
+            'Reports requests/s and p50/p95/p99 latency in ms. Uses the configured database.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default='/classes/', help='Endpoint to request, including any query string.')
+        parser.add_argument('--requests', type=int, default=2000, help='Requests sent per handler.')
+        parser.add_argument('--concurrency', type=int, default=50, help='Requests in flight at once.')
+        parser.add_argument('--threads', type=int, default=8, help='Worker threads of the WSGI run.')
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{'handler':<10}{'req/s':>10}{'p50':>10}{'p95':>10}{'p99':>10}")
+
+        # Unthrottled, so every request reaches the view.
+        with override_settings(ROOT_URLCONF=_URLConf(sync_urlpatterns), BOOKING_THROTTLE_RATES={}):
+            self.stdout.write(f"{'wsgi':<10}{self.run_wsgi(options)}")
+
+        with override_settings(ROOT_URLCONF=_URLConf(async_urlpatterns), BOOKING_THROTTLE_RATES={}):
+            self.stdout.write(f"{'asgi':<10}{asyncio.run(self.run_asgi(options))}")
+
+    @staticmethod
+    def run_wsgi(options):
+        client = Client()
+
+        def timed_request(_):
+            started = time.perf_counter()
+            client.get(options['path'])
+            return time.perf_counter() - started
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['threads']) as pool:
+            latencies = list(pool.map(timed_request, range(options['requests'])))
+        return _summary(latencies, time.perf_counter() - started)
+
+    @staticmethod
+    async def run_asgi(options):
+        client = AsyncClient()
+        in_flight = asyncio.Semaphore(options['concurrency'])
+
+        async def timed_request():
+            async with in_flight:
+                started = time.perf_counter()
+                await client.get(options['path'])
+                return time.perf_counter() - started
+
+        started = time.perf_counter()
+        latencies = await asyncio.gather(*(timed_request() for _ in range(options['requests'])))
+        return _summary(latencies, time.perf_counter() - started)
@@ -0,0 +1,102 @@
+import itertools
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.test import RequestFactory
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from booking.models import FitnessClass
+
+
+class Command(BaseCommand):
+    help = ('Time GET /classes/, POST /book/ and GET /bookings/ through the WSGI handler, which '
+            'closes connections after each request like a real server: with a new connection per '
+            'request, with persistent connections, and (PostgreSQL with psycopg[pool] only) with a '
+            'connection pool. Reports p50/p95/p99 latency in ms per endpoint and the connections '
+            'opened. Uses the configured database; the bookings it makes are deleted afterwards.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500, help='Requests per endpoint and profile.')
+        parser.add_argument('--threads', type=int, default=8, help='Worker threads.')
+
+    def handle(self, *args, **options):
+        profiles = [
+            ('per-request', {'CONN_MAX_AGE': 0}),
+            ('persistent', {'CONN_MAX_AGE': 600}),
+        ]
+        if connections['default'].vendor == 'postgresql':
+            profiles.append(('pool', {'CONN_MAX_AGE': 0, 'OPTIONS': {'pool': {'min_size': options['threads']}}}))
+        else:
+            self.stdout.write("Connection pools need PostgreSQL; skipping the pool profile.")
+
+        self.stdout.write(f"{'profile':<13}{'endpoint':<16}{'p50':>8}{'p95':>8}{'p99':>8}{'connects':>10}")
+        db_settings = connections.settings['default']
+        original = {key: db_settings.get(key) for key in ('CONN_MAX_AGE', 'OPTIONS')}
+        try:
+            for name, overrides in profiles:
+                connections.close_all()
+                db_settings.update(overrides)
+                # Unthrottled, so every request reaches the database.
+                with override_settings(BOOKING_THROTTLE_RATES={}):
+                    for endpoint, latencies, connects in self.run(options):
+                        self.stdout.write(f"{name:<13}{endpoint:<16}{_percentile(latencies, 0.5):>8.2f}"
+                                          f"{_percentile(latencies, 0.95):>8.2f}"
+                                          f"{_percentile(latencies, 0.99):>8.2f}{connects:>10}")
+                if 'pool' in overrides.get('OPTIONS', {}):
+                    connections['default'].close_pool()
+        finally:
+            connections.close_all()
+            db_settings.update(original)
+
+    @staticmethod
+    def run(options):
+        fitness_class = FitnessClass.objects.create(
+            name="Connection Benchmark", instructor="Bench", start_time=timezone.now() + timedelta(days=1),
+            available_slots=options['requests'],
+        )
+        handler, factory = WSGIHandler(), RequestFactory()
+        numbers = itertools.count()
+        endpoints = {
+            'GET /classes/': lambda: factory.get('/classes/'),
+            'POST /book/': lambda: factory.post('/book/', json.dumps({
+                'fitness_class': fitness_class.name, 'client_name': "Bench",
+                'client_email': f"bench{next(numbers)}@yopmail.com",
+            }), content_type='application/json'),
+            'GET /bookings/': lambda: factory.get('/bookings/', {'email': 'bench0@yopmail.com'}),
+        }
+        connects = [0]
+
+        def count_connect(**kwargs):
+            connects[0] += 1
+
+        def timed_request(make_request):
+            environ = make_request().environ
+            started = time.perf_counter()
+            response = handler(environ, lambda status, headers: None)
+            b''.join(response)
+            response.close()
+            return time.perf_counter() - started
+
+        connection_created.connect(count_connect)
+        try:
+            for endpoint, make_request in endpoints.items():
+                connects[0] = 0
+                with ThreadPoolExecutor(max_workers=options['threads']) as pool:
+                    latencies = list(pool.map(timed_request, [make_request] * options['requests']))
+                yield endpoint, latencies, connects[0]
+        finally:
+            connection_created.disconnect(count_connect)
+            connections.close_all()
+            fitness_class.delete()
+
+
+def _percentile(latencies, p):
+    latencies = sorted(latencies)
+    return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
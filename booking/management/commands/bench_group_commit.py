@@ -0,0 +1,78 @@
+import os
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from functools import partial
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from booking.management.commands.bench_sqlite_writes import scratch_database
+from booking.models import Booking, FitnessClass
+from booking.serializers import BookingSerializer
+from booking.views import batched_booking, save_booking
+
+
+class Command(BaseCommand):
+    help = ('Book concurrently against a scratch SQLite file opened with the production profile, '
+            'once with a transaction per booking (the usual POST /book/ path) and once through the '
+            'group-commit batcher. Reports bookings/s and p50/p99 latency in ms. The configured '
+            'database is not touched.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=32, help='Concurrent clients.')
+        parser.add_argument('--bookings', type=int, default=100, help='Bookings per client.')
+        parser.add_argument('--window-ms', type=float, default=2, help='Group commit collection window.')
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{'path':<16}{'bookings/s':>12}{'p50':>10}{'p99':>10}")
+        for name, group_commit in (('per-request', False), ('group commit', True)):
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                with scratch_database(os.path.join(tmp_dir, 'bench.sqlite3'), settings.SQLITE_PRODUCTION_OPTIONS), \
+                        override_settings(BOOKING_SERIALIZE_WRITES=True, BOOKING_GROUP_COMMIT=group_commit,
+                                          BOOKING_GROUP_COMMIT_WINDOW=options['window_ms'] / 1000):
+                    booked, latencies, elapsed = self.run(options, group_commit)
+            latencies.sort()
+            self.stdout.write(f"{name:<16}{booked / elapsed:>12,.0f}"
+                              f"{latencies[len(latencies) // 2] * 1000:>10.2f}"
+                              f"{latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000:>10.2f}")
+
+    @staticmethod
+    def run(options, group_commit):
+        fitness_class = FitnessClass.objects.create(
+            name="Benchmark Class", instructor="Bench", start_time=timezone.now() + timedelta(days=1),
+            available_slots=options['threads'] * options['bookings'],
+        )
+        latencies, latencies_lock = [], threading.Lock()
+
+        def client(number):
+            mine = []
+            try:
+                for index in range(options['bookings']):
+                    data = {
+                        'fitness_class': fitness_class, 'client_name': "Client",
+                        'client_email': f"client{number}.{index}@yopmail.com",
+                    }
+                    started = time.perf_counter()
+                    if group_commit:
+                        batched_booking(data)
+                    else:
+                        save_booking(partial(BookingSerializer().create, data))
+                    mine.append(time.perf_counter() - started)
+            finally:
+                connections.close_all()
+                with latencies_lock:
+                    latencies.extend(mine)
+
+        threads = [threading.Thread(target=client, args=(number,)) for number in range(options['threads'])]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        return Booking.objects.filter(fitness_class=fitness_class).count(), latencies, elapsed
@@ -0,0 +1,54 @@
+import os
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+
+from booking.management.commands.seed_data import Command as SeedDataCommand
+
+
+class Command(BaseCommand):
+    help = ('Benchmark how many schedule rows per second seed_data reads and converts for each '
+            'supported file format. Nothing is written to the database.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=100000, help='Rows in the generated schedule.')
+        parser.add_argument('--chunk-size', type=int, default=5000, help='Rows read and converted at a time.')
+
+    def handle(self, *args, **options):
+        import pandas as pd
+
+        rows = options['rows']
+        start_times = pd.date_range('2030-01-01 06:00', periods=rows, freq='30min')
+        schedule = pd.DataFrame({
+            'Class Name': [f"Class {i % 40}" for i in range(rows)],
+            'Start Time': start_times.strftime('%Y-%m-%d %H:%M:%S'),
+            'Instructor': [f"Instructor {i % 15}" for i in range(rows)],
+            'Available Slots': [10 + i % 20 for i in range(rows)],
+        })
+
+        writers = {
+            'csv': lambda path: schedule.to_csv(path, index=False),
+            'jsonl': lambda path: schedule.to_json(path, orient='records', lines=True),
+            # Parquet keeps the start time as a native timestamp column.
+            'parquet': lambda path: schedule.assign(**{'Start Time': start_times}).to_parquet(path, index=False),
+            'xlsx': lambda path: schedule.to_excel(path, index=False),
+        }
+
+        self.stdout.write(f"{'format':<10}{'rows':>10}{'seconds':>10}{'rows/s':>12}")
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for extension, write in writers.items():
+                path = os.path.join(tmp_dir, f"classes.{extension}")
+                try:
+                    write(path)
+                except ImportError as e:
+                    self.stdout.write(f"{extension:<10}skipped ({e})")
+                    continue
+
+                started = time.perf_counter()
+                converted = 0
+                for chunk in SeedDataCommand.read_chunks(path, options['chunk_size']):
+                    class_objects, _ = SeedDataCommand.build_classes(chunk, 'Asia/Kolkata')
+                    converted += len(class_objects)
+                elapsed = time.perf_counter() - started
+                self.stdout.write(f"{extension:<10}{converted:>10}{elapsed:>10.2f}{converted / elapsed:>12,.0f}")
@@ -0,0 +1,108 @@
+import os
+import random
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connections
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from booking.db import serialized_writes
+from booking.models import Booking, FitnessClass
+from booking.serializers import BookingSerializer
+
+
+@contextmanager
+def scratch_database(path, db_options):
+    """
+    Points the default alias at a new, migrated SQLite file opened with
+    `db_options`, for every thread, and restores the settings on exit.
+    """
+    connections.close_all()
+    db_settings = connections.settings['default']
+    original = {key: db_settings.get(key) for key in ('NAME', 'OPTIONS')}
+    db_settings.update(NAME=path, OPTIONS=dict(db_options))
+    try:
+        call_command('migrate', verbosity=0)
+        yield
+    finally:
+        connections.close_all()
+        db_settings.update(original)
+
+
+class Command(BaseCommand):
+    help = ('Run concurrent bookings, cancellations and booking-list reads against a scratch SQLite '
+            'file, with stock SQLite settings and with the production profile '
+            '(SQLITE_PRODUCTION_OPTIONS plus serialized writes). Reports operations/s and how many '
+            'operations failed with "database is locked". The configured database is not touched.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=16, help='Concurrent clients.')
+        parser.add_argument('--operations', type=int, default=200, help='Operations per client.')
+        parser.add_argument('--write-ratio', type=float, default=0.5,
+                            help='Share of operations that book or cancel; the rest read.')
+
+    def handle(self, *args, **options):
+        profiles = [
+            ('stock', {}, False),
+            ('production', settings.SQLITE_PRODUCTION_OPTIONS, True),
+        ]
+        self.stdout.write(f"{'profile':<12}{'ops/s':>10}{'locked':>10}{'error %':>10}")
+        for name, db_options, serialize in profiles:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                with scratch_database(os.path.join(tmp_dir, 'bench.sqlite3'), db_options), \
+                        override_settings(BOOKING_SERIALIZE_WRITES=serialize):
+                    operations, locked, elapsed = self.run(options)
+            self.stdout.write(f"{name:<12}{operations / elapsed:>10,.0f}{locked:>10}"
+                              f"{locked / operations * 100:>10.1f}")
+
+    @staticmethod
+    def run(options):
+        fitness_class = FitnessClass.objects.create(
+            name="Benchmark Class", instructor="Bench", start_time=timezone.now() + timedelta(days=1),
+            available_slots=options['threads'] * options['operations'],
+        )
+        counts = {'operations': 0, 'locked': 0}
+        counts_lock = threading.Lock()
+
+        def client(number):
+            rng = random.Random(number)
+            email = f"client{number}@yopmail.com"
+            mine = []
+            try:
+                for _ in range(options['operations']):
+                    locked = 0
+                    try:
+                        if rng.random() >= options['write_ratio']:
+                            list(Booking.objects.active().for_email(email)[:10])
+                        elif mine and rng.random() < 0.5:
+                            with serialized_writes():
+                                Booking.objects.filter(pk=mine.pop()).cancel()
+                        else:
+                            with serialized_writes():
+                                mine.append(BookingSerializer().create({
+                                    'fitness_class': fitness_class, 'client_name': "Client", 'client_email': email,
+                                }).pk)
+                    except OperationalError as e:
+                        if 'locked' not in str(e):
+                            raise
+                        locked = 1
+                    with counts_lock:
+                        counts['operations'] += 1
+                        counts['locked'] += locked
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=client, args=(number,)) for number in range(options['threads'])]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return counts['operations'], counts['locked'], time.perf_counter() - started
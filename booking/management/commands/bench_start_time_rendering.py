@@ -0,0 +1,52 @@
+import time
+from datetime import timedelta
+from unittest import mock
+
+import pytz
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from booking.models import FitnessClass
+from booking.serializers import FitnessClassSerializer
+
+
+class Command(BaseCommand):
+    help = ('Time start_time rendering of a class listing: per-row timezone lookup and formatting '
+            'against the batched list serializer path. Runs on unsaved classes; the database is not '
+            'touched. Reports microseconds per row, best of --repeat runs.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=2000, help='Classes in the listing.')
+        parser.add_argument('--distinct', type=int, default=None,
+                            help='Distinct start times among them (default: every class its own).')
+        parser.add_argument('--timezone', default='America/New_York')
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        rows, tz_name = options['rows'], options['timezone']
+        distinct = options['distinct'] or rows
+        base = timezone.now().replace(second=0, microsecond=0)
+        classes = [
+            FitnessClass(id=i, name=f"Class {i}", instructor="Alice", available_slots=10,
+                         start_time=base + timedelta(minutes=15 * (i % distinct)))
+            for i in range(rows)
+        ]
+
+        def per_row():
+            for obj in classes:
+                obj.start_time.astimezone(pytz.timezone(tz_name)).strftime('%Y-%m-%d %H:%M:%S %Z')
+
+        def batched():
+            # Only the start_time work: the serializer renders other fields too.
+            with mock.patch.object(FitnessClassSerializer, 'to_representation',
+                                   lambda self, obj: {'start_time': self.get_start_time(obj)}):
+                FitnessClassSerializer(classes, many=True, context={'timezone': tz_name}).data
+
+        self.stdout.write(f"{rows} rows, {distinct} distinct start times")
+        for name, render in (('per-row', per_row), ('batched', batched)):
+            timings = []
+            for _ in range(options['repeat']):
+                started = time.perf_counter()
+                render()
+                timings.append(time.perf_counter() - started)
+            self.stdout.write(f"{name:<10}{min(timings) / rows * 1e6:>10.2f} us/row")
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from booking.models import IdempotencyKey
+from booking.utils import CustomLogger
+
+logger = CustomLogger(__name__).get_custom_logger()
+
+
+class Command(BaseCommand):
+    help = ('Delete stored Idempotency-Key answers older than BOOKING_IDEMPOTENCY_TTL. '
+            'Meant to be run periodically, e.g. hourly from cron.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000,
+                            help='Keys deleted per DELETE statement, to keep write locks short.')
+
+    def handle(self, *args, **options):
+        purged = 0
+        while True:
+            keys = list(IdempotencyKey.objects.expired().values_list('pk', flat=True)[:options['batch_size']])
+            if not keys:
+                break
+            purged += IdempotencyKey.objects.filter(pk__in=keys).delete()[0]
+        logger.info("Purged %d expired idempotency keys.", purged)
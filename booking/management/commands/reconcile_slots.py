@@ -0,0 +1,24 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from booking.slots import reservations
+from booking.utils import CustomLogger
+
+logger = CustomLogger(__name__).get_custom_logger()
+
+
+class Command(BaseCommand):
+    help = ('Reload the shared slot counters of BOOKING_SLOT_COUNTER=cache from the database: '
+            'available_slots of every upcoming class within BOOKING_SLOT_COUNTER_HORIZON. Bookings '
+            'left unflushed by workers that died are forgotten, so run it on deploy, before the '
+            'workers start.')
+
+    def handle(self, *args, **options):
+        kind = getattr(settings, 'BOOKING_SLOT_COUNTER', None)
+        if not kind:
+            raise CommandError("BOOKING_SLOT_COUNTER is not set; there are no slot counters to reconcile.")
+        if kind == 'memory':
+            raise CommandError("The memory slot counters live in each worker process and are reloaded when "
+                               "the workers start; only BOOKING_SLOT_COUNTER=cache can be reconciled from here.")
+        counts = reservations.reconcile(drop_pending=True)
+        logger.info("Reconciled the slot counters of %d classes.", len(counts))
@@ -0,0 +1,36 @@
+import sqlite3
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from booking.utils import CustomLogger
+
+logger = CustomLogger(__name__).get_custom_logger()
+
+
+class Command(BaseCommand):
+    help = ('Copy the primary SQLite database over every BOOKING_READ_REPLICAS SQLite file, using '
+            'SQLite\'s online backup so the primary stays usable. For local testing of the replica '
+            'router; real replicas are kept in sync by the database server.')
+
+    def handle(self, *args, **options):
+        primary = connections['default'].settings_dict
+        if primary['ENGINE'] != 'django.db.backends.sqlite3':
+            raise CommandError("refresh_replicas only copies SQLite databases.")
+
+        source = sqlite3.connect(primary['NAME'])
+        try:
+            for alias in getattr(settings, 'BOOKING_READ_REPLICAS', []):
+                replica = connections[alias].settings_dict
+                if replica['ENGINE'] != 'django.db.backends.sqlite3':
+                    raise CommandError(f"Replica {alias} is not an SQLite database.")
+                connections[alias].close()
+                target = sqlite3.connect(replica['NAME'])
+                try:
+                    source.backup(target)
+                finally:
+                    target.close()
+                logger.info("Refreshed replica %s from the primary database.", alias)
+        finally:
+            source.close()
@@ -1,53 +1,235 @@
-import pandas as pd
-from django.core.management.base import BaseCommand
-from booking.models import FitnessClass
-import pytz
+from itertools import islice
 import os
+
+from django.core.management.base import BaseCommand
+from django.db import models, transaction
+from django.db.models import Case, F, Value, When
+from django.db.models.functions import Greatest
+from django.utils import timezone
+from booking.cache import invalidate_class_listing
+from booking.events import slot_events
+from booking.models import FitnessClass, WaitlistEntry
+from booking.slots import reservations
 from booking.utils import CustomLogger
 
+# pandas, openpyxl and pyarrow are imported inside the readers so that
+# loading the command registry (every manage.py call) stays cheap.
+
 logger = CustomLogger(__name__).get_custom_logger()
 
+REQUIRED_COLUMNS = {'Class Name', 'Start Time', 'Instructor', 'Available Slots'}
+
 
 class Command(BaseCommand):
-    help = 'Import fitness classes from an Excel file using bulk create.'
+    help = ('Import fitness classes from a CSV, Parquet, JSON Lines or Excel file in chunks '
+            'using batched bulk create.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--file', default='booking/script_data/classes_data.xlsx',
+                            help='Path of the schedule to import. The format is picked from the '
+                                 'extension (.csv, .parquet, .jsonl/.ndjson), anything else is read as Excel.')
+        parser.add_argument('--timezone', default='Asia/Kolkata',
+                            help='Timezone the start times in the file are written in.')
+        parser.add_argument('--chunk-size', type=int, default=5000,
+                            help='Rows read from the file and converted at a time.')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Rows per INSERT/UPDATE issued by bulk_create and bulk_update.')
+        parser.add_argument('--upsert', action='store_true',
+                            help='Sync instead of append: classes are matched on (name, start time, '
+                                 'instructor), changed ones are updated and only new ones inserted.')
 
-    def handle(self, *args, **kwargs):
-        excel_path = "booking/script_data/classes_data.xlsx"
+    def handle(self, *args, **options):
+        path = options['file']
 
-        if not os.path.exists(excel_path):
-            logger.error(f"File not found: {excel_path}")
+        if not os.path.exists(path):
+            logger.error("File not found: %s", path)
             return
 
+        imported = updated = unchanged = skipped = 0
         try:
-            df = pd.read_excel(excel_path)
-
-            required_columns = {'Class Name', 'Start Time', 'Instructor', 'Available Slots'}
-            if not required_columns.issubset(df.columns):
-                logger.error(f"Missing required columns. Required: {required_columns}")
-                return
-
-            class_objects = []
-            for _, row in df.iterrows():
-                try:
-                    ist_time = pd.to_datetime(row['Start Time'])
-                    utc_time = ist_time.tz_localize('Asia/Kolkata').astimezone(pytz.UTC)
-
-                    class_objects.append(
-                        FitnessClass(
-                            name=row['Class Name'],
-                            start_time=utc_time,
-                            instructor=row['Instructor'],
-                            available_slots=int(row['Available Slots'])
-                        )
-                    )
-                except Exception as e:
-                    logger.error(f"Skipping row due to error: {str(e)}")
-
-            if class_objects:
-                FitnessClass.objects.bulk_create(class_objects)
-                logger.info(f"{len(class_objects)} classes imported successfully.")
-            else:
-                logger.warning("No valid rows to import.")
+            for chunk in self.read_chunks(path, options['chunk_size']):
+                class_objects, invalid = self.build_classes(chunk, options['timezone'])
+                skipped += invalid
+                with transaction.atomic():
+                    if options['upsert']:
+                        counts = self.upsert_classes(class_objects, options['batch_size'])
+                        imported += counts[0]
+                        updated += counts[1]
+                        unchanged += counts[2]
+                    else:
+                        FitnessClass.objects.bulk_create(class_objects, batch_size=options['batch_size'])
+                        imported += len(class_objects)
 
+        except ValueError as e:
+            logger.error("%s", e)
+            return
         except Exception as e:
-            logger.error(f"Error while reading Excel file: {e}")
+            logger.error("Error while reading schedule file: %s", e)
+            return
+        finally:
+            if imported or updated:
+                # bulk_create and bulk_update bypass post_save, so the listing is invalidated here.
+                invalidate_class_listing()
+
+        if skipped:
+            logger.error("Skipped %d rows with a missing or invalid value.", skipped)
+        if options['upsert']:
+            logger.info("Schedule synced: %d inserted, %d updated, %d unchanged.", imported, updated, unchanged)
+        elif imported:
+            logger.info("%d classes imported successfully.", imported)
+        else:
+            logger.warning("No valid rows to import.")
+
+    @classmethod
+    def read_chunks(cls, path, chunk_size):
+        """
+        Streams the schedule as DataFrames of at most `chunk_size` rows,
+        without loading the whole file into memory.
+        """
+        extension = os.path.splitext(path)[1].lower()
+        reader = {
+            '.csv': cls._read_csv,
+            '.parquet': cls._read_parquet,
+            '.jsonl': cls._read_json_lines,
+            '.ndjson': cls._read_json_lines,
+        }.get(extension, cls._read_excel)
+
+        for chunk in reader(path, chunk_size):
+            if not REQUIRED_COLUMNS.issubset(chunk.columns):
+                raise ValueError(f"Missing required columns. Required: {REQUIRED_COLUMNS}")
+            yield chunk
+
+    @staticmethod
+    def _read_csv(path, chunk_size):
+        import pandas as pd
+
+        with pd.read_csv(path, chunksize=chunk_size) as reader:
+            yield from reader
+
+    @staticmethod
+    def _read_json_lines(path, chunk_size):
+        import pandas as pd
+
+        with pd.read_json(path, lines=True, chunksize=chunk_size, convert_dates=False, dtype=False) as reader:
+            yield from reader
+
+    @staticmethod
+    def _read_parquet(path, chunk_size):
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ValueError("Reading Parquet files requires pyarrow (pip install pyarrow).")
+
+        parquet_file = pq.ParquetFile(path)
+        for batch in parquet_file.iter_batches(batch_size=chunk_size):
+            yield batch.to_pandas()
+
+    @staticmethod
+    def _read_excel(path, chunk_size):
+        import openpyxl
+        import pandas as pd
+
+        workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+        try:
+            rows = workbook.active.iter_rows(values_only=True)
+            header = next(rows, ())
+            while True:
+                chunk = list(islice(rows, chunk_size))
+                if not chunk:
+                    break
+                yield pd.DataFrame(chunk, columns=header)
+        finally:
+            workbook.close()
+
+    @staticmethod
+    def build_classes(df, source_tz):
+        """
+        Converts a chunk column-wise: start times are parsed, localized from
+        `source_tz` and converted to UTC in one vectorized step. Rows with a
+        missing or unparsable value are dropped and counted.
+        """
+        import pandas as pd
+
+        # Without format='mixed' pandas infers the format from the first value
+        # and coerces every row written differently to NaT.
+        start_times = pd.to_datetime(df['Start Time'], errors='coerce', format='mixed')
+        if start_times.dt.tz is None:
+            start_times = start_times.dt.tz_localize(source_tz, ambiguous='NaT', nonexistent='NaT')
+        start_times = start_times.dt.tz_convert('UTC')
+        slots = pd.to_numeric(df['Available Slots'], errors='coerce')
+
+        valid = (start_times.notna() & slots.notna() & (slots >= 0)
+                 & df['Class Name'].notna() & df['Instructor'].notna())
+
+        class_objects = [
+            FitnessClass(name=name, start_time=start_time, instructor=instructor,
+                         available_slots=int(available), capacity=int(available))
+            for name, start_time, instructor, available in zip(
+                df['Class Name'][valid], start_times[valid].dt.to_pydatetime(),
+                df['Instructor'][valid], slots[valid],
+            )
+        ]
+        return class_objects, int((~valid).sum())
+
+    @staticmethod
+    def upsert_classes(class_objects, batch_size):
+        """
+        Applies one chunk keyed on (name, start_time, instructor): a single
+        lookup query for the chunk, then bulk_update for classes whose
+        capacity changed and bulk_create for new ones. Returns the inserted,
+        updated and unchanged counts.
+
+        The file's slot count is the class's capacity. A changed capacity
+        moves available_slots by the difference in the database, floored at
+        0, so bookings made meanwhile are neither undone nor oversold.
+        Called-off classes are left as they are.
+        """
+        # The last row wins when the file lists the same class twice.
+        incoming = {(obj.name, obj.start_time, obj.instructor): obj for obj in class_objects}
+        if not incoming:
+            return 0, 0, 0
+
+        start_times = [key[1] for key in incoming]
+        existing = {}
+        candidates = FitnessClass.objects.filter(
+            start_time__range=(min(start_times), max(start_times)),
+            name__in={key[0] for key in incoming},
+        ).order_by('id')
+        for fitness_class in candidates:
+            existing.setdefault((fitness_class.name, fitness_class.start_time, fitness_class.instructor), fitness_class)
+
+        to_create, to_update, grown = [], [], []
+        now = timezone.now()
+        for key, obj in incoming.items():
+            current = existing.get(key)
+            if current is None:
+                to_create.append(obj)
+            elif current.called_off_at is None and current.capacity != obj.capacity:
+                added = obj.capacity - current.capacity
+                if added > 0:
+                    grown.append(current)
+                # A class called off since it was read keeps its 0 slots.
+                current.available_slots = Case(
+                    When(called_off_at__isnull=True, then=Greatest(F('available_slots') + added, Value(0))),
+                    default=F('available_slots'),
+                    output_field=models.PositiveIntegerField(),
+                )
+                current.capacity = obj.capacity
+                current.updated_at = now
+                to_update.append(current)
+
+        FitnessClass.objects.bulk_create(to_create, batch_size=batch_size)
+        FitnessClass.objects.bulk_update(
+            to_update, ['available_slots', 'capacity', 'updated_at'], batch_size=batch_size
+        )
+        if to_update:
+            slot_events.slots_changed([obj.pk for obj in to_update])
+        # bulk_create and bulk_update bypass post_save; hold or reload the
+        # slot counters of these classes before promoting their waitlists.
+        reservations.reconcile([obj.pk for obj in to_create + to_update])
+        if grown:
+            # Added slots go to the waitlisted clients first.
+            waiting = WaitlistEntry.objects.filter(fitness_class__in=grown).values_list('fitness_class_id', flat=True)
+            for class_id in set(waiting):
+                WaitlistEntry.objects.promote(class_id)
+        return len(to_create), len(to_update), len(incoming) - len(to_create) - len(to_update)
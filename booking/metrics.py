@@ -0,0 +1,168 @@
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+# name: (type, help, histogram buckets)
+METRICS = {
+    'booking_requests_total': ('counter', "Requests handled, by view, method and status.", None),
+    'booking_request_duration_seconds': ('histogram', "Time spent handling a request.", LATENCY_BUCKETS),
+    'booking_render_duration_seconds': ('histogram', "Time spent rendering a response body.", LATENCY_BUCKETS),
+    'booking_db_queries': ('histogram', "Database queries made per request.", QUERY_COUNT_BUCKETS),
+    'booking_db_query_duration_seconds_total': ('counter', "Time spent in database queries.", None),
+    'booking_response_size_bytes': ('histogram', "Size of response bodies.", SIZE_BUCKETS),
+    'booking_db_connections_total': (
+        'counter', "Database connections opened, or checked out of a pool, by alias.", None,
+    ),
+    'booking_db_pool_connections': ('gauge', "Connections held by the pool, by alias and state.", None),
+    'booking_db_pool_requests_waiting': ('gauge', "Requests waiting for a pooled connection.", None),
+    'booking_db_pool_wait_seconds_total': ('counter', "Time requests spent waiting for a pooled connection.", None),
+    'booking_db_pool_errors_total': (
+        'counter', "Requests that got no pooled connection (timed out or queue full).", None,
+    ),
+}
+
+
+class _Shard:
+    """
+    The metrics recorded by one thread. Only its own thread writes to it.
+    """
+    __slots__ = ('counters', 'histograms')
+
+    def __init__(self):
+        self.counters = defaultdict(float)
+        # (name, labels) -> [count per bucket..., count above the last bucket, sum]
+        self.histograms = {}
+
+
+class MetricsRegistry:
+    """
+    Counters and histograms aggregated per thread: recording a value only
+    touches the calling thread's shard, so the request path never takes a
+    lock. The shards are merged when the metrics are collected, and those
+    of finished threads are folded into a base shard so that servers
+    starting a thread per request do not keep one shard per thread ever
+    seen.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._shards = []
+        self._base = _Shard()
+        self._lock = threading.Lock()
+        self._collectors = []
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = _Shard()
+            # Taken once per thread, never per request.
+            with self._lock:
+                self._merge_finished_shards()
+                self._shards.append((threading.current_thread(), shard))
+        return shard
+
+    def _merge_finished_shards(self):
+        # Called with the lock held. A finished thread no longer writes to
+        # its shard, so it can be read without racing.
+        alive = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                alive.append((thread, shard))
+            else:
+                _merge(self._base.counters, self._base.histograms, shard)
+        self._shards = alive
+
+    def add_collector(self, collector):
+        """
+        Registers a callable returning (name, labels, value) tuples, read at
+        collection time, for values kept elsewhere (e.g. connection pools).
+        """
+        self._collectors.append(collector)
+
+    def inc(self, name, labels, value=1):
+        self._shard().counters[name, labels] += value
+
+    def observe(self, name, labels, value):
+        buckets = METRICS[name][2]
+        histograms = self._shard().histograms
+        histogram = histograms.get((name, labels))
+        if histogram is None:
+            histogram = histograms[name, labels] = [0] * (len(buckets) + 1) + [0.0]
+        histogram[bisect_left(buckets, value)] += 1
+        histogram[-1] += value
+
+    def collect(self):
+        """
+        Returns the counters (and gauges) and histograms summed over every
+        thread, plus the values of the collectors.
+        """
+        counters, histograms = defaultdict(float), {}
+        with self._lock:
+            self._merge_finished_shards()
+            _merge(counters, histograms, self._base)
+            shards = [shard for _, shard in self._shards]
+        for shard in shards:
+            _merge(counters, histograms, shard)
+        for collector in self._collectors:
+            for name, labels, value in collector():
+                counters[name, labels] += value
+        return counters, histograms
+
+    def render(self):
+        """
+        Returns every metric in the Prometheus text exposition format.
+        """
+        counters, histograms = self.collect()
+        lines = []
+        for name, (metric_type, help_text, buckets) in METRICS.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            if metric_type in ('counter', 'gauge'):
+                for (metric, labels), value in sorted(counters.items()):
+                    if metric == name:
+                        lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+                continue
+
+            for (metric, labels), values in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(buckets + ('+Inf',), values):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_format_labels(labels + (('le', bound),))} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(values[-1])}")
+                lines.append(f"{name}_count{_format_labels(labels)} {cumulative}")
+        return '\n'.join(lines) + '\n'
+
+
+def _merge(counters, histograms, shard):
+    """
+    Adds the values of `shard` to `counters` and `histograms`.
+    """
+    for key, value in list(shard.counters.items()):
+        counters[key] += value
+    for key, values in list(shard.histograms.items()):
+        merged = histograms.setdefault(key, [0] * len(values))
+        for index, value in enumerate(list(values)):
+            merged[index] += value
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    pairs = ','.join(
+        '%s="%s"' % (key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in labels
+    )
+    return '{%s}' % pairs
+
+
+def _format_value(value):
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+registry = MetricsRegistry()
@@ -0,0 +1,159 @@
+import time
+from contextlib import nullcontext
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from booking.metrics import registry
+from booking.routers import pin_to_primary
+from booking.utils import CustomLogger
+
+logger = CustomLogger(__name__).get_custom_logger()
+
+
+class QueryStats:
+    """
+    The queries of one request and the time spent in them.
+    """
+    __slots__ = ('count', 'duration')
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+
+# Context-local, so queries that async views run through sync_to_async (in
+# another thread, on another connection) are counted for their request too.
+current_query_stats = ContextVar('current_query_stats', default=None)
+
+
+def record_query(execute, sql, params, many, context):
+    """
+    Database execute wrapper, installed on every connection by
+    booking.signals, that adds each query to the current request's
+    QueryStats.
+    """
+    stats = current_query_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.duration += time.perf_counter() - start
+        stats.count += 1
+
+
+class RequestMetricsMiddleware:
+    """
+    Records, per view: request latency, database queries and the time spent
+    in them, response rendering time and response size; see
+    booking.metrics. Requests slower than BOOKING_SLOW_REQUEST_MS are
+    logged with the same figures.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        start, queries = time.perf_counter(), QueryStats()
+        token = current_query_stats.set(queries)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_query_stats.reset(token)
+        self.record(request, response, time.perf_counter() - start, queries)
+        return response
+
+    async def __acall__(self, request):
+        start, queries = time.perf_counter(), QueryStats()
+        token = current_query_stats.set(queries)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_query_stats.reset(token)
+        self.record(request, response, time.perf_counter() - start, queries)
+        return response
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered after this hook; time the rendering.
+        render_start = time.perf_counter()
+
+        def rendered(response):
+            response.render_duration = time.perf_counter() - render_start
+
+        response.add_post_render_callback(rendered)
+        return response
+
+    @staticmethod
+    def record(request, response, duration, queries):
+        match = request.resolver_match
+        view = match.view_name if match else 'unmatched'
+        labels = (('view', view), ('method', request.method))
+        size = None if response.streaming else len(response.content)
+
+        registry.inc('booking_requests_total', labels + (('status', response.status_code),))
+        registry.observe('booking_request_duration_seconds', labels, duration)
+        registry.observe('booking_db_queries', labels, queries.count)
+        registry.inc('booking_db_query_duration_seconds_total', labels, queries.duration)
+        render_duration = getattr(response, 'render_duration', None)
+        if render_duration is not None:
+            registry.observe('booking_render_duration_seconds', labels, render_duration)
+        if size is not None:
+            registry.observe('booking_response_size_bytes', labels, size)
+
+        slow_ms = getattr(settings, 'BOOKING_SLOW_REQUEST_MS', None)
+        if slow_ms is not None and duration * 1000 >= slow_ms:
+            logger.warning(
+                "Slow request %s %s (%s): %.1f ms, %d queries in %.1f ms, rendered in %.1f ms, %s bytes",
+                request.method, request.get_full_path(), view, duration * 1000, queries.count,
+                queries.duration * 1000, (render_duration or 0) * 1000, size,
+            )
+
+
+class PrimaryPinningMiddleware:
+    """
+    After a successful write (any unsafe method), sets a cookie that pins
+    the client to the primary database for BOOKING_PRIMARY_PIN_SECONDS, so
+    reads served from lagging replicas never hide their own bookings.
+    """
+    cookie_name = 'booking_pin_primary'
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        with self.pinning(request):
+            response = self.get_response(request)
+        return self.remember_write(request, response)
+
+    async def __acall__(self, request):
+        with self.pinning(request):
+            response = await self.get_response(request)
+        return self.remember_write(request, response)
+
+    def pinning(self, request):
+        return pin_to_primary() if self.cookie_name in request.COOKIES else nullcontext()
+
+    def remember_write(self, request, response):
+        if request.method not in ('GET', 'HEAD', 'OPTIONS', 'TRACE') and response.status_code < 400:
+            response.set_cookie(
+                self.cookie_name, '1', max_age=getattr(settings, 'BOOKING_PRIMARY_PIN_SECONDS', 10),
+                httponly=True, samesite='Lax',
+            )
+        return response
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.2 on 2026-10-18 18:01
+
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('booking', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(django.db.models.functions.text.Lower('client_email'), models.F('booked_at'), models.F('id'), name='booking_email_lower_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='fitnessclass',
+            index=models.Index(fields=['start_time', 'id'], name='fitnessclass_start_time_idx'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.2 on 2026-10-18 18:14
+
+import django.db.models.deletion
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('booking', '0003_booking_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WaitlistEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('client_name', models.CharField(max_length=100)),
+                ('client_email', models.EmailField(max_length=254)),
+                ('joined_at', models.DateTimeField(auto_now_add=True)),
+                ('fitness_class', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='waitlist', to='booking.fitnessclass')),
+            ],
+            options={
+                'ordering': ['id'],
+                'indexes': [models.Index(fields=['fitness_class', 'id'], name='waitlist_queue_idx')],
+                'constraints': [models.UniqueConstraint(models.F('fitness_class'), django.db.models.functions.text.Lower('client_email'), name='waitlist_unique_client')],
+            },
+        ),
+    ]
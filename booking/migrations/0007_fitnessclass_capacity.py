@@ -0,0 +1,37 @@
+# Generated by Django 5.2.2 on 2026-10-18 21:40
+
+from django.db import migrations, models
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def fill_capacity(apps, schema_editor):
+    # A class's capacity is what is left plus what is booked.
+    FitnessClass = apps.get_model('booking', 'FitnessClass')
+    Booking = apps.get_model('booking', 'Booking')
+    booked = Booking.objects.filter(fitness_class=OuterRef('pk'), cancelled_at__isnull=True).order_by().values(
+        'fitness_class').annotate(count=Count('id')).values('count')
+    FitnessClass.objects.filter(capacity__isnull=True).update(
+        capacity=F('available_slots') + Coalesce(Subquery(booked), Value(0))
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('booking', '0006_idempotencykey'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fitnessclass',
+            name='capacity',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.RunPython(fill_capacity, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='fitnessclass',
+            name='capacity',
+            field=models.PositiveIntegerField(blank=True),
+        ),
+    ]
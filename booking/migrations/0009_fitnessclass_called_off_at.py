@@ -0,0 +1,18 @@
+# Generated by Django 5.2.2 on 2026-10-18 18:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('booking', '0008_deletion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fitnessclass',
+            name='called_off_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
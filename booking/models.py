@@ -1,21 +1,379 @@
-from django.db import models
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, models, transaction
+from django.db.models import Case, Count, F, OuterRef, Q, Subquery, Value, When
+from django.db.models.functions import Lower
+from django.utils import timezone
+
+from .events import slot_events
+from .slots import reservations
+
+
+class FitnessClassQuerySet(models.QuerySet):
+
+    def bookable(self):
+        return self.filter(called_off_at__isnull=True)
+
+    def reserve_slots(self, class_id, count=1):
+        """
+        Atomically takes `count` slots from a class. Returns False when the
+        class does not have enough slots left or was called off; the row is
+        never read first. Classes held by the slot counter (booking.slots)
+        are checked there.
+        """
+        taken = reservations.take(class_id, count)
+        if taken is False:
+            return False
+        updated = self.bookable().filter(pk=class_id, available_slots__gte=count).update(
+            available_slots=F('available_slots') - count,
+            updated_at=timezone.now(),
+        )
+        if updated:
+            slot_events.slots_changed([class_id])
+        elif taken:
+            reservations.give(class_id, count)
+        return updated == 1
+
+    def release_slots(self, class_id, count=1):
+        """
+        Atomically gives `count` slots back to a class, unless it was called
+        off.
+        """
+        updated = self.bookable().filter(pk=class_id).update(
+            available_slots=F('available_slots') + count,
+            updated_at=timezone.now(),
+        )
+        if updated:
+            slot_events.slots_changed([class_id])
+            reservations.release(class_id, count)
+        return updated == 1
+
+    def reserve_slots_many(self, counts):
+        """
+        Takes counts[class_id] slots from each class with a single UPDATE.
+        All-or-nothing: if any class lacks capacity or was called off
+        nothing is taken and False is returned.
+        """
+        taken = reservations.take_many(counts)
+        if taken is False:
+            return False
+        guard = Q()
+        for class_id, count in counts.items():
+            guard |= Q(pk=class_id, available_slots__gte=count)
+        with transaction.atomic():
+            updated = self.bookable().filter(guard).update(
+                available_slots=Case(
+                    *[When(pk=class_id, then=F('available_slots') - count) for class_id, count in counts.items()],
+                    default=F('available_slots'),
+                    output_field=models.PositiveIntegerField(),
+                ),
+                updated_at=timezone.now(),
+            )
+            if updated != len(counts):
+                transaction.set_rollback(True)
+        if updated == len(counts):
+            slot_events.slots_changed(list(counts))
+        else:
+            reservations.give_many(taken)
+        return updated == len(counts)
+
+    def reserve_up_to(self, class_id, count, attempts=5):
+        """
+        Takes as many of `count` slots as the class still has and returns how
+        many were taken.
+        """
+        for _ in range(attempts):
+            if count < 1 or self.reserve_slots(class_id, count):
+                return max(count, 0)
+            available = self.filter(pk=class_id).values_list('available_slots', flat=True).first()
+            held = reservations.available(class_id)
+            count = min(count, (available if held is None else held) or 0)
+        return 0
+
+    def call_off(self):
+        """
+        Calls off the classes in this queryset: they leave the listing and
+        can no longer be booked, their bookings are cancelled without
+        promoting anyone and their waitlists are dropped. Returns how many
+        bookings were cancelled.
+        """
+        now = timezone.now()
+        with transaction.atomic():
+            class_ids = list(self.bookable().values_list('id', flat=True))
+            # Marked first, so the cancellations below give no slot back.
+            FitnessClass.objects.filter(pk__in=class_ids).update(called_off_at=now, available_slots=0, updated_at=now)
+            cancelled = Booking.objects.filter(fitness_class_id__in=class_ids).cancel(promote=False)
+            WaitlistEntry.objects.filter(fitness_class_id__in=class_ids).delete()
+            reservations.reconcile(class_ids)
+            slot_events.slots_changed(class_ids)
+        return cancelled
+
 
 class FitnessClass(models.Model):
     name = models.CharField(max_length=100)
     start_time = models.DateTimeField()
     instructor = models.CharField(max_length=100)
     available_slots = models.PositiveIntegerField()
+    # Slots the class was scheduled with; defaults to available_slots.
+    capacity = models.PositiveIntegerField(blank=True)
+    called_off_at = models.DateTimeField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = FitnessClassQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Serves the upcoming-class filter and its (start_time, id) keyset order.
+            models.Index(fields=['start_time', 'id'], name='fitnessclass_start_time_idx'),
+        ]
+
     def __str__(self):
         return f"{self.name} at {self.start_time} by {self.instructor}"
 
+    def save(self, *args, **kwargs):
+        if self.capacity is None:
+            self.capacity = self.available_slots
+        super().save(*args, **kwargs)
+
+class ClientEmailQuerySet(models.QuerySet):
+
+    def for_email(self, email):
+        """
+        Filters on client_email case-insensitively. The database lowers both
+        sides, so the comparison matches LOWER(client_email) and its index
+        exactly, for non-ASCII addresses too.
+        """
+        return self.alias(client_email_lower=Lower('client_email')).filter(client_email_lower=Lower(Value(email)))
+
+
+class BookingQuerySet(ClientEmailQuerySet):
+
+    def active(self):
+        return self.filter(cancelled_at__isnull=True)
+
+    def cancel(self, promote=True):
+        """
+        Soft-cancels the active bookings in this queryset and gives their
+        slots back to their classes, in one transaction. Each class's
+        bookings are cancelled with one conditional UPDATE and exactly that
+        many slots are restored, so a booking racing with another
+        cancellation is only ever counted once. With `promote` the freed
+        slots go to the classes' waitlists. Returns how many bookings were
+        cancelled.
+        """
+        cancelled = 0
+        now = timezone.now()
+        with transaction.atomic():
+            class_ids = set(self.active().order_by().values_list('fitness_class_id', flat=True).distinct())
+            for class_id in class_ids:
+                count = self.active().filter(fitness_class_id=class_id).update(cancelled_at=now, updated_at=now)
+                if count:
+                    FitnessClass.objects.release_slots(class_id, count)
+                    if promote:
+                        WaitlistEntry.objects.promote(class_id)
+                cancelled += count
+        return cancelled
+
+
 class Booking(models.Model):
     fitness_class = models.ForeignKey(FitnessClass, on_delete=models.CASCADE, related_name='bookings')
     client_name = models.CharField(max_length=100)
     client_email = models.EmailField()
     booked_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    cancelled_at = models.DateTimeField(null=True, blank=True)
+
+    objects = BookingQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Case-insensitive email lookups go through `for_email()`, which
+            # compiles to LOWER(client_email) and can use this index.
+            models.Index(Lower('client_email'), F('booked_at'), F('id'), name='booking_email_lower_idx'),
+        ]
 
     def __str__(self):
         return f"{self.client_name} booking for {self.fitness_class.name}"
+
+
+class WaitlistQuerySet(ClientEmailQuerySet):
+
+    def with_position(self):
+        """
+        Annotates each entry with its 1-based place in its class's queue.
+        """
+        ahead = (
+            WaitlistEntry.objects.filter(fitness_class=OuterRef('fitness_class'), id__lte=OuterRef('id'))
+            .values('fitness_class').annotate(count=Count('id')).values('count')
+        )
+        return self.annotate(position=Subquery(ahead))
+
+    def join(self, fitness_class, client_name, client_email):
+        """
+        Queues a client at the back of a full class's waitlist; joining
+        twice keeps the original place. Free slots are handed out right away
+        in case one opened up before the entry was written, so the returned
+        entry has `booking` set when the client was promoted on the spot.
+        """
+        entry = self.filter(fitness_class=fitness_class).for_email(client_email).first()
+        with transaction.atomic():
+            if entry is None:
+                try:
+                    with transaction.atomic():
+                        entry = self.create(
+                            fitness_class=fitness_class, client_name=client_name, client_email=client_email
+                        )
+                except IntegrityError:
+                    # A concurrent request queued the same client first.
+                    entry = self.filter(fitness_class=fitness_class).for_email(client_email).get()
+
+            entry.booking = None
+            for promoted, booking in self.promote(fitness_class.id):
+                if promoted.pk == entry.pk:
+                    entry.booking = booking
+            entry.position = self.filter(fitness_class=fitness_class, id__lte=entry.id).count()
+        return entry
+
+    def promote(self, class_id):
+        """
+        Books clients from the head of a class's waitlist, in order, for as
+        long as the class has free slots. Call it inside the transaction
+        that freed the slots so no other client can take them in between.
+        Returns the promoted (entry, booking) pairs.
+        """
+        promoted = []
+        with transaction.atomic():
+            while True:
+                entry = self.filter(fitness_class_id=class_id).order_by('id').first()
+                if entry is None or not FitnessClass.objects.reserve_slots(class_id):
+                    break
+                if not self.filter(pk=entry.pk).delete()[0]:
+                    # A concurrent promotion already booked this client.
+                    FitnessClass.objects.release_slots(class_id)
+                    continue
+                booking = Booking.objects.create(
+                    fitness_class_id=class_id, client_name=entry.client_name, client_email=entry.client_email
+                )
+                promoted.append((entry, booking))
+        return promoted
+
+
+class WaitlistEntry(models.Model):
+    fitness_class = models.ForeignKey(FitnessClass, on_delete=models.CASCADE, related_name='waitlist')
+    client_name = models.CharField(max_length=100)
+    client_email = models.EmailField()
+    joined_at = models.DateTimeField(auto_now_add=True)
+
+    objects = WaitlistQuerySet.as_manager()
+
+    class Meta:
+        # Entries are served first come, first served in id order.
+        ordering = ['id']
+        constraints = [
+            models.UniqueConstraint(
+                F('fitness_class'), Lower('client_email'), name='waitlist_unique_client',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['fitness_class', 'id'], name='waitlist_queue_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.client_name} waiting for {self.fitness_class.name}"
+
+
+def idempotency_cutoff():
+    """
+    Keys created before this moment have expired.
+    """
+    return timezone.now() - timedelta(seconds=getattr(settings, 'BOOKING_IDEMPOTENCY_TTL', 24 * 60 * 60))
+
+
+class IdempotencyKeyQuerySet(models.QuerySet):
+
+    def expired(self):
+        return self.filter(created_at__lt=idempotency_cutoff())
+
+    def find(self, key):
+        """
+        Returns the stored answer for `key`, or None. An expired key is
+        removed here so that it can be used again.
+        """
+        record = self.filter(pk=key).first()
+        if record is not None and record.created_at < idempotency_cutoff():
+            record.delete()
+            return None
+        return record
+
+    async def afind(self, key):
+        record = await self.filter(pk=key).afirst()
+        if record is not None and record.created_at < idempotency_cutoff():
+            await record.adelete()
+            return None
+        return record
+
+
+class IdempotencyKey(models.Model):
+    """
+    The answer given to a request sent with an Idempotency-Key header,
+    replayed when the request is retried with the same key.
+    """
+    key = models.CharField(max_length=255, primary_key=True)
+    # Hash of the request body, to refuse a key reused for another request.
+    fingerprint = models.CharField(max_length=64)
+    status_code = models.PositiveSmallIntegerField()
+    response = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    objects = IdempotencyKeyQuerySet.as_manager()
+
+    def __str__(self):
+        return self.key
+
+
+
+class DeletionQuerySet(models.QuerySet):
+
+    def record(self, scope):
+        """
+        Stamps `scope` with the current time. Deleted rows leave nothing
+        behind for Max('updated_at') to see, so listings add this stamp to
+        their Last-Modified.
+        """
+        now = timezone.now()
+        if self.filter(pk=scope).update(deleted_at=now):
+            return
+        try:
+            with transaction.atomic():
+                self.create(scope=scope, deleted_at=now)
+        except IntegrityError:
+            # A concurrent delete stamped the scope first.
+            self.filter(pk=scope).update(deleted_at=now)
+
+    def latest_at(self, scope):
+        return self.filter(pk=scope).values_list('deleted_at', flat=True).first()
+
+    async def alatest_at(self, scope):
+        return await self.filter(pk=scope).values_list('deleted_at', flat=True).afirst()
+
+
+class Deletion(models.Model):
+    """
+    When a row of a listing was last deleted: `CLASSES` for the class
+    listing, `bookings_of(email)` for a client's bookings.
+    """
+    CLASSES = 'classes'
+
+    scope = models.CharField(max_length=300, primary_key=True)
+    deleted_at = models.DateTimeField()
+
+    objects = DeletionQuerySet.as_manager()
+
+    def __str__(self):
+        return self.scope
+
+    @staticmethod
+    def bookings_of(email):
+        return f'bookings:{email.lower()}'
@@ -0,0 +1,113 @@
+import base64
+import json
+from bisect import bisect_right
+from datetime import datetime
+
+from django.conf import settings
+from django.db.models import Q
+from rest_framework.exceptions import ValidationError
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination:
+    """
+    Cursor pagination on (ordering_field, id). Each page is fetched with a
+    range condition on the last row seen rather than an OFFSET, so paging
+    deep into a listing costs the same as fetching the first page.
+    """
+    ordering_field = None
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+
+    def __init__(self, request):
+        self.request = request
+        self.page_size = self.get_page_size()
+        self.cursor = self.decode_cursor()
+        self.next_cursor = None
+
+    def get_page_size(self):
+        default = api_settings.PAGE_SIZE or 10
+        max_page_size = getattr(settings, 'BOOKING_MAX_PAGE_SIZE', 100)
+        try:
+            page_size = int(self.request.GET.get(self.page_size_query_param, default))
+        except (TypeError, ValueError):
+            raise ValidationError("Invalid page_size.")
+        if page_size < 1:
+            raise ValidationError("Invalid page_size.")
+        return min(page_size, max_page_size)
+
+    def decode_cursor(self):
+        encoded = self.request.GET.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')))
+            value, pk = datetime.fromisoformat(payload['t']), int(payload['id'])
+        except (TypeError, ValueError, KeyError, UnicodeEncodeError):
+            raise ValidationError("Invalid cursor.")
+        if value.tzinfo is None:
+            raise ValidationError("Invalid cursor.")
+        return value, pk
+
+    @staticmethod
+    def encode_cursor(value, pk):
+        payload = json.dumps({'t': value.isoformat(), 'id': pk}, separators=(',', ':'))
+        return base64.urlsafe_b64encode(payload.encode('ascii')).decode('ascii')
+
+    def _page_queryset(self, queryset):
+        queryset = queryset.order_by(self.ordering_field, 'id')
+        if self.cursor:
+            value, pk = self.cursor
+            queryset = queryset.filter(
+                Q(**{f'{self.ordering_field}__gt': value}) |
+                Q(**{self.ordering_field: value, 'id__gt': pk})
+            )
+        # One extra row tells whether there is a next page.
+        return queryset[:self.page_size + 1]
+
+    def _trim_page(self, page):
+        if len(page) > self.page_size:
+            page = page[:self.page_size]
+            last = page[-1]
+            if isinstance(last, dict):
+                # Rows fetched with .values()
+                self.next_cursor = self.encode_cursor(last[self.ordering_field], last['id'])
+            else:
+                self.next_cursor = self.encode_cursor(getattr(last, self.ordering_field), last.id)
+        return page
+
+    def paginate_queryset(self, queryset):
+        return self._trim_page(list(self._page_queryset(queryset)))
+
+    async def apaginate_queryset(self, queryset):
+        return self._trim_page([obj async for obj in self._page_queryset(queryset)])
+
+    def paginate_entries(self, entries):
+        """
+        Pages an already ordered list of (value, id, item) entries, such as
+        the cached class listing, with the same cursors as the queryset.
+        """
+        start = 0
+        if self.cursor:
+            start = bisect_right(entries, self.cursor, key=lambda entry: entry[:2])
+        page = entries[start:start + self.page_size + 1]
+        if len(page) > self.page_size:
+            page = page[:self.page_size]
+            value, pk, _ = page[-1]
+            self.next_cursor = self.encode_cursor(value, pk)
+        return [item for _, _, item in page]
+
+    def get_next_link(self):
+        if self.next_cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.next_cursor)
+
+
+class ClassKeysetPagination(KeysetPagination):
+    ordering_field = 'start_time'
+
+
+class BookingKeysetPagination(KeysetPagination):
+    ordering_field = 'booked_at'
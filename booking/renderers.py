@@ -0,0 +1,33 @@
+from django.conf import settings
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer that encodes with orjson when it is installed. The output is
+    byte-identical to JSONRenderer's compact UTF-8 form: datetimes and other
+    non-native types still go through DRF's encoder, and U+2028/U+2029 are
+    escaped the same way. Indented output and ensure_ascii fall back to the
+    stdlib encoder.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if (orjson is None or data is None or self.ensure_ascii or not self.compact
+                or self.get_indent(accepted_media_type, renderer_context or {}) is not None):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        ret = orjson.dumps(data, default=self.encoder_class().default, option=orjson.OPT_PASSTHROUGH_DATETIME)
+        return ret.replace('\u2028'.encode(), b'\\u2028').replace('\u2029'.encode(), b'\\u2029')
+
+
+def get_json_renderer():
+    """
+    Returns the renderer used for the list endpoints' JSON output, which is
+    FastJSONRenderer when BOOKING_FAST_JSON is enabled.
+    """
+    return FastJSONRenderer() if getattr(settings, 'BOOKING_FAST_JSON', False) else JSONRenderer()
@@ -0,0 +1,113 @@
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+# Set while a read-only endpoint runs, to the replica it reads from once
+# chosen; every other query uses the primary.
+_replica_reads = ContextVar('replica_reads', default=None)
+# Set for clients that wrote recently, so they read their own writes.
+_pinned_to_primary = ContextVar('pinned_to_primary', default=False)
+
+
+@contextmanager
+def _set(var, value):
+    token = var.set(value)
+    try:
+        yield
+    finally:
+        var.reset(token)
+
+
+def read_from_replicas():
+    # A list, so that the replica chosen by the first query (possibly in a
+    # sync_to_async thread) is kept for the rest of the request.
+    return _set(_replica_reads, [])
+
+
+def pin_to_primary():
+    return _set(_pinned_to_primary, True)
+
+
+def reads_from_replicas(handler):
+    """
+    Decorates a read-only view method, sync or async, so that its queries
+    go to the read replicas.
+    """
+    if iscoroutinefunction(handler):
+        @wraps(handler)
+        async def wrapper(*args, **kwargs):
+            with read_from_replicas():
+                return await handler(*args, **kwargs)
+    else:
+        @wraps(handler)
+        def wrapper(*args, **kwargs):
+            with read_from_replicas():
+                return handler(*args, **kwargs)
+    return wrapper
+
+
+class ReplicaSelector:
+    """
+    Picks the replica for the next read: in turn ('round_robin') or the one
+    left unused the longest ('lru').
+    """
+
+    def __init__(self, aliases, strategy='round_robin'):
+        self.aliases = tuple(aliases)
+        self.strategy = strategy
+        self._lock = threading.Lock()
+        self._cycle = itertools.cycle(self.aliases)
+        self._last_used = dict.fromkeys(self.aliases, 0.0)
+
+    def choose(self):
+        with self._lock:
+            if self.strategy == 'lru':
+                alias = min(self.aliases, key=self._last_used.__getitem__)
+                self._last_used[alias] = time.monotonic()
+                return alias
+            return next(self._cycle)
+
+
+class ReadReplicaRouter:
+    """
+    Sends the reads of views decorated with @reads_from_replicas to one of
+    the BOOKING_READ_REPLICAS aliases, the same one for the whole request,
+    unless the client is pinned to the primary (see
+    PrimaryPinningMiddleware). Everything else, including every write, goes
+    to the primary ('default'). The class listing stays
+    on the primary too: it is rebuilt into the shared cache, where a
+    lagging replica's answer would be served for the cache timeout.
+    """
+
+    def __init__(self):
+        self._selector = None
+
+    def _get_selector(self):
+        aliases = tuple(getattr(settings, 'BOOKING_READ_REPLICAS', ()))
+        strategy = getattr(settings, 'BOOKING_REPLICA_STRATEGY', 'round_robin')
+        if self._selector is None or (self._selector.aliases, self._selector.strategy) != (aliases, strategy):
+            self._selector = ReplicaSelector(aliases, strategy)
+        return self._selector
+
+    def db_for_read(self, model, **hints):
+        chosen = _replica_reads.get()
+        if chosen is None or _pinned_to_primary.get():
+            return DEFAULT_DB_ALIAS
+        if not chosen:
+            selector = self._get_selector()
+            chosen.append(selector.choose() if selector.aliases else DEFAULT_DB_ALIAS)
+        return chosen[0]
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary.
+        return True
@@ -1,6 +1,28 @@
+from django.conf import settings
+from django.db import models, transaction
 from rest_framework import serializers
-from .models import FitnessClass, Booking
-from booking.utils import convert_to_timezone
+from rest_framework.settings import api_settings
+from .models import FitnessClass, Booking, WaitlistEntry
+from .slots import reservations
+from booking.utils import convert_to_timezone, format_in_timezone
+
+
+START_TIME_FORMAT = '%Y-%m-%d %H:%M:%S %Z'
+
+
+class FitnessClassListSerializer(serializers.ListSerializer):
+    """
+    Formats every start_time of the listing in a single batched pass before
+    the rows are serialized, instead of once per row.
+    """
+
+    def to_representation(self, data):
+        iterable = list(data.all() if isinstance(data, models.manager.BaseManager) else data)
+        tz_name = self.context.get('timezone', 'Asia/Kolkata')
+        self.child.start_times = format_in_timezone(
+            (obj.start_time for obj in iterable), tz_name, START_TIME_FORMAT
+        )
+        return super().to_representation(iterable)
 
 
 class FitnessClassSerializer(serializers.ModelSerializer):
@@ -9,11 +31,50 @@ class FitnessClassSerializer(serializers.ModelSerializer):
     class Meta:
         model = FitnessClass
         fields = ['id', 'name', 'start_time', 'instructor', 'available_slots']
+        list_serializer_class = FitnessClassListSerializer
 
     def get_start_time(self, obj):
+        start_times = getattr(self, 'start_times', None)
+        if start_times and obj.start_time in start_times:
+            return start_times[obj.start_time]
         tz_name = self.context.get('timezone', 'Asia/Kolkata')
         dt = convert_to_timezone(obj.start_time, tz_name)
-        return dt.strftime('%Y-%m-%d %H:%M:%S %Z')
+        return dt.strftime(START_TIME_FORMAT)
+
+
+# Fast read path (BOOKING_FAST_JSON): the list endpoints fetch these
+# `.values()` columns and build the same dicts as the serializers above and
+# below, without creating a serializer instance per row.
+FAST_CLASS_VALUES = ('id', 'name', 'start_time', 'instructor', 'available_slots')
+FAST_BOOKING_VALUES = ('id', 'fitness_class__name', 'client_name', 'client_email', 'booked_at')
+
+
+def fast_class_rows(rows, tz_name):
+    start_times = format_in_timezone((row['start_time'] for row in rows), tz_name, START_TIME_FORMAT)
+    return [
+        {
+            'id': row['id'],
+            'name': row['name'],
+            'start_time': start_times[row['start_time']],
+            'instructor': row['instructor'],
+            'available_slots': row['available_slots'],
+        }
+        for row in rows
+    ]
+
+
+def fast_booking_rows(rows):
+    booked_at = serializers.DateTimeField().to_representation
+    return [
+        {
+            'id': row['id'],
+            'fitness_class': row['fitness_class__name'],
+            'client_name': row['client_name'],
+            'client_email': row['client_email'],
+            'booked_at': booked_at(row['booked_at']),
+        }
+        for row in rows
+    ]
 
 
 class BookingSerializer(serializers.ModelSerializer):
@@ -21,19 +82,162 @@ class BookingSerializer(serializers.ModelSerializer):
         slug_field='name',
         queryset=FitnessClass.objects.all()
     )
+    waitlist = serializers.BooleanField(required=False, write_only=True)
+
     class Meta:
         model = Booking
-        fields = ['id', 'fitness_class', 'client_name', 'client_email', 'booked_at']
+        fields = ['id', 'fitness_class', 'client_name', 'client_email', 'booked_at', 'waitlist']
         read_only_fields = ['id', 'booked_at']
 
     def validate(self, data):
+        # Cheap early rejection only; the authoritative check is the
+        # conditional update in create().
         fitness_class = data['fitness_class']
-        if fitness_class.available_slots < 1:
+        if fitness_class.called_off_at is not None:
+            raise serializers.ValidationError("This class has been called off.")
+        if fitness_class.available_slots < 1 and not data.get('waitlist'):
             raise serializers.ValidationError("No available slots for this class.")
         return data
 
     def create(self, validated_data):
+        """
+        Books the class. When it is full and `waitlist` was requested, the
+        client is queued instead and the WaitlistEntry is returned. Bookings
+        made by the slot counter are returned unsaved.
+        """
+        waitlist = validated_data.pop('waitlist', False)
         fitness_class = validated_data['fitness_class']
-        fitness_class.available_slots -= 1
-        fitness_class.save()
-        return super().create(validated_data)
+        with transaction.atomic():
+            # Classes held by the slot counter are booked there; the Booking
+            # is saved by a later flush (see booking.slots).
+            booking = reservations.book(fitness_class, validated_data['client_name'], validated_data['client_email'])
+            if booking:
+                return booking
+            if not FitnessClass.objects.reserve_slots(fitness_class.id):
+                if waitlist:
+                    return WaitlistEntry.objects.join(
+                        fitness_class, validated_data['client_name'], validated_data['client_email']
+                    )
+                raise serializers.ValidationError({
+                    api_settings.NON_FIELD_ERRORS_KEY: ["No available slots for this class."]
+                })
+            return super().create(validated_data)
+
+
+class BookingRequestSerializer(BookingSerializer):
+    """
+    One entry of a bulk booking. The class stays a name here so that the
+    bulk serializer can resolve every name with a single query.
+    """
+    fitness_class = serializers.CharField(max_length=100)
+
+    def validate(self, data):
+        return data
+
+
+class WaitlistEntrySerializer(serializers.ModelSerializer):
+    """
+    Expects entries annotated by WaitlistQuerySet.with_position().
+    """
+    fitness_class = serializers.SlugRelatedField(slug_field='name', read_only=True)
+    position = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = WaitlistEntry
+        fields = ['id', 'fitness_class', 'client_name', 'client_email', 'joined_at', 'position']
+
+
+class BulkBookingSerializer(serializers.Serializer):
+    """
+    Books many clients at once. With `atomic` (the default) either every
+    booking succeeds or none is made; otherwise each booking that can be
+    satisfied is made and the rest are reported as failed.
+    """
+    bookings = serializers.ListField(child=serializers.DictField(), allow_empty=False)
+    atomic = serializers.BooleanField(default=True)
+
+    def validate_bookings(self, bookings):
+        max_items = getattr(settings, 'BOOKING_BULK_MAX_ITEMS', 500)
+        if len(bookings) > max_items:
+            raise serializers.ValidationError(f"At most {max_items} bookings can be made per request.")
+        return bookings
+
+    def create(self, validated_data):
+        atomic = validated_data['atomic']
+        results = [None] * len(validated_data['bookings'])
+        pending = []
+
+        for index, item in enumerate(validated_data['bookings']):
+            item_serializer = BookingRequestSerializer(data=item)
+            if item_serializer.is_valid():
+                # Bulk bookings are never queued on a waitlist.
+                item_serializer.validated_data.pop('waitlist', None)
+                pending.append((index, item_serializer.validated_data))
+            else:
+                results[index] = self._failed(index, item_serializer.errors)
+
+        classes_by_name = {}
+        names = {data['fitness_class'] for _, data in pending}
+        for fitness_class in FitnessClass.objects.filter(name__in=names):
+            classes_by_name.setdefault(fitness_class.name, []).append(fitness_class)
+
+        resolved, requested = [], {}
+        for index, data in pending:
+            matches = classes_by_name.get(data['fitness_class'], [])
+            if len(matches) != 1:
+                message = (f"Object with name={data['fitness_class']} does not exist." if not matches
+                           else f"Multiple classes are named {data['fitness_class']}.")
+                results[index] = self._failed(index, {'fitness_class': [message]})
+                continue
+            data['fitness_class'] = matches[0]
+            resolved.append((index, data))
+            requested.setdefault(matches[0].id, []).append(index)
+        pending = resolved
+
+        if atomic and any(results):
+            return self._skip_pending(results, pending)
+
+        with transaction.atomic():
+            granted = {}
+            counts = {class_id: len(indexes) for class_id, indexes in requested.items()}
+            if counts and FitnessClass.objects.reserve_slots_many(counts):
+                granted = counts
+            elif atomic:
+                available = dict(FitnessClass.objects.filter(pk__in=counts).values_list('id', 'available_slots'))
+                for class_id, count in counts.items():
+                    if available.get(class_id, 0) < count:
+                        for index in requested[class_id]:
+                            results[index] = self._failed(index, self._no_slots_error())
+                return self._skip_pending(results, pending)
+            else:
+                granted = {class_id: FitnessClass.objects.reserve_up_to(class_id, count)
+                           for class_id, count in counts.items()}
+
+            bookings = []
+            for index, data in pending:
+                class_id = data['fitness_class'].id
+                if granted.get(class_id, 0) > 0:
+                    granted[class_id] -= 1
+                    bookings.append((index, Booking(**data)))
+                else:
+                    results[index] = self._failed(index, self._no_slots_error())
+            Booking.objects.bulk_create([booking for _, booking in bookings])
+
+        for index, booking in bookings:
+            results[index] = {"index": index, "status": "booked", "booking_id": booking.id}
+        return results
+
+    @staticmethod
+    def _failed(index, errors):
+        return {"index": index, "status": "failed", "errors": errors}
+
+    @staticmethod
+    def _no_slots_error():
+        return {api_settings.NON_FIELD_ERRORS_KEY: ["No available slots for this class."]}
+
+    @staticmethod
+    def _skip_pending(results, pending):
+        for index, _ in pending:
+            if results[index] is None:
+                results[index] = {"index": index, "status": "skipped"}
+        return results
@@ -0,0 +1,70 @@
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .cache import invalidate_class_listing
+from .events import slot_events
+from .metrics import registry
+from .middleware import record_query
+from .models import Booking, Deletion, FitnessClass, WaitlistEntry
+from .slots import reservations
+
+
+@receiver([post_save, post_delete], sender=FitnessClass)
+@receiver([post_save, post_delete], sender=Booking)
+def invalidate_class_listing_on_change(sender, **kwargs):
+    # Invalidate again once the change is committed, otherwise a listing
+    # rebuilt by another request mid-transaction would stay cached.
+    invalidate_class_listing()
+    transaction.on_commit(invalidate_class_listing)
+
+
+@receiver(post_delete, sender=FitnessClass)
+def stamp_class_deletion(sender, **kwargs):
+    Deletion.objects.record(Deletion.CLASSES)
+
+
+@receiver(post_delete, sender=Booking)
+def stamp_booking_deletion(sender, instance, **kwargs):
+    Deletion.objects.record(Deletion.bookings_of(instance.client_email))
+
+
+@receiver(post_save, sender=FitnessClass)
+def publish_slots_on_class_save(sender, instance, **kwargs):
+    slot_events.slots_changed([instance.pk])
+
+
+@receiver(post_save, sender=FitnessClass)
+def reconcile_slot_counter_on_class_save(sender, instance, raw=False, **kwargs):
+    # Reloads the class's slot counter (if it is held) before its waitlist
+    # is promoted, so slots added from the admin can be handed out.
+    if not raw:
+        reservations.reconcile([instance.pk])
+
+
+@receiver(post_delete, sender=FitnessClass)
+def discard_slot_counter_on_class_delete(sender, instance, **kwargs):
+    reservations.reconcile([instance.pk])
+
+
+@receiver(post_save, sender=FitnessClass)
+def promote_waitlist_on_class_save(sender, instance, created, raw=False, **kwargs):
+    # Slots added to a class (e.g. from the admin) go to its waitlist first,
+    # within the same transaction as the save.
+    if not created and not raw:
+        WaitlistEntry.objects.promote(instance.pk)
+
+
+@receiver(connection_created)
+def install_query_recorder(sender, connection, **kwargs):
+    # Lets RequestMetricsMiddleware count the queries of every request.
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+@receiver(connection_created)
+def count_connection(sender, connection, **kwargs):
+    # Compared with booking_requests_total, shows how often connections are
+    # reused (see BOOKING_CONN_MAX_AGE and BOOKING_DB_POOL).
+    registry.inc('booking_db_connections_total', (('alias', connection.alias),))
@@ -0,0 +1,445 @@
+import atexit
+import threading
+import weakref
+from collections import Counter, defaultdict, deque
+from datetime import timedelta
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DatabaseError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .events import slot_events
+from .utils import CustomLogger
+
+logger = CustomLogger(__name__).get_custom_logger()
+
+
+def on_rollback(callback):
+    """
+    Runs `callback` if the current transaction, or the savepoint it is in,
+    rolls back. Django has no such hook, but it drops the on_commit
+    callbacks of a block that rolls back: the sentinel registered here runs
+    `callback` once it is dropped without having been called.
+    """
+    committed = []
+
+    def sentinel():
+        committed.append(True)
+
+    weakref.finalize(sentinel, lambda: committed or callback()).atexit = False
+    transaction.on_commit(sentinel)
+
+
+class MemorySlotStore:
+    """
+    Slot counters of the current process. `slots` holds, per held class,
+    the slots still free: the database's available_slots minus the
+    bookings not flushed yet, which `pending` counts.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.loaded = False
+        self._slots = {}
+        self._pending = Counter()
+
+    def take(self, class_id, count=1):
+        """
+        Returns True when `count` slots were taken, False when the class has
+        fewer left, and None when the class is not held here.
+        """
+        with self.lock:
+            free = self._slots.get(class_id)
+            if free is None:
+                return None
+            if free < count:
+                return False
+            self._slots[class_id] = free - count
+            return True
+
+    def give(self, class_id, count=1):
+        with self.lock:
+            if class_id in self._slots:
+                self._slots[class_id] += count
+
+    def available(self, class_id):
+        return self._slots.get(class_id)
+
+    def add_pending(self, counts):
+        with self.lock:
+            self._pending.update(counts)
+
+    def flushed(self, counts):
+        with self.lock:
+            self._pending.subtract(counts)
+
+    def drop_pending(self, class_ids):
+        with self.lock:
+            for class_id in class_ids:
+                self._pending.pop(class_id, None)
+
+    def load(self, counts, replace=True):
+        """
+        Holds the classes of `counts` (class id: available_slots in the
+        database) with their unflushed bookings deducted.
+        """
+        with self.lock:
+            for class_id, available in counts.items():
+                if replace or class_id not in self._slots:
+                    self._slots[class_id] = max(available - self._pending[class_id], 0)
+
+    def discard(self, class_ids):
+        with self.lock:
+            for class_id in class_ids:
+                self._slots.pop(class_id, None)
+
+    def clear(self):
+        with self.lock:
+            self._slots.clear()
+            self._pending.clear()
+            self.loaded = False
+
+
+class CacheSlotStore:
+    """
+    Slot counters in a Django cache shared by several workers, taken with
+    the cache's atomic decr. The cache must allow negative values: Redis
+    and the local-memory cache do, Memcached clamps them to zero.
+    """
+
+    def __init__(self, alias='default'):
+        self.alias = alias
+        self.loaded = False
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def take(self, class_id, count=1):
+        key = f'booking:slots:{class_id}'
+        try:
+            free = self.cache.decr(key, count)
+        except ValueError:
+            return None
+        if free < 0:
+            self.cache.incr(key, count)
+            return False
+        return True
+
+    def give(self, class_id, count=1):
+        try:
+            self.cache.incr(f'booking:slots:{class_id}', count)
+        except ValueError:
+            pass
+
+    def available(self, class_id):
+        return self.cache.get(f'booking:slots:{class_id}')
+
+    def add_pending(self, counts):
+        for class_id, count in counts.items():
+            key = f'booking:slots:pending:{class_id}'
+            if not self.cache.add(key, count, timeout=None):
+                self.cache.incr(key, count)
+
+    def flushed(self, counts):
+        for class_id, count in counts.items():
+            try:
+                self.cache.decr(f'booking:slots:pending:{class_id}', count)
+            except ValueError:
+                pass
+
+    def drop_pending(self, class_ids):
+        self.cache.delete_many([f'booking:slots:pending:{class_id}' for class_id in class_ids])
+
+    def load(self, counts, replace=True):
+        # Not atomic with concurrent takes of other workers: run it while
+        # the classes are quiet, e.g. before the workers start.
+        pending = self.cache.get_many([f'booking:slots:pending:{class_id}' for class_id in counts])
+        for class_id, available in counts.items():
+            free = max(available - pending.get(f'booking:slots:pending:{class_id}', 0), 0)
+            if replace:
+                self.cache.set(f'booking:slots:{class_id}', free, timeout=None)
+            else:
+                self.cache.add(f'booking:slots:{class_id}', free, timeout=None)
+
+    def discard(self, class_ids):
+        self.cache.delete_many([f'booking:slots:{class_id}' for class_id in class_ids])
+
+
+@lru_cache(maxsize=None)
+def _get_store(kind, alias):
+    return CacheSlotStore(alias) if kind == 'cache' else MemorySlotStore()
+
+
+def _configured_store():
+    kind = getattr(settings, 'BOOKING_SLOT_COUNTER', None)
+    if not kind:
+        return None
+    return _get_store(kind, getattr(settings, 'BOOKING_SLOT_COUNTER_CACHE_ALIAS', 'default'))
+
+
+class SlotReservations:
+    """
+    Optional reservation engine for flash sales, enabled with
+    BOOKING_SLOT_COUNTER ('memory' or 'cache'). It holds the free slots of
+    the classes starting within BOOKING_SLOT_COUNTER_HORIZON seconds in a
+    counter store, so POST /book/ takes a slot with one atomic decrement
+    instead of an UPDATE of the class row. The Booking rows, and the
+    matching available_slots decrements, are written behind in batches by
+    a flusher thread every BOOKING_SLOT_FLUSH_INTERVAL seconds.
+
+    Every other slot change (cancellations, bulk bookings, waitlist
+    promotion) still updates the database, and goes through the counter
+    too for held classes (see FitnessClassQuerySet), so the two never
+    disagree on what is left. Bookings and released slots are undone in
+    the counter when their transaction rolls back; any other rolled back
+    take only leaves the counter short, never oversold. Reconciliation,
+    which each process runs on first use and `manage.py reconcile_slots`
+    runs on deploy, reloads the counters from the database.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = []
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._flusher = None
+        # Queued bookings the database refused at flush time.
+        self.rejected = deque(maxlen=1000)
+
+    def get_store(self):
+        """
+        Returns the configured store, loaded from the database on first use
+        in this process, or None when the engine is off.
+        """
+        store = _configured_store()
+        if store is not None and not store.loaded:
+            with self._lock:
+                if not store.loaded:
+                    # Keeps the counters other workers already hold.
+                    self.reconcile(replace=False)
+                    store.loaded = True
+        return store
+
+    def take(self, class_id, count=1):
+        """
+        Takes `count` slots of a held class. Returns None when the class is
+        not held, i.e. the database alone decides.
+        """
+        store = self.get_store()
+        return None if store is None else store.take(class_id, count)
+
+    def give(self, class_id, count=1):
+        store = self.get_store()
+        if store is not None:
+            store.give(class_id, count)
+
+    def take_many(self, counts):
+        """
+        Takes counts[class_id] slots of each held class, all or nothing.
+        Returns the counts taken, or False when a held class is short.
+        """
+        taken = {}
+        for class_id, count in counts.items():
+            held = self.take(class_id, count)
+            if held is False:
+                self.give_many(taken)
+                return False
+            if held:
+                taken[class_id] = count
+        return taken
+
+    def give_many(self, counts):
+        for class_id, count in counts.items():
+            self.give(class_id, count)
+
+    def release(self, class_id, count=1):
+        """
+        Gives `count` slots back to a held class right away, so the
+        transaction restoring them in the database can hand them to the
+        waitlist, and takes them back if it rolls back.
+        """
+        store = self.get_store()
+        if store is None:
+            return
+        store.give(class_id, count)
+        # Someone may have taken them meanwhile: the counter then stays
+        # below zero until as many slots are freed again.
+        on_rollback(lambda: store.give(class_id, -count))
+
+    def available(self, class_id):
+        store = self.get_store()
+        return None if store is None else store.available(class_id)
+
+    def holds(self, class_id):
+        """
+        Whether the counter holds the class. Never loads the store, so it
+        is safe in async code; before the first load nothing is held.
+        """
+        store = _configured_store()
+        return store is not None and store.loaded and store.available(class_id) is not None
+
+    def book(self, fitness_class, client_name, client_email):
+        """
+        Books a held class from the counter. Returns the Booking, which is
+        saved by a later flush (its pk is None until then), False when the
+        class is full, or None when the class is not held.
+        """
+        from .models import Booking
+
+        store = self.get_store()
+        taken = None if store is None else store.take(fitness_class.id)
+        if not taken:
+            return taken
+        # Counted as pending from now on, so a reconcile before the commit
+        # does not free the slot again.
+        store.add_pending({fitness_class.id: 1})
+        booking = Booking(fitness_class=fitness_class, client_name=client_name, client_email=client_email)
+        # Queued only if the surrounding transaction (e.g. the one storing an
+        # Idempotency-Key) commits.
+        transaction.on_commit(lambda: self._enqueue(booking))
+        on_rollback(lambda: self._unbook(store, fitness_class.id))
+        return booking
+
+    @staticmethod
+    def _unbook(store, class_id):
+        store.flushed({class_id: 1})
+        store.give(class_id)
+
+    def _enqueue(self, booking):
+        with self._lock:
+            self._pending.append(booking)
+            backlog = len(self._pending)
+        if backlog >= getattr(settings, 'BOOKING_SLOT_FLUSH_BATCH', 500):
+            self._wake.set()
+        self._start_flusher()
+
+    def _start_flusher(self):
+        interval = getattr(settings, 'BOOKING_SLOT_FLUSH_INTERVAL', 0.2)
+        if interval is None or self._flusher is not None:
+            return
+        with self._lock:
+            if self._flusher is None:
+                self._flusher = threading.Thread(
+                    target=self._run_flusher, args=(interval,), name='booking-slot-flusher', daemon=True
+                )
+                self._flusher.start()
+                atexit.register(self.flush)
+
+    def _run_flusher(self, interval):
+        while True:
+            self._wake.wait(interval)
+            self._wake.clear()
+            try:
+                while self.flush():
+                    pass
+            except Exception:
+                logger.error("Slot flusher failed.", exc_info=True)
+
+    def flush(self):
+        """
+        Writes one batch of queued bookings in one transaction: per class, a
+        guarded UPDATE takes their slots from available_slots, then one
+        INSERT writes them. Returns how many were written. Bookings that no
+        longer fit, because their class was deleted, called off or lowered
+        in the meantime, are rejected for good: logged and kept in
+        `rejected`. A batch failing on a database error is logged and
+        retried by the next flush.
+        """
+        from .cache import invalidate_class_listing
+        from .models import Booking
+
+        with self._flush_lock:
+            batch_size = getattr(settings, 'BOOKING_SLOT_FLUSH_BATCH', 500)
+            with self._lock:
+                batch, self._pending = self._pending[:batch_size], self._pending[batch_size:]
+            if not batch:
+                return 0
+
+            by_class = defaultdict(list)
+            for booking in batch:
+                by_class[booking.fitness_class_id].append(booking)
+            try:
+                with transaction.atomic():
+                    written, refused = [], []
+                    for class_id, bookings in by_class.items():
+                        taken = self._take_slots(class_id, len(bookings))
+                        written.extend(bookings[:taken])
+                        refused.extend(bookings[taken:])
+                    Booking.objects.bulk_create(written)
+                    slot_events.slots_changed(list(by_class))
+            except DatabaseError:
+                logger.error("Could not write %d bookings; retrying with the next flush.", len(batch), exc_info=True)
+                with self._lock:
+                    self._pending[:0] = batch
+                return 0
+
+            self.get_store().flushed(Counter(booking.fitness_class_id for booking in batch))
+            if refused:
+                self.rejected.extend(refused)
+                for booking in refused:
+                    logger.error("Rejected booking of class ID %s by %s: the class no longer has a slot for it.",
+                                 booking.fitness_class_id, booking.client_email)
+                # Their slots were never written; reload what is really left.
+                self.reconcile({booking.fitness_class_id for booking in refused})
+            # bulk_create and update() bypass post_save.
+            invalidate_class_listing()
+            logger.info("Flushed %d bookings for %d classes", len(written), len(by_class))
+            return len(written)
+
+    @staticmethod
+    def _take_slots(class_id, count, attempts=5):
+        """
+        Takes up to `count` slots of a class in the database, bypassing the
+        counter that already took them, and returns how many were taken.
+        """
+        from .models import FitnessClass
+
+        for _ in range(attempts):
+            if count < 1:
+                return 0
+            updated = FitnessClass.objects.bookable().filter(pk=class_id, available_slots__gte=count).update(
+                available_slots=F('available_slots') - count,
+                updated_at=timezone.now(),
+            )
+            if updated:
+                return count
+            available = FitnessClass.objects.bookable().filter(pk=class_id).values_list(
+                'available_slots', flat=True).first()
+            count = min(count, available or 0)
+        return 0
+
+    def reconcile(self, class_ids=None, replace=True, drop_pending=False):
+        """
+        Loads the counters of the upcoming classes within the horizon (or of
+        `class_ids`) from the database, minus the bookings not flushed yet.
+        Those of `class_ids` outside the horizon, or called off, are no
+        longer held. `drop_pending` first forgets the unflushed counts, e.g.
+        those of workers that died with bookings queued: only do that while
+        no worker is running. Returns the loaded available_slots by class
+        id.
+        """
+        from .models import FitnessClass
+
+        store = _configured_store()
+        if store is None:
+            return {}
+        now = timezone.now()
+        horizon = timedelta(seconds=getattr(settings, 'BOOKING_SLOT_COUNTER_HORIZON', 86400))
+        classes = FitnessClass.objects.all()
+        if class_ids is not None:
+            classes = classes.filter(pk__in=class_ids)
+        held = classes.bookable().filter(start_time__gte=now, start_time__lt=now + horizon)
+        counts = dict(held.values_list('id', 'available_slots'))
+        if drop_pending:
+            store.drop_pending(counts)
+        store.load(counts, replace=replace)
+        if class_ids is not None:
+            store.discard(set(class_ids) - set(counts))
+        return counts
+
+
+reservations = SlotReservations()
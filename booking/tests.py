@@ -1,14 +1,69 @@
+import logging
+import logging.handlers
+import os
+import subprocess
+import sys
+import tempfile
+from io import StringIO
+from unittest import mock
+from urllib.parse import urlencode
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection, connections, transaction
+from django.db.backends.signals import connection_created
+from django.db.models import EmailField
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.utils import timezone
-from rest_framework.test import APITestCase, APIClient
+from rest_framework.test import APITestCase, APITransactionTestCase, APIClient
 from rest_framework import status
-from .models import FitnessClass, Booking
+from rest_framework.exceptions import ValidationError
+from rest_framework.renderers import JSONRenderer
+from .events import SlotEventHub, slot_events
+from .batching import BookingBatcher, booking_batcher
+from .db import pool_metrics, serialized_writes
+from .idempotency import request_fingerprint
+from .metrics import QUERY_COUNT_BUCKETS, MetricsRegistry
+from .models import FitnessClass, Booking, IdempotencyKey, WaitlistEntry, WaitlistQuerySet
+from .renderers import FastJSONRenderer
+from .routers import ReplicaSelector
+from .throttling import CacheBucketStore, MemoryBucketStore, get_bucket_store
+from .urls import async_urlpatterns
+from .serializers import BookingSerializer, FitnessClassSerializer
+from .slots import reservations
+from .views import SlotAvailabilityStreamView, batched_booking
+from .utils import CustomLogger, DailyLogFileHandler, get_timezone, load_timezone, validate_timezone
 import pytz
-from datetime import timedelta
+import threading
+import time
+from concurrent.futures import Future
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+
+
+def create_class(name="Yoga Class", instructor="Alice", available_slots=5, starts_in=timedelta(days=1)):
+    return FitnessClass.objects.create(
+        name=name, instructor=instructor, start_time=timezone.now() + starts_in, available_slots=available_slots
+    )
+
+
+@override_settings(BOOKING_THROTTLE_RATES={})
+class BookingAPITestCase(APITestCase):
+    """
+    Starts every test with an empty cache and without rate limits, which
+    ThrottlingTests sets per test.
+    """
+
+    def setUp(self):
+        cache.clear()
 
 
-class FitnessClassBookingTests(APITestCase):
+class FitnessClassBookingTests(BookingAPITestCase):
     def setUp(self):
+        super().setUp()
         self.client = APIClient()
 
         self.class1 = FitnessClass.objects.create(
@@ -76,3 +131,1658 @@ class FitnessClassBookingTests(APITestCase):
         response = self.client.get('/bookings/')
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
         self.assertIn('message', response.data)
+
+    def test_booking_last_slot_taken_after_validation(self):
+        self.class1.available_slots = 1
+        self.class1.save()
+        serializer = BookingSerializer(data={
+            "fitness_class": self.class1.name,
+            "client_name": "Late Comer",
+            "client_email": "late@yopmail.com"
+        })
+        self.assertTrue(serializer.is_valid())
+
+        # Another request takes the last slot between validation and save
+        self.assertTrue(FitnessClass.objects.reserve_slots(self.class1.id))
+
+        with self.assertRaises(ValidationError):
+            serializer.save()
+        self.class1.refresh_from_db()
+        self.assertEqual(self.class1.available_slots, 0)
+        self.assertFalse(Booking.objects.filter(client_email="late@yopmail.com").exists())
+
+    def test_booking_does_not_overwrite_concurrent_changes(self):
+        stale = FitnessClass.objects.get(pk=self.class1.pk)
+        FitnessClass.objects.filter(pk=self.class1.pk).update(instructor="Carol", available_slots=3)
+
+        serializer = BookingSerializer(data={
+            "fitness_class": stale.name,
+            "client_name": "John Doe",
+            "client_email": "john@yopmail.com"
+        })
+        self.assertTrue(serializer.is_valid())
+        serializer.save()
+
+        self.class1.refresh_from_db()
+        self.assertEqual(self.class1.available_slots, 2)
+        self.assertEqual(self.class1.instructor, "Carol")
+
+
+class ClassListCacheTests(BookingAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.yoga = FitnessClass.objects.create(
+            name="Yoga Class",
+            instructor="Alice",
+            start_time=timezone.now() + timedelta(hours=1),
+            available_slots=5
+        )
+        self.hiit = FitnessClass.objects.create(
+            name="HIIT",
+            instructor="Bob",
+            start_time=timezone.now() + timedelta(hours=3),
+            available_slots=5
+        )
+
+    def test_repeat_request_is_served_from_cache(self):
+        first = self.client.get('/classes/')
+        with self.assertNumQueries(0):
+            second = self.client.get('/classes/')
+        self.assertEqual(first.data['data'], second.data['data'])
+
+    def test_cache_is_per_timezone(self):
+        kolkata = self.client.get('/classes/', {'timezone': 'Asia/Kolkata'})
+        london = self.client.get('/classes/', {'timezone': 'Europe/London'})
+        self.assertNotEqual(kolkata.data['data'][0]['start_time'], london.data['data'][0]['start_time'])
+
+    def test_booking_invalidates_cache(self):
+        self.client.get('/classes/')
+        self.client.post('/book/', {
+            "fitness_class": self.yoga.name,
+            "client_name": "John Doe",
+            "client_email": "john@yopmail.com"
+        }, format='json')
+        response = self.client.get('/classes/')
+        self.assertEqual(response.data['data'][0]['available_slots'], 4)
+
+    def test_class_change_invalidates_cache(self):
+        self.client.get('/classes/')
+        self.hiit.delete()
+        response = self.client.get('/classes/')
+        self.assertEqual([item['id'] for item in response.data['data']], [self.yoga.id])
+
+    def test_started_classes_roll_off_without_rebuild(self):
+        self.client.get('/classes/')
+        later = timezone.now() + timedelta(hours=2)
+        with mock.patch('booking.cache.timezone.now', return_value=later):
+            with self.assertNumQueries(0):
+                response = self.client.get('/classes/')
+        self.assertEqual([item['id'] for item in response.data['data']], [self.hiit.id])
+
+
+class StartTimeRenderingTests(APITestCase):
+    """
+    The batched list serializer path against per-row timezone resolution
+    and formatting, on an in-memory listing (no database involved). Timings
+    live in `manage.py bench_start_time_rendering`.
+    """
+
+    def setUp(self):
+        base = timezone.now().replace(minute=0, second=0, microsecond=0)
+        self.classes = [
+            FitnessClass(id=i, name=f"Class {i}", instructor="Alice", available_slots=10,
+                         start_time=base + timedelta(minutes=17 * i))
+            for i in range(200)
+        ]
+
+    def _per_row(self):
+        return [
+            obj.start_time.astimezone(pytz.timezone('America/New_York')).strftime('%Y-%m-%d %H:%M:%S %Z')
+            for obj in self.classes
+        ]
+
+    def _batched(self):
+        data = FitnessClassSerializer(self.classes, many=True, context={'timezone': 'America/New_York'}).data
+        return [item['start_time'] for item in data]
+
+    def test_timezone_resolved_once_per_listing(self):
+        load_timezone.cache_clear()
+        with mock.patch('booking.utils.pytz.timezone', wraps=pytz.timezone) as resolve:
+            self._batched()
+            self._batched()
+        self.assertEqual(resolve.call_count, 1)
+
+    def test_batched_rendering_matches_per_row(self):
+        self.assertEqual(self._batched(), self._per_row())
+
+    def test_timezone_names_are_normalized_before_caching(self):
+        load_timezone.cache_clear()
+        self.assertEqual(validate_timezone('america/NEW_york'), 'America/New_York')
+        self.assertIs(get_timezone('AMERICA/NEW_YORK'), get_timezone('America/New_York'))
+        self.assertEqual(load_timezone.cache_info().currsize, 1)
+        with self.assertRaises(ValidationError):
+            validate_timezone('Mars/Olympus_Mons')
+
+
+class KeysetPaginationTests(BookingAPITestCase):
+    def setUp(self):
+        super().setUp()
+        start = timezone.now() + timedelta(days=1)
+        # Pairs of classes share a start time so pages split across ties.
+        self.classes = [
+            FitnessClass.objects.create(
+                name=f"Class {i}",
+                instructor="Alice",
+                start_time=start + timedelta(hours=i // 2),
+                available_slots=5
+            )
+            for i in range(7)
+        ]
+
+    def _collect(self, url, params):
+        ids, pages = [], 0
+        while url:
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            ids.extend(item['id'] for item in response.data['data'])
+            url, params, pages = response.data['next'], None, pages + 1
+        return ids, pages
+
+    def test_classes_are_paged_by_start_time_and_id(self):
+        ids, pages = self._collect('/classes/', {'page_size': 3})
+        self.assertEqual(ids, [fitness_class.id for fitness_class in self.classes])
+        self.assertEqual(pages, 3)
+
+    def test_bookings_are_paged_by_booked_at_and_id(self):
+        booked_at = timezone.now()
+        for fitness_class in self.classes:
+            Booking.objects.create(fitness_class=fitness_class, client_name="Pat", client_email="pat@yopmail.com")
+        Booking.objects.update(booked_at=booked_at)
+        expected = list(Booking.objects.order_by('id').values_list('id', flat=True))
+
+        ids, pages = self._collect('/bookings/', {'email': 'PAT@yopmail.com', 'page_size': 2})
+        self.assertEqual(ids, expected)
+        self.assertEqual(pages, 4)
+
+        response = self.client.get('/bookings/', {'email': 'pat@yopmail.com', 'page_size': 2})
+        self.assertEqual(response.data['count'], 7)
+
+    def test_default_and_maximum_page_size(self):
+        response = self.client.get('/classes/')
+        self.assertEqual(len(response.data['data']), 7)
+        self.assertIsNone(response.data['next'])
+
+        with self.settings(BOOKING_MAX_PAGE_SIZE=4):
+            response = self.client.get('/classes/', {'page_size': 50})
+        self.assertEqual(len(response.data['data']), 4)
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/classes/', {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get('/bookings/', {'email': 'pat@yopmail.com', 'page_size': 0})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class QueryPlanTests(APITestCase):
+    """
+    Asserts on SQLite's EXPLAIN QUERY PLAN that the list queries are served
+    by the indexes added in 0002_indexes rather than a table scan.
+    """
+
+    def _query_plan(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+            return " ".join(row[-1] for row in cursor.fetchall())
+
+    def test_upcoming_classes_use_start_time_index(self):
+        queryset = FitnessClass.objects.filter(start_time__gte=timezone.now()).order_by('start_time', 'id')
+        plan = self._query_plan(queryset)
+        self.assertIn("USING INDEX fitnessclass_start_time_idx", plan)
+        self.assertNotIn("USE TEMP B-TREE", plan)
+
+    def test_email_lookup_matches_non_ascii_addresses(self):
+        yoga = create_class()
+        booking = Booking.objects.create(fitness_class=yoga, client_name="Émile", client_email="Émile@YopMail.com")
+        self.assertEqual(list(Booking.objects.for_email("Émile@yopmail.com")), [booking])
+        # No lookup is registered on Django's EmailField for every app.
+        self.assertNotIn('lower', EmailField.get_lookups())
+
+    def test_booking_email_lookup_uses_lower_email_index(self):
+        queryset = Booking.objects.for_email('User@YopMail.com').order_by('booked_at', 'id')
+        plan = self._query_plan(queryset)
+        self.assertIn("USING INDEX booking_email_lower_idx", plan)
+        self.assertNotIn("USE TEMP B-TREE", plan)
+
+
+class QueryCountAssertionsMixin:
+    """
+    Fails when an endpoint's query count grows with the size of its result,
+    i.e. when a serializer lazily loads a relation per row.
+    """
+
+    def assertQueryCountIndependentOfSize(self, add_rows, make_request, sizes=(1, 5, 20)):
+        counts = {}
+        total = 0
+        for size in sizes:
+            add_rows(size - total)
+            total = size
+            cache.clear()
+            with CaptureQueriesContext(connection) as queries:
+                response = make_request()
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            counts[size] = len(queries)
+        self.assertEqual(
+            len(set(counts.values())), 1,
+            f"Query count grows with result size: {counts}"
+        )
+
+
+class QueryCountTests(QueryCountAssertionsMixin, BookingAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.start = timezone.now() + timedelta(days=1)
+
+    def _add_classes(self, count):
+        for _ in range(count):
+            FitnessClass.objects.create(
+                name="Pilates", instructor="Alice", start_time=self.start, available_slots=5
+            )
+
+    def _add_bookings(self, count):
+        for _ in range(count):
+            fitness_class = FitnessClass.objects.create(
+                name="Spin", instructor="Bob", start_time=self.start, available_slots=5
+            )
+            Booking.objects.create(fitness_class=fitness_class, client_name="Pat", client_email="pat@yopmail.com")
+
+    def test_class_list_query_count(self):
+        self.assertQueryCountIndependentOfSize(
+            self._add_classes, lambda: self.client.get('/classes/', {'page_size': 50})
+        )
+
+    def test_booking_list_query_count(self):
+        self.assertQueryCountIndependentOfSize(
+            self._add_bookings, lambda: self.client.get('/bookings/', {'email': 'pat@yopmail.com', 'page_size': 50})
+        )
+
+
+class BulkBookingTests(BookingAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.yoga = create_class(available_slots=3)
+        self.hiit = create_class("HIIT", "Bob", available_slots=1, starts_in=timedelta(days=2))
+
+    def _bookings(self, *class_names):
+        return [
+            {"fitness_class": name, "client_name": f"Client {i}", "client_email": f"client{i}@yopmail.com"}
+            for i, name in enumerate(class_names)
+        ]
+
+    def test_bulk_booking_all_succeed(self):
+        bookings = self._bookings("Yoga Class", "Yoga Class", "HIIT")
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/book/bulk/', {"bookings": bookings}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        statements = [query['sql'].split()[0] for query in queries]
+        self.assertEqual([s for s in statements if s in ('SELECT', 'UPDATE', 'INSERT')], ['SELECT', 'UPDATE', 'INSERT'])
+        self.assertEqual(response.data['booked'], 3)
+        self.assertTrue(all(result['booking_id'] for result in response.data['results']))
+
+        self.yoga.refresh_from_db()
+        self.hiit.refresh_from_db()
+        self.assertEqual((self.yoga.available_slots, self.hiit.available_slots), (1, 0))
+
+    def test_atomic_bulk_booking_is_all_or_nothing(self):
+        bookings = self._bookings("Yoga Class", "HIIT", "HIIT")
+        response = self.client.post('/book/bulk/', {"bookings": bookings}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual([result['status'] for result in response.data['results']], ["skipped", "failed", "failed"])
+        self.assertEqual(Booking.objects.count(), 0)
+        self.yoga.refresh_from_db()
+        self.assertEqual(self.yoga.available_slots, 3)
+
+    def test_best_effort_bulk_booking_reports_partial_success(self):
+        bookings = self._bookings("Yoga Class", "HIIT", "HIIT", "Unknown")
+        bookings.append({"fitness_class": "Yoga Class", "client_name": "No Email"})
+        response = self.client.post('/book/bulk/', {"bookings": bookings, "atomic": False}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual(
+            [result['status'] for result in response.data['results']],
+            ["booked", "booked", "failed", "failed", "failed"]
+        )
+        self.assertIn('client_email', response.data['results'][4]['errors'])
+        self.assertEqual(Booking.objects.count(), 2)
+        self.hiit.refresh_from_db()
+        self.assertEqual(self.hiit.available_slots, 0)
+
+    def test_bulk_booking_size_limit(self):
+        with self.settings(BOOKING_BULK_MAX_ITEMS=2):
+            response = self.client.post('/book/bulk/', {"bookings": self._bookings("HIIT", "HIIT", "HIIT")}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('bookings', response.data['errors'])
+
+
+class CustomLoggerTests(APITestCase):
+    def test_logger_handlers_are_not_duplicated(self):
+        first = CustomLogger('booking.tests.logger').get_custom_logger()
+        second = CustomLogger('booking.tests.logger').get_custom_logger()
+        self.assertIs(first, second)
+        self.assertEqual(len(second.handlers), 1)
+        self.assertIsInstance(second.handlers[0], logging.handlers.QueueHandler)
+
+    def test_logger_level_from_settings(self):
+        with self.settings(LOG_LEVEL='INFO', LOG_LEVELS={'booking.tests.quiet': 'ERROR'}):
+            quiet = CustomLogger('booking.tests.quiet').get_custom_logger()
+        self.assertFalse(quiet.isEnabledFor(logging.WARNING))
+
+    def test_daily_log_file_rolls_over_at_midnight(self):
+        with tempfile.TemporaryDirectory() as logs_dir:
+            handler = DailyLogFileHandler(logs_dir)
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            today = time.time()
+            for created, message in ((today, "today"), (today + 86400, "tomorrow")):
+                record = logging.makeLogRecord({'msg': message, 'created': created})
+                handler.emit(record)
+            handler.close()
+
+            for created, message in ((today, "today"), (today + 86400, "tomorrow")):
+                day = date.fromtimestamp(created).strftime('%Y-%m-%d')
+                with open(os.path.join(logs_dir, 'logs', day, 'logs.txt')) as log_file:
+                    self.assertEqual(log_file.read().strip(), message)
+
+
+class SeedDataTests(APITestCase):
+    HEADER = ('Class Name', 'Start Time', 'Instructor', 'Available Slots')
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+
+    def _write_xlsx(self, rows, header=HEADER):
+        import openpyxl
+
+        path = os.path.join(self.tmp_dir.name, 'classes.xlsx')
+        workbook = openpyxl.Workbook()
+        workbook.active.append(header)
+        for row in rows:
+            workbook.active.append(row)
+        workbook.save(path)
+        return path
+
+    def test_import_in_chunks_converts_to_utc(self):
+        rows = [(f"Class {i}", f"2030-01-01 {7 + i % 10:02d}:00:00", "Priya", 10) for i in range(25)]
+        path = self._write_xlsx(rows)
+
+        call_command('seed_data', file=path, timezone='Asia/Kolkata', chunk_size=10, batch_size=4)
+
+        self.assertEqual(FitnessClass.objects.count(), 25)
+        first = FitnessClass.objects.get(name="Class 0")
+        self.assertEqual(first.start_time, datetime(2030, 1, 1, 1, 30, tzinfo=dt_timezone.utc))
+
+    def test_source_timezone_argument(self):
+        path = self._write_xlsx([("Yoga", "2030-01-01 07:00:00", "Priya", 10)])
+        call_command('seed_data', file=path, timezone='Europe/London')
+        self.assertEqual(
+            FitnessClass.objects.get().start_time, datetime(2030, 1, 1, 7, 0, tzinfo=dt_timezone.utc)
+        )
+
+    def test_invalid_rows_are_skipped(self):
+        path = self._write_xlsx([
+            ("Yoga", "2030-01-01 07:00:00", "Priya", 10),
+            ("Zumba", "not a date", "Ankit", 10),
+            ("HIIT", "2030-01-01 09:00:00", "Sneha", "many"),
+            (None, "2030-01-01 10:00:00", "John", 5),
+        ])
+        call_command('seed_data', file=path)
+        self.assertEqual(list(FitnessClass.objects.values_list('name', flat=True)), ["Yoga"])
+
+    def test_mixed_start_time_formats(self):
+        path = self._write_xlsx([
+            ("Yoga", "2030-01-01 07:00:00", "Priya", 10),
+            ("Zumba", "01/02/2030 07:00", "Ankit", 10),
+            ("HIIT", datetime(2030, 1, 3, 7, 0), "Sneha", 10),
+            ("Pilates", "4 Jan 2030 7:00 AM", "John", 10),
+        ])
+        call_command('seed_data', file=path, timezone='Asia/Kolkata')
+        self.assertEqual(
+            list(FitnessClass.objects.order_by('start_time').values_list('name', 'start_time')),
+            [(name, datetime(2030, 1, day, 1, 30, tzinfo=dt_timezone.utc))
+             for day, name in enumerate(["Yoga", "Zumba", "HIIT", "Pilates"], start=1)]
+        )
+
+    def test_missing_columns_import_nothing(self):
+        path = self._write_xlsx([("Yoga", "2030-01-01 07:00:00", 10)], header=('Class Name', 'Start Time', 'Available Slots'))
+        call_command('seed_data', file=path)
+        self.assertFalse(FitnessClass.objects.exists())
+
+    def test_upsert_is_idempotent_and_applies_changes(self):
+        rows = [(f"Class {i}", f"2030-01-01 {7 + i:02d}:00:00", "Priya", 10) for i in range(5)]
+        path = self._write_xlsx(rows)
+        call_command('seed_data', file=path, upsert=True)
+        call_command('seed_data', file=path, upsert=True)
+        self.assertEqual(FitnessClass.objects.count(), 5)
+
+        rows[0] = ("Class 0", "2030-01-01 07:00:00", "Priya", 3)
+        rows.append(("Class 5", "2030-01-01 12:00:00", "Priya", 10))
+        path = self._write_xlsx(rows)
+        with mock.patch('booking.management.commands.seed_data.logger') as seed_logger:
+            with CaptureQueriesContext(connection) as queries:
+                call_command('seed_data', file=path, upsert=True, chunk_size=100)
+        seed_logger.info.assert_called_with(
+            "Schedule synced: %d inserted, %d updated, %d unchanged.", 1, 1, 4
+        )
+        self.assertEqual(len([q for q in queries if not q['sql'].startswith(('SAVEPOINT', 'RELEASE'))]), 3)
+        self.assertEqual(FitnessClass.objects.count(), 6)
+        self.assertEqual(FitnessClass.objects.get(name="Class 0").available_slots, 3)
+
+    def test_upsert_applies_capacity_changes_to_free_slots(self):
+        path = self._write_xlsx([("Yoga", "2030-01-01 07:00:00", "Priya", 10)])
+        call_command('seed_data', file=path, upsert=True)
+        yoga = FitnessClass.objects.get()
+        for number in range(4):
+            Booking.objects.create(fitness_class=yoga, client_name="Client", client_email=f"c{number}@yopmail.com")
+            FitnessClass.objects.reserve_slots(yoga.id)
+
+        call_command('seed_data', file=self._write_xlsx([("Yoga", "2030-01-01 07:00:00", "Priya", 12)]), upsert=True)
+        yoga.refresh_from_db()
+        self.assertEqual((yoga.capacity, yoga.available_slots), (12, 8))
+
+        # Never below zero, even when the class shrinks under its bookings.
+        call_command('seed_data', file=self._write_xlsx([("Yoga", "2030-01-01 07:00:00", "Priya", 3)]), upsert=True)
+        yoga.refresh_from_db()
+        self.assertEqual((yoga.capacity, yoga.available_slots), (3, 0))
+
+    def test_upsert_leaves_called_off_classes_alone(self):
+        path = self._write_xlsx([("Yoga", "2030-01-01 07:00:00", "Priya", 10)])
+        call_command('seed_data', file=path, upsert=True)
+        FitnessClass.objects.call_off()
+
+        call_command('seed_data', file=self._write_xlsx([("Yoga", "2030-01-01 07:00:00", "Priya", 12)]), upsert=True)
+        yoga = FitnessClass.objects.get()
+        self.assertEqual((yoga.capacity, yoga.available_slots), (10, 0))
+
+    def _schedule_frame(self):
+        import pandas as pd
+
+        return pd.DataFrame({
+            'Class Name': ["Yoga", "Zumba"],
+            'Start Time': ["2030-01-01 07:00:00", "2030-01-02 18:30:00"],
+            'Instructor': ["Priya", "Ankit"],
+            'Available Slots': [15, 20],
+        })
+
+    def _assert_imported(self, path):
+        call_command('seed_data', file=path, chunk_size=1)
+        self.assertEqual(
+            list(FitnessClass.objects.order_by('start_time').values_list('name', 'start_time', 'available_slots')),
+            [("Yoga", datetime(2030, 1, 1, 1, 30, tzinfo=dt_timezone.utc), 15),
+             ("Zumba", datetime(2030, 1, 2, 13, 0, tzinfo=dt_timezone.utc), 20)]
+        )
+
+    def test_import_csv(self):
+        path = os.path.join(self.tmp_dir.name, 'classes.csv')
+        self._schedule_frame().to_csv(path, index=False)
+        self._assert_imported(path)
+
+    def test_import_json_lines(self):
+        path = os.path.join(self.tmp_dir.name, 'classes.jsonl')
+        self._schedule_frame().to_json(path, orient='records', lines=True)
+        self._assert_imported(path)
+
+    def test_import_parquet(self):
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            self.skipTest("pyarrow is not installed")
+        path = os.path.join(self.tmp_dir.name, 'classes.parquet')
+        self._schedule_frame().to_parquet(path, index=False)
+        self._assert_imported(path)
+
+    def test_command_registry_does_not_import_pandas(self):
+        code = (
+            "import os, sys, django;"
+            "os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'fitness_studio.settings');"
+            "django.setup();"
+            "from django.core.management import load_command_class;"
+            "load_command_class('booking', 'seed_data');"
+            "sys.exit('pandas' in sys.modules)"
+        )
+        result = subprocess.run([sys.executable, '-c', code], cwd=settings.BASE_DIR)
+        self.assertEqual(result.returncode, 0)
+
+    def test_format_benchmark_runs(self):
+        out = StringIO()
+        call_command('bench_seed_formats', rows=20, chunk_size=8, stdout=out)
+        self.assertIn('csv', out.getvalue())
+        self.assertIn('jsonl', out.getvalue())
+
+
+class AsyncURLConf:
+    urlpatterns = async_urlpatterns
+
+
+class AsyncViewTests(BookingAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.yoga = create_class(available_slots=1)
+        create_class("HIIT", "Bob", starts_in=timedelta(days=2))
+        Booking.objects.create(fitness_class=self.yoga, client_name="Pat", client_email="pat@yopmail.com")
+
+    async def _get_both(self, path, params):
+        sync_response = await sync_to_async(self.client.get)(path, params)
+        with self.settings(ROOT_URLCONF=AsyncURLConf):
+            async_response = await self.async_client.get(path, params)
+        return sync_response, async_response
+
+    async def test_async_class_list_matches_sync(self):
+        for params in ({'timezone': 'Europe/London', 'page_size': 1}, {'timezone': 'Invalid/Zone'}):
+            sync_response, async_response = await self._get_both('/classes/', params)
+            self.assertEqual(async_response.status_code, sync_response.status_code)
+            self.assertEqual(async_response.content, sync_response.content)
+
+    async def test_async_booking_list_matches_sync(self):
+        for params in ({'email': 'PAT@yopmail.com'}, {}):
+            sync_response, async_response = await self._get_both('/bookings/', params)
+            self.assertEqual(async_response.status_code, sync_response.status_code)
+            self.assertEqual(async_response.content, sync_response.content)
+
+    async def test_async_booking(self):
+        booking = {"fitness_class": "Yoga Class", "client_name": "John Doe", "client_email": "john@yopmail.com"}
+        with self.settings(ROOT_URLCONF=AsyncURLConf):
+            response = await self.async_client.post('/book/', booking, content_type='application/json')
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            self.assertIn('booking_id', response.json())
+
+            response = await self.async_client.post('/book/', booking, content_type='application/json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertEqual(response.json()['errors'], {'non_field_errors': ["No available slots for this class."]})
+
+            response = await self.async_client.post('/book/', dict(booking, fitness_class="Unknown"),
+                                                     content_type='application/json')
+            self.assertIn('fitness_class', response.json()['errors'])
+
+        await self.yoga.arefresh_from_db()
+        self.assertEqual(self.yoga.available_slots, 0)
+
+    async def test_async_booking_accepts_form_data(self):
+        booking = {"fitness_class": "HIIT", "client_name": "John Doe", "client_email": "john@yopmail.com"}
+        with self.settings(ROOT_URLCONF=AsyncURLConf):
+            response = await self.async_client.post('/book/', booking)
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+            response = await self.async_client.post('/book/', urlencode(dict(booking, client_email="jane@yopmail.com")),
+                                                     content_type='application/x-www-form-urlencoded')
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+            response = await self.async_client.post('/book/', "fitness_class=HIIT", content_type='text/plain')
+            self.assertEqual(response.status_code, status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+
+        self.assertEqual(await Booking.objects.filter(fitness_class__name="HIIT").acount(), 2)
+
+
+class FastJSONTests(BookingAPITestCase):
+    def setUp(self):
+        super().setUp()
+        start = timezone.now() + timedelta(days=1)
+        for i, name in enumerate(["Yoga Class", "Zumba été \U0001F525", "Line\u2028Break \"quoted\""]):
+            fitness_class = FitnessClass.objects.create(
+                name=name, instructor="Renée", start_time=start + timedelta(hours=i), available_slots=5 + i
+            )
+            Booking.objects.create(fitness_class=fitness_class, client_name="Pat Ø", client_email="pat@yopmail.com")
+
+    def _assert_identical(self, path, params):
+        cache.clear()
+        with self.settings(BOOKING_FAST_JSON=False):
+            regular = self.client.get(path, params)
+        cache.clear()
+        with self.settings(BOOKING_FAST_JSON=True):
+            fast = self.client.get(path, params)
+        self.assertEqual(fast.status_code, status.HTTP_200_OK)
+        self.assertEqual(fast.content, regular.content)
+        self.assertEqual(fast['Content-Type'], regular['Content-Type'])
+
+    def test_class_list_is_byte_identical(self):
+        self._assert_identical('/classes/', {'timezone': 'America/New_York'})
+        self._assert_identical('/classes/', {'page_size': 2})
+
+    def test_booking_list_is_byte_identical(self):
+        self._assert_identical('/bookings/', {'email': 'pat@yopmail.com'})
+        self._assert_identical('/bookings/', {'email': 'pat@yopmail.com', 'page_size': 2})
+
+    def test_renderer_matches_drf_with_and_without_orjson(self):
+        data = {"when": timezone.now(), "text": "a\u2028b\u2029c é", "items": [1, None, True]}
+        expected = JSONRenderer().render(data)
+        self.assertEqual(FastJSONRenderer().render(data), expected)
+        with mock.patch('booking.renderers.orjson', None):
+            self.assertEqual(FastJSONRenderer().render(data), expected)
+
+
+class ConditionalGetTests(BookingAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.yoga = create_class(starts_in=timedelta(hours=1))
+        self.hiit = create_class("HIIT", "Bob", starts_in=timedelta(hours=3))
+        Booking.objects.create(fitness_class=self.yoga, client_name="Pat", client_email="pat@yopmail.com")
+
+    def test_unchanged_class_list_returns_304_from_cache(self):
+        response = self.client.get('/classes/')
+        self.assertIn('ETag', response)
+        self.assertIn('Last-Modified', response)
+
+        with self.assertNumQueries(0):
+            response = self.client.get('/classes/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response.content, b'')
+
+    def test_class_list_validators_change_with_data_and_timezone(self):
+        etag = self.client.get('/classes/')['ETag']
+        self.assertNotEqual(self.client.get('/classes/', {'timezone': 'Europe/London'})['ETag'], etag)
+
+        self.client.post('/book/', {
+            "fitness_class": self.hiit.name, "client_name": "John Doe", "client_email": "john@yopmail.com"
+        }, format='json')
+        response = self.client.get('/classes/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_class_roll_off_counts_as_modification(self):
+        response = self.client.get('/classes/')
+        later = timezone.now() + timedelta(hours=2)
+        with mock.patch('booking.cache.timezone.now', return_value=later):
+            rolled = self.client.get('/classes/', HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(rolled.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(rolled['ETag'], response['ETag'])
+
+    def test_if_modified_since(self):
+        last_modified = self.client.get('/classes/')['Last-Modified']
+        response = self.client.get('/classes/', HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_booking_list_returns_304_until_bookings_change(self):
+        response = self.client.get('/bookings/', {'email': 'pat@yopmail.com'})
+        etag = response['ETag']
+
+        response = self.client.get('/bookings/', {'email': 'PAT@yopmail.com'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        Booking.objects.create(fitness_class=self.hiit, client_name="Pat", client_email="pat@yopmail.com")
+        response = self.client.get('/bookings/', {'email': 'pat@yopmail.com'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 2)
+
+    def test_deletes_move_last_modified(self):
+        an_hour_ago = timezone.now() - timedelta(hours=1)
+        FitnessClass.objects.update(updated_at=an_hour_ago)
+        Booking.objects.update(updated_at=an_hour_ago)
+        Booking.objects.create(fitness_class=self.hiit, client_name="Pat", client_email="pat@yopmail.com")
+        Booking.objects.filter(fitness_class=self.hiit).update(updated_at=an_hour_ago)
+        classes = self.client.get('/classes/')['Last-Modified']
+        bookings = self.client.get('/bookings/', {'email': 'pat@yopmail.com'})['Last-Modified']
+
+        Booking.objects.filter(fitness_class=self.hiit).delete()
+        response = self.client.get('/bookings/', {'email': 'PAT@yopmail.com'}, HTTP_IF_MODIFIED_SINCE=bookings)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 1)
+
+        self.hiit.delete()
+        response = self.client.get('/classes/', HTTP_IF_MODIFIED_SINCE=classes)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([item['id'] for item in response.data['data']], [self.yoga.id])
+
+    def test_renamed_class_changes_booking_list(self):
+        etag = self.client.get('/bookings/', {'email': 'pat@yopmail.com'})['ETag']
+        FitnessClass.objects.filter(pk=self.yoga.pk).update(
+            name="Power Yoga", updated_at=timezone.now() + timedelta(seconds=1)
+        )
+        response = self.client.get('/bookings/', {'email': 'pat@yopmail.com'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class SlotStreamTests(BookingAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.yoga = create_class(available_slots=3)
+
+    def test_hub_coalesces_events_per_class(self):
+        hub = SlotEventHub()
+        first, second = hub.subscribe(), hub.subscribe()
+        hub.publish([{"id": 1, "available_slots": 3}, {"id": 1, "available_slots": 2}, {"id": 2, "available_slots": 0}])
+        hub.unsubscribe(second)
+        hub.publish([{"id": 2, "available_slots": 1}])
+
+        self.assertEqual(first.wait(0), [{"id": 1, "available_slots": 2}, {"id": 2, "available_slots": 1}])
+        self.assertEqual(second.wait(0), [{"id": 1, "available_slots": 2}, {"id": 2, "available_slots": 0}])
+        self.assertEqual(first.wait(0), [])
+        hub.unsubscribe(first)
+        self.assertFalse(hub.has_subscribers)
+
+    def test_no_publishing_without_subscribers(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            FitnessClass.objects.reserve_slots(self.yoga.id)
+        self.assertEqual(callbacks, [])
+
+    def test_stream_sends_snapshot_heartbeat_and_booking_updates(self):
+        with self.settings(BOOKING_SSE_HEARTBEAT=0.01):
+            response = self.client.get('/classes/stream/')
+            self.assertEqual(response['Content-Type'], 'text/event-stream')
+            self.assertEqual(response['Cache-Control'], 'no-cache')
+            stream = iter(response.streaming_content)
+
+            self.assertEqual(
+                next(stream),
+                b'event: snapshot\ndata: [{"id":%d,"available_slots":3}]\n\n' % self.yoga.id,
+            )
+            self.assertEqual(next(stream), b': keep-alive\n\n')
+
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post('/book/', {
+                    "fitness_class": "Yoga Class", "client_name": "John Doe", "client_email": "john@yopmail.com"
+                }, format='json')
+            self.assertEqual(next(stream), b'event: slots\ndata: {"id":%d,"available_slots":2}\n\n' % self.yoga.id)
+
+            response.close()
+        self.assertFalse(slot_events.has_subscribers)
+
+    async def test_async_stream(self):
+        with self.settings(BOOKING_SSE_HEARTBEAT=0.01):
+            response = await self.async_client.get('/classes/stream/')
+            self.assertTrue(response.is_async)
+
+        stream = SlotAvailabilityStreamView().astream(0.01)
+        self.assertTrue((await anext(stream)).startswith('event: snapshot\n'))
+        self.assertEqual(await anext(stream), ': keep-alive\n\n')
+
+        slot_events.publish([{"id": self.yoga.id, "available_slots": 0}])
+        self.assertEqual(await anext(stream), 'event: slots\ndata: {"id":%d,"available_slots":0}\n\n' % self.yoga.id)
+        await stream.aclose()
+        self.assertFalse(slot_events.has_subscribers)
+
+
+class WaitlistTests(BookingAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.yoga = create_class(available_slots=0)
+
+    def _book(self, email, **extra):
+        return self.client.post('/book/', dict({
+            "fitness_class": "Yoga Class", "client_name": email.split('@')[0], "client_email": email
+        }, **extra), format='json')
+
+    def test_full_class_queues_clients_in_order(self):
+        response = self._book("pat@yopmail.com")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self._book("pat@yopmail.com", waitlist=True)
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data['position'], 1)
+        self.assertEqual(self._book("sam@yopmail.com", waitlist=True).data['position'], 2)
+
+        # Joining again keeps the original place.
+        response = self._book("PAT@yopmail.com", waitlist=True)
+        self.assertEqual(response.data['position'], 1)
+        self.assertEqual(WaitlistEntry.objects.count(), 2)
+
+    def test_added_slots_promote_the_head_of_the_queue(self):
+        for email in ("pat@yopmail.com", "sam@yopmail.com", "kim@yopmail.com"):
+            self._book(email, waitlist=True)
+
+        self.yoga.available_slots = 2
+        self.yoga.save()
+
+        self.yoga.refresh_from_db()
+        self.assertEqual(self.yoga.available_slots, 0)
+        self.assertEqual(
+            sorted(Booking.objects.values_list('client_email', flat=True)), ["pat@yopmail.com", "sam@yopmail.com"]
+        )
+
+        response = self.client.get('/waitlist/', {'email': 'KIM@yopmail.com'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['data']), 1)
+        self.assertEqual(response.data['data'][0]['fitness_class'], "Yoga Class")
+        self.assertEqual(response.data['data'][0]['position'], 1)
+
+    def test_join_takes_a_slot_freed_in_the_meantime(self):
+        FitnessClass.objects.filter(pk=self.yoga.pk).update(available_slots=1)
+        entry = WaitlistEntry.objects.join(self.yoga, "Pat", "pat@yopmail.com")
+        self.assertIsNotNone(entry.booking)
+        self.assertFalse(WaitlistEntry.objects.exists())
+
+    def test_promote_skips_an_entry_claimed_concurrently(self):
+        FitnessClass.objects.filter(pk=self.yoga.pk).update(available_slots=1)
+        first = WaitlistEntry.objects.create(fitness_class=self.yoga, client_name="Pat", client_email="pat@yopmail.com")
+        WaitlistEntry.objects.create(fitness_class=self.yoga, client_name="Sam", client_email="sam@yopmail.com")
+
+        delete = WaitlistQuerySet.delete
+
+        def claimed_elsewhere(queryset):
+            if queryset.filter(pk=first.pk).exists():
+                delete(queryset)
+                return 0, {}
+            return delete(queryset)
+
+        with mock.patch.object(WaitlistQuerySet, 'delete', claimed_elsewhere):
+            promoted = WaitlistEntry.objects.promote(self.yoga.id)
+
+        self.assertEqual([booking.client_email for _, booking in promoted], ["sam@yopmail.com"])
+        self.yoga.refresh_from_db()
+        self.assertEqual(self.yoga.available_slots, 0)
+
+    async def test_async_booking_joins_waitlist(self):
+        with self.settings(ROOT_URLCONF=AsyncURLConf):
+            response = await self.async_client.post('/book/', {
+                "fitness_class": "Yoga Class", "client_name": "Pat", "client_email": "pat@yopmail.com", "waitlist": True
+            }, content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.json()['position'], 1)
+
+
+class CancellationTests(BookingAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.yoga = create_class(available_slots=1)
+        self.booking = Booking.objects.create(fitness_class=self.yoga, client_name="Pat", client_email="pat@yopmail.com")
+
+    def _cancel(self, booking_id, email):
+        return self.client.post(f'/bookings/{booking_id}/cancel/', {"client_email": email}, format='json')
+
+    def test_cancel_restores_slot_once(self):
+        self.assertEqual(self._cancel(self.booking.id, "sam@yopmail.com").status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self._cancel(self.booking.id, "").status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self._cancel(self.booking.id, "PAT@yopmail.com")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self._cancel(self.booking.id, "pat@yopmail.com")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['message'], "Booking is already cancelled.")
+
+        self.yoga.refresh_from_db()
+        self.assertEqual(self.yoga.available_slots, 2)
+        self.booking.refresh_from_db()
+        self.assertIsNotNone(self.booking.cancelled_at)
+
+        response = self.client.get('/bookings/', {'email': 'pat@yopmail.com'})
+        self.assertEqual(response.data['count'], 0)
+        self.assertEqual(response.data['data'], [])
+        response = self.client.get('/classes/')
+        self.assertEqual(response.data['data'][0]['available_slots'], 2)
+
+    def test_cancel_promotes_the_waitlist(self):
+        FitnessClass.objects.filter(pk=self.yoga.pk).update(available_slots=0)
+        WaitlistEntry.objects.create(fitness_class=self.yoga, client_name="Sam", client_email="sam@yopmail.com")
+
+        self._cancel(self.booking.id, "pat@yopmail.com")
+
+        self.yoga.refresh_from_db()
+        self.assertEqual(self.yoga.available_slots, 0)
+        self.assertFalse(WaitlistEntry.objects.exists())
+        self.assertEqual(list(Booking.objects.active().values_list('client_email', flat=True)), ["sam@yopmail.com"])
+
+    def test_call_off_cancels_every_booking(self):
+        Booking.objects.create(fitness_class=self.yoga, client_name="Sam", client_email="sam@yopmail.com")
+        WaitlistEntry.objects.create(fitness_class=self.yoga, client_name="Kim", client_email="kim@yopmail.com")
+        FitnessClass.objects.filter(pk=self.yoga.pk).update(available_slots=0)
+
+        with self.assertNumQueries(5):
+            cancelled = Booking.objects.filter(fitness_class=self.yoga).cancel(promote=False)
+        self.assertEqual(cancelled, 2)
+        self.assertEqual(Booking.objects.filter(fitness_class=self.yoga).cancel(), 0)
+
+        self.yoga.refresh_from_db()
+        self.assertEqual(self.yoga.available_slots, 2)
+        self.assertTrue(WaitlistEntry.objects.exists())
+
+    def test_called_off_class_is_unlisted_and_not_bookable(self):
+        WaitlistEntry.objects.create(fitness_class=self.yoga, client_name="Kim", client_email="kim@yopmail.com")
+        self.assertEqual(FitnessClass.objects.filter(pk=self.yoga.pk).call_off(), 1)
+
+        self.yoga.refresh_from_db()
+        self.assertIsNotNone(self.yoga.called_off_at)
+        self.assertEqual(self.yoga.available_slots, 0)
+        self.assertFalse(WaitlistEntry.objects.exists())
+        self.assertEqual(self.client.get('/classes/').data['data'], [])
+
+        for waitlist in (False, True):
+            response = self.client.post('/book/', {
+                "fitness_class": self.yoga.name, "client_name": "Sam", "client_email": "sam@yopmail.com",
+                "waitlist": waitlist,
+            }, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertEqual(response.data['errors'], {'non_field_errors': ["This class has been called off."]})
+        self.assertFalse(FitnessClass.objects.reserve_slots(self.yoga.id))
+        # A later cancellation gives nothing back either.
+        self.assertFalse(FitnessClass.objects.release_slots(self.yoga.id))
+        self.assertFalse(Booking.objects.active().exists())
+        self.assertFalse(WaitlistEntry.objects.exists())
+
+
+class ConcurrentCancellationTests(APITransactionTestCase):
+    CAPACITY = 5
+
+    def _retry(self, operation):
+        # SQLite raises instead of waiting when two connections write at once;
+        # the failed transaction rolled back, so it is simply run again.
+        while True:
+            try:
+                return operation()
+            except OperationalError:
+                time.sleep(0.001)
+
+    def test_slot_counter_stays_consistent(self):
+        yoga = FitnessClass.objects.create(
+            name="Yoga Class", instructor="Alice", start_time=timezone.now() + timedelta(days=1),
+            available_slots=self.CAPACITY,
+        )
+        booked, cancelled, errors = [], [], []
+        done = threading.Event()
+
+        def client(number):
+            # Books repeatedly and cancels each booking itself.
+            try:
+                for _ in range(10):
+                    data = {"fitness_class": yoga, "client_name": "Client", "client_email": f"c{number}@yopmail.com"}
+                    try:
+                        booking = self._retry(lambda: BookingSerializer().create(dict(data)))
+                    except ValidationError:
+                        continue
+                    booked.append(booking.pk)
+                    cancelled.append(self._retry(Booking.objects.filter(pk=booking.pk).cancel))
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connections.close_all()
+
+        def canceller():
+            # Calls the class off over and over, racing the clients' own cancellations.
+            try:
+                while not done.is_set():
+                    cancelled.append(self._retry(Booking.objects.filter(fitness_class=yoga).cancel))
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connections.close_all()
+
+        clients = [threading.Thread(target=client, args=(number,)) for number in range(8)]
+        cancellers = [threading.Thread(target=canceller) for _ in range(2)]
+        for thread in clients + cancellers:
+            thread.start()
+        for thread in clients:
+            thread.join()
+        done.set()
+        for thread in cancellers:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertTrue(booked)
+        # Every booking was cancelled exactly once and gave exactly one slot back.
+        self.assertEqual(sum(cancelled), len(booked))
+        yoga.refresh_from_db()
+        self.assertFalse(Booking.objects.active().exists())
+        self.assertEqual(yoga.available_slots, self.CAPACITY)
+
+
+class IdempotencyKeyTests(BookingAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.yoga = create_class()
+        self.booking = {"fitness_class": "Yoga Class", "client_name": "Pat", "client_email": "pat@yopmail.com"}
+
+    def _book(self, key, booking=None):
+        return self.client.post('/book/', booking or self.booking, format='json', HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retry_replays_the_first_answer_with_one_lookup(self):
+        first = self._book("retry-1")
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+
+        with self.assertNumQueries(1):
+            retry = self._book("retry-1")
+        self.assertEqual(retry.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry.data, first.data)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+
+        self.yoga.refresh_from_db()
+        self.assertEqual(self.yoga.available_slots, 4)
+        self.assertEqual(Booking.objects.count(), 1)
+
+        self.assertEqual(self._book("retry-2").status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Booking.objects.count(), 2)
+
+    def test_key_reused_for_another_request_is_refused(self):
+        self._book("retry-1")
+        response = self._book("retry-1", dict(self.booking, client_email="sam@yopmail.com"))
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+        self.assertEqual(self._book("x" * 256).status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_failed_booking_is_not_stored(self):
+        FitnessClass.objects.filter(pk=self.yoga.pk).update(available_slots=0)
+        self.assertEqual(self._book("retry-1").status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+    def test_concurrent_retry_is_rolled_back(self):
+        # The other request's key is committed between this request's lookup and its insert.
+        IdempotencyKey.objects.create(
+            key="retry-1", fingerprint=request_fingerprint(self.booking), status_code=201,
+            response={"message": "Booking successful.", "booking_id": 99},
+        )
+        with mock.patch.object(IdempotencyKey.objects, 'find', side_effect=[None, IdempotencyKey.objects.get()]):
+            response = self._book("retry-1")
+        self.assertEqual(response.data['booking_id'], 99)
+        self.assertFalse(Booking.objects.exists())
+        self.yoga.refresh_from_db()
+        self.assertEqual(self.yoga.available_slots, 5)
+
+    def test_expired_keys_are_purged_and_reusable(self):
+        self._book("retry-1")
+        IdempotencyKey.objects.update(created_at=timezone.now() - timedelta(days=2))
+        response = self._book("retry-1")
+        self.assertNotIn('Idempotent-Replayed', response)
+        self.assertEqual(Booking.objects.count(), 2)
+
+        IdempotencyKey.objects.update(created_at=timezone.now() - timedelta(days=2))
+        call_command('purge_idempotency_keys')
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+    async def test_async_booking_replays(self):
+        with self.settings(ROOT_URLCONF=AsyncURLConf):
+            first = await self.async_client.post('/book/', self.booking, content_type='application/json',
+                                                 headers={'Idempotency-Key': 'retry-1'})
+            retry = await self.async_client.post('/book/', self.booking, content_type='application/json',
+                                                 headers={'Idempotency-Key': 'retry-1'})
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry.content, first.content)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(await Booking.objects.acount(), 1)
+
+
+class ThrottlingTests(APITestCase):
+    def setUp(self):
+        get_bucket_store().clear()
+        self.yoga = create_class(available_slots=50)
+
+    def test_bucket_refills_at_the_configured_rate(self):
+        for store in (MemoryBucketStore(), CacheBucketStore()):
+            buckets = [('throttle:test:refill', 3, 60)]
+            self.assertEqual([store.acquire(buckets, now=1000) for _ in range(3)], [0, 0, 0])
+            self.assertAlmostEqual(store.acquire(buckets, now=1000), 20)
+            # One token comes back every 20 seconds.
+            self.assertEqual(store.acquire(buckets, now=1020), 0)
+            self.assertGreater(store.acquire(buckets, now=1020), 0)
+        cache.clear()
+
+    def test_denied_request_takes_no_token_from_other_buckets(self):
+        store = MemoryBucketStore()
+        store.acquire([('throttle:test:ip', 1, 60)], now=0)
+        self.assertGreater(store.acquire([('throttle:test:ip', 1, 60), ('throttle:test:email', 1, 60)], now=0), 0)
+        self.assertEqual(store.acquire([('throttle:test:email', 1, 60)], now=0), 0)
+
+    def test_memory_store_drops_least_recently_used_keys(self):
+        store = MemoryBucketStore(max_keys=2)
+        for key in ('a', 'b', 'c'):
+            store.acquire([(key, 1, 60)], now=0)
+        self.assertEqual(store.get_many(['a', 'b', 'c']).keys(), {'b', 'c'})
+
+    @override_settings(BOOKING_THROTTLE_RATES={'book': {'client': '2/min'}, 'bookings': {'global': '3/min'}})
+    def test_views_are_limited_per_ip(self):
+        def book(email, ip, **headers):
+            return self.client.post('/book/', {
+                "fitness_class": "Yoga Class", "client_name": "Pat", "client_email": email
+            }, format='json', REMOTE_ADDR=ip, **headers)
+
+        self.assertEqual(book("pat@yopmail.com", "10.0.0.1").status_code, status.HTTP_201_CREATED)
+        self.assertEqual(book("sam@yopmail.com", "10.0.0.1").status_code, status.HTTP_201_CREATED)
+        response = book("kim@yopmail.com", "10.0.0.1", HTTP_X_FORWARDED_FOR="203.0.113.7")
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertIn('Retry-After', response)
+        # Another caller is not locked out of an email someone else used up.
+        self.assertEqual(book("pat@yopmail.com", "10.0.0.2").status_code, status.HTTP_201_CREATED)
+        self.assertEqual(book("pat@yopmail.com", "10.0.0.2").status_code, status.HTTP_201_CREATED)
+
+        for i in range(3):
+            self.assertEqual(self.client.get('/bookings/', {'email': f'c{i}@yopmail.com'}).status_code,
+                             status.HTTP_200_OK)
+        response = self.client.get('/bookings/', {'email': 'other@yopmail.com'}, REMOTE_ADDR='10.0.0.9')
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+        # Scopes without configured limits are not throttled.
+        for _ in range(5):
+            self.assertEqual(self.client.get('/classes/').status_code, status.HTTP_200_OK)
+
+    @override_settings(BOOKING_THROTTLE_RATES={'book': {'client': '1/min'}},
+                       REST_FRAMEWORK=dict(settings.REST_FRAMEWORK, NUM_PROXIES=1))
+    def test_forwarded_address_is_used_behind_trusted_proxies(self):
+        def book(email, client_ip):
+            return self.client.post('/book/', {
+                "fitness_class": "Yoga Class", "client_name": "Pat", "client_email": email
+            }, format='json', REMOTE_ADDR='10.0.0.1', HTTP_X_FORWARDED_FOR=f"198.51.100.1, {client_ip}")
+
+        self.assertEqual(book("pat@yopmail.com", "203.0.113.7").status_code, status.HTTP_201_CREATED)
+        self.assertEqual(book("sam@yopmail.com", "203.0.113.8").status_code, status.HTTP_201_CREATED)
+        self.assertEqual(book("kim@yopmail.com", "203.0.113.7").status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+    @override_settings(BOOKING_THROTTLE_RATES={'bookings': {'client': '1/min'}})
+    async def test_async_views_share_the_limits(self):
+        sync_response = await sync_to_async(self.client.get)('/bookings/', {'email': 'pat@yopmail.com'})
+        self.assertEqual(sync_response.status_code, status.HTTP_200_OK)
+        with self.settings(ROOT_URLCONF=AsyncURLConf):
+            response = await self.async_client.get('/bookings/', {'email': 'pat@yopmail.com'})
+        sync_response = await sync_to_async(self.client.get)('/bookings/', {'email': 'pat@yopmail.com'})
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(response.content, sync_response.rendered_content)
+        self.assertEqual(response['Retry-After'], sync_response['Retry-After'])
+
+
+class RequestMetricsTests(BookingAPITestCase):
+    def setUp(self):
+        super().setUp()
+        create_class()
+        self.registry = MetricsRegistry()
+        for module in ('booking.middleware', 'booking.views'):
+            patcher = mock.patch(f'{module}.registry', self.registry)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_registry_merges_per_thread_shards(self):
+        labels = (('view', 'class-list'), ('method', 'GET'))
+
+        def record():
+            for value in (0.001, 0.2, 30):
+                self.registry.observe('booking_request_duration_seconds', labels, value)
+            self.registry.inc('booking_requests_total', labels)
+
+        threads = [threading.Thread(target=record) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        counters, histograms = self.registry.collect()
+        self.assertEqual(counters['booking_requests_total', labels], 3)
+        histogram = histograms['booking_request_duration_seconds', labels]
+        self.assertEqual(sum(histogram[:-1]), 9)
+        self.assertEqual(histogram[-2], 3)
+
+        text = self.registry.render()
+        self.assertIn('booking_request_duration_seconds_bucket{view="class-list",method="GET",le="0.005"} 3', text)
+        self.assertIn('booking_request_duration_seconds_bucket{view="class-list",method="GET",le="+Inf"} 9', text)
+        self.assertIn('booking_request_duration_seconds_count{view="class-list",method="GET"} 9', text)
+
+    def test_finished_threads_are_folded_into_the_base_shard(self):
+        labels = (('view', 'class-list'), ('method', 'GET'))
+        for _ in range(5):
+            thread = threading.Thread(target=self.registry.inc, args=('booking_requests_total', labels))
+            thread.start()
+            thread.join()
+        self.registry.inc('booking_requests_total', labels)
+
+        counters, _ = self.registry.collect()
+        self.assertEqual(counters['booking_requests_total', labels], 6)
+        self.assertEqual([thread for thread, _ in self.registry._shards], [threading.current_thread()])
+
+    def test_metrics_need_an_allowed_address_or_the_token(self):
+        self.assertEqual(self.client.get('/metrics/').status_code, status.HTTP_403_FORBIDDEN)
+        with self.settings(BOOKING_METRICS_TOKEN="s3cret"):
+            self.assertEqual(self.client.get('/metrics/', HTTP_AUTHORIZATION="Bearer wrong").status_code,
+                             status.HTTP_403_FORBIDDEN)
+            self.assertEqual(self.client.get('/metrics/', HTTP_AUTHORIZATION="Bearer s3cret").status_code,
+                             status.HTTP_200_OK)
+        with self.settings(BOOKING_METRICS_ALLOWED_IPS=['10.0.0.5']):
+            self.assertEqual(self.client.get('/metrics/', REMOTE_ADDR='10.0.0.5').status_code, status.HTTP_200_OK)
+            self.assertEqual(self.client.get('/metrics/').status_code, status.HTTP_403_FORBIDDEN)
+
+    @override_settings(BOOKING_METRICS_ALLOWED_IPS=['127.0.0.1'])
+    def test_requests_are_recorded_per_view(self):
+        self.client.get('/classes/')
+        self.client.get('/bookings/', {'email': 'pat@yopmail.com'})
+
+        response = self.client.get('/metrics/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        text = response.content.decode()
+        self.assertIn('booking_requests_total{view="class-list",method="GET",status="200"} 1', text)
+        self.assertIn('booking_render_duration_seconds_count{view="class-list",method="GET"} 1', text)
+        self.assertIn('booking_response_size_bytes_count{view="booking-list",method="GET"} 1', text)
+
+        counters, histograms = self.registry.collect()
+        queries = histograms['booking_db_queries', (('view', 'booking-list'), ('method', 'GET'))]
+        # Validators aggregate, deletion stamp and page: three queries, in the "5" bucket.
+        self.assertEqual(queries[QUERY_COUNT_BUCKETS.index(5)], 1)
+        self.assertGreater(counters['booking_db_query_duration_seconds_total', (('view', 'booking-list'),
+                                                                                 ('method', 'GET'))], 0)
+
+    def test_slow_requests_are_logged(self):
+        with mock.patch('booking.middleware.logger') as middleware_logger:
+            with self.settings(BOOKING_SLOW_REQUEST_MS=None):
+                self.client.get('/classes/')
+            middleware_logger.warning.assert_not_called()
+            with self.settings(BOOKING_SLOW_REQUEST_MS=0):
+                self.client.get('/classes/')
+        self.assertEqual(middleware_logger.warning.call_args[0][3], 'class-list')
+
+    async def test_async_requests_are_recorded(self):
+        with self.settings(ROOT_URLCONF=AsyncURLConf):
+            await self.async_client.get('/bookings/', {'email': 'pat@yopmail.com'})
+        counters, histograms = self.registry.collect()
+        labels = (('view', 'booking-list'), ('method', 'GET'))
+        self.assertEqual(counters['booking_requests_total', labels + (('status', 200),)], 1)
+        self.assertEqual(histograms['booking_db_queries', labels][QUERY_COUNT_BUCKETS.index(5)], 1)
+
+
+@override_settings(BOOKING_SLOT_COUNTER='memory', BOOKING_SLOT_FLUSH_INTERVAL=None)
+class SlotCounterTests(BookingAPITestCase):
+    """
+    The flusher thread is off; flush() runs in the test's transaction.
+    """
+
+    def setUp(self):
+        super().setUp()
+        reservations.get_store().clear()
+        self.addCleanup(reservations.flush)
+        self.flash_sale = create_class("Flash Sale HIIT", "Bob", available_slots=2, starts_in=timedelta(hours=2))
+
+    def _book(self, email, fitness_class="Flash Sale HIIT"):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post('/book/', {
+                "fitness_class": fitness_class, "client_name": "Client", "client_email": email
+            }, format='json')
+
+    def test_bookings_are_taken_from_the_counter_and_written_behind(self):
+        self.assertEqual(self._book("pat@yopmail.com").status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(self._book("sam@yopmail.com").status_code, status.HTTP_202_ACCEPTED)
+        response = self._book("kim@yopmail.com")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        self.flash_sale.refresh_from_db()
+        self.assertEqual(self.flash_sale.available_slots, 2)
+        self.assertFalse(Booking.objects.exists())
+
+        # One UPDATE and one INSERT, plus the savepoint of the test transaction.
+        with self.assertNumQueries(4):
+            self.assertEqual(reservations.flush(), 2)
+        self.flash_sale.refresh_from_db()
+        self.assertEqual(self.flash_sale.available_slots, 0)
+        self.assertEqual(
+            sorted(Booking.objects.values_list('client_email', flat=True)), ["pat@yopmail.com", "sam@yopmail.com"]
+        )
+
+    def test_bookings_that_no_longer_fit_are_rejected_at_flush(self):
+        reservations.rejected.clear()
+        self._book("pat@yopmail.com")
+        self._book("sam@yopmail.com")
+        gone = create_class("Gone", available_slots=1, starts_in=timedelta(hours=1))
+        self._book("kim@yopmail.com", fitness_class="Gone")
+
+        # Capacity lowered and a class deleted while the bookings are pending.
+        self.flash_sale.available_slots = 1
+        self.flash_sale.save()
+        gone.delete()
+
+        self.assertEqual(reservations.flush(), 1)
+        self.flash_sale.refresh_from_db()
+        self.assertEqual(self.flash_sale.available_slots, 0)
+        self.assertEqual(list(Booking.objects.values_list('client_email', flat=True)), ["pat@yopmail.com"])
+        self.assertEqual(
+            sorted(booking.client_email for booking in reservations.rejected), ["kim@yopmail.com", "sam@yopmail.com"]
+        )
+        # Rejected bookings are not retried.
+        self.assertEqual(reservations.flush(), 0)
+        self.assertEqual(reservations.available(self.flash_sale.id), 0)
+
+    def test_other_slot_changes_go_through_the_counter(self):
+        self._book("pat@yopmail.com")
+        self._book("sam@yopmail.com")
+
+        # The database still shows both slots free, but they are taken.
+        response = self.client.post('/book/bulk/', {"bookings": [
+            {"fitness_class": "Flash Sale HIIT", "client_name": "Kim", "client_email": "kim@yopmail.com"},
+        ]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        reservations.flush()
+        booking = Booking.objects.get(client_email="pat@yopmail.com")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/bookings/{booking.id}/cancel/', {"client_email": "pat@yopmail.com"}, format='json')
+        self.assertEqual(reservations.available(self.flash_sale.id), 1)
+        self.assertEqual(self._book("kim@yopmail.com").status_code, status.HTTP_202_ACCEPTED)
+
+    def test_cancelling_promotes_the_waitlist(self):
+        self._book("pat@yopmail.com")
+        self._book("sam@yopmail.com")
+        reservations.flush()
+        WaitlistEntry.objects.create(fitness_class=self.flash_sale, client_name="Kim", client_email="kim@yopmail.com")
+
+        booking = Booking.objects.get(client_email="pat@yopmail.com")
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                f'/bookings/{booking.id}/cancel/', {"client_email": "pat@yopmail.com"}, format='json'
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(Booking.objects.active().filter(client_email="kim@yopmail.com").exists())
+        self.assertFalse(WaitlistEntry.objects.exists())
+        self.assertEqual(reservations.available(self.flash_sale.id), 0)
+        self.assertEqual(self._book("lee@yopmail.com").status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_rolled_back_booking_gives_its_slot_back(self):
+        with transaction.atomic():
+            reservations.book(self.flash_sale, "Pat", "pat@yopmail.com")
+            # Reconciling before the commit keeps the slot taken.
+            reservations.reconcile()
+            self.assertEqual(reservations.available(self.flash_sale.id), 1)
+            transaction.set_rollback(True)
+
+        self.assertEqual(reservations.available(self.flash_sale.id), 2)
+        reservations.reconcile()
+        self.assertEqual(reservations.available(self.flash_sale.id), 2)
+        self.assertEqual(reservations.flush(), 0)
+
+    def test_rolled_back_cancellation_takes_its_slot_back(self):
+        self._book("pat@yopmail.com")
+        reservations.flush()
+        with transaction.atomic():
+            Booking.objects.filter(client_email="pat@yopmail.com").cancel()
+            self.assertEqual(reservations.available(self.flash_sale.id), 2)
+            transaction.set_rollback(True)
+        self.assertEqual(reservations.available(self.flash_sale.id), 1)
+
+    def test_reconcile_deducts_unflushed_bookings(self):
+        self._book("pat@yopmail.com")
+        FitnessClass.objects.filter(pk=self.flash_sale.pk).update(available_slots=5)
+
+        self.assertEqual(reservations.reconcile(), {self.flash_sale.id: 5})
+        self.assertEqual(reservations.available(self.flash_sale.id), 4)
+
+    @override_settings(BOOKING_SLOT_COUNTER='cache')
+    def test_reconcile_slots_forgets_bookings_of_dead_workers(self):
+        store = reservations.get_store()
+        self.addCleanup(setattr, store, 'loaded', False)
+        # Left behind by a worker killed before its flush.
+        store.add_pending({self.flash_sale.id: 1})
+        reservations.reconcile()
+        self.assertEqual(reservations.available(self.flash_sale.id), 1)
+
+        call_command('reconcile_slots')
+        self.assertEqual(reservations.available(self.flash_sale.id), 2)
+
+    def test_reconcile_slots_refuses_the_memory_counter(self):
+        with self.assertRaises(CommandError):
+            call_command('reconcile_slots')
+
+    def test_classes_beyond_the_horizon_are_booked_in_the_database(self):
+        create_class(starts_in=timedelta(days=3))
+        response = self._book("pat@yopmail.com", fitness_class="Yoga Class")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertTrue(Booking.objects.filter(pk=response.data['booking_id']).exists())
+
+
+class GroupCommitTests(BookingAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.yoga = create_class(available_slots=2)
+        self.hiit = create_class("HIIT", "Bob")
+
+    def _request(self, fitness_class, email):
+        return {"fitness_class": fitness_class, "client_name": "Client", "client_email": email}, Future()
+
+    def test_batch_is_booked_in_one_transaction_in_arrival_order(self):
+        batch = [self._request(self.yoga, f"c{number}@yopmail.com") for number in range(3)]
+        batch.append(self._request(self.hiit, "kim@yopmail.com"))
+
+        with CaptureQueriesContext(connection) as queries:
+            booking_batcher.commit(batch)
+        statements = [query['sql'].split()[0] for query in queries.captured_queries
+                      if 'SAVEPOINT' not in query['sql']]
+        self.assertEqual(statements, ['SELECT', 'UPDATE', 'INSERT'])
+
+        results = [future.result() for _, future in batch]
+        self.assertEqual([booking and booking.client_email for booking in results],
+                         ["c0@yopmail.com", "c1@yopmail.com", None, "kim@yopmail.com"])
+        self.assertTrue(all(booking.pk for booking in results if booking))
+        self.assertEqual(
+            dict(FitnessClass.objects.values_list('name', 'available_slots')), {"Yoga Class": 0, "HIIT": 4}
+        )
+
+    def test_waitlist_and_disabled_requests_are_not_batched(self):
+        self.assertFalse(booking_batcher.handles({"fitness_class": self.yoga, "waitlist": False}))
+        with self.settings(BOOKING_GROUP_COMMIT=True):
+            self.assertTrue(booking_batcher.handles({"fitness_class": self.yoga, "waitlist": False}))
+            self.assertFalse(booking_batcher.handles({"fitness_class": self.yoga, "waitlist": True}))
+
+    @override_settings(BOOKING_GROUP_COMMIT=True, BOOKING_SLOT_COUNTER='memory', BOOKING_SLOT_FLUSH_INTERVAL=None)
+    def test_classes_held_by_the_slot_counter_are_not_batched(self):
+        store = reservations.get_store()
+        store.clear()
+        self.addCleanup(store.clear)
+        soon = create_class("Flash Sale HIIT", "Bob", starts_in=timedelta(hours=2))
+        later = create_class("Pilates", starts_in=timedelta(days=3))
+        # Loaded by the first booking in a real process.
+        reservations.get_store()
+
+        self.assertFalse(booking_batcher.handles({"fitness_class": soon}))
+        self.assertTrue(booking_batcher.handles({"fitness_class": later}))
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/book/', {
+                "fitness_class": soon.name, "client_name": "Pat", "client_email": "pat@yopmail.com"
+            }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(reservations.flush(), 1)
+
+    @override_settings(BOOKING_GROUP_COMMIT=True, BOOKING_GROUP_COMMIT_TIMEOUT=0.01)
+    def test_unanswered_request_gets_503_and_is_withdrawn(self):
+        submitted = []
+
+        def submit(validated_data):
+            submitted.append(Future())
+            return submitted[-1]
+
+        with mock.patch.object(booking_batcher, 'submit', submit):
+            response = self.client.post('/book/', {
+                "fitness_class": "Yoga Class", "client_name": "Pat", "client_email": "pat@yopmail.com"
+            }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertTrue(submitted[0].cancelled())
+
+    def test_dead_worker_is_restarted(self):
+        dead = threading.Thread(target=lambda: None)
+        dead.start()
+        dead.join()
+        batcher = BookingBatcher()
+        batcher._worker = dead
+        with mock.patch.object(batcher, 'commit', lambda batch: [future.set_result(None) for _, future in batch]):
+            self.assertIsNone(batcher.submit({}).result(timeout=5))
+        self.assertIsNot(batcher._worker, dead)
+        self.assertTrue(batcher._worker.is_alive())
+
+
+class ConcurrentGroupCommitTests(APITransactionTestCase):
+    def test_concurrent_requests_share_transactions(self):
+        yoga = create_class(available_slots=20)
+        answers, errors = [], []
+
+        def client(number):
+            data = {"fitness_class": yoga, "client_name": "Client", "client_email": f"c{number}@yopmail.com"}
+            try:
+                answers.append(batched_booking(data)[1])
+            except ValidationError:
+                answers.append(status.HTTP_400_BAD_REQUEST)
+            except Exception as e:
+                errors.append(e)
+
+        with self.settings(BOOKING_GROUP_COMMIT_WINDOW=0.05), \
+                mock.patch.object(booking_batcher, 'commit', wraps=booking_batcher.commit) as commit:
+            threads = [threading.Thread(target=client, args=(number,)) for number in range(25)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(sorted(answers), [status.HTTP_201_CREATED] * 20 + [status.HTTP_400_BAD_REQUEST] * 5)
+        self.assertLess(commit.call_count, 25)
+        yoga.refresh_from_db()
+        self.assertEqual(yoga.available_slots, 0)
+        self.assertEqual(Booking.objects.count(), 20)
+
+
+class ConnectionReuseTests(APITestCase):
+    def setUp(self):
+        self.registry = MetricsRegistry()
+        self.registry.add_collector(pool_metrics)
+        patcher = mock.patch('booking.signals.registry', self.registry)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_connections_persist_and_are_health_checked(self):
+        db_settings = settings.DATABASES['default']
+        self.assertEqual(db_settings['CONN_MAX_AGE'], settings.BOOKING_CONN_MAX_AGE)
+        self.assertTrue(db_settings['CONN_HEALTH_CHECKS'])
+
+    def test_connections_are_not_kept_under_asgi(self):
+        code = (
+            "import sys;"
+            "import fitness_studio.asgi;"
+            "from django.conf import settings;"
+            "sys.exit(settings.DATABASES['default']['CONN_MAX_AGE'])"
+        )
+        env = {key: value for key, value in os.environ.items() if key != 'BOOKING_CONN_MAX_AGE'}
+        result = subprocess.run([sys.executable, '-c', code], cwd=settings.BASE_DIR, env=env)
+        self.assertEqual(result.returncode, 0)
+
+    def test_new_connections_are_counted(self):
+        connection_created.send(sender=type(connection), connection=connection)
+        self.assertIn('booking_db_connections_total{alias="default"} 1', self.registry.render())
+
+    def test_pool_saturation_is_exported(self):
+        pool = mock.Mock()
+        pool.get_stats.return_value = {
+            'pool_size': 10, 'pool_available': 0, 'requests_waiting': 4, 'requests_wait_ms': 2500,
+        }
+        with mock.patch.dict(connection.settings_dict['OPTIONS'], {'pool': True}), \
+                mock.patch.object(connection, 'pool', pool, create=True):
+            text = self.registry.render()
+        self.assertIn('# TYPE booking_db_pool_connections gauge', text)
+        self.assertIn('booking_db_pool_connections{alias="default",state="idle"} 0', text)
+        self.assertIn('booking_db_pool_connections{alias="default",state="in_use"} 10', text)
+        self.assertIn('booking_db_pool_requests_waiting{alias="default"} 4', text)
+        self.assertIn('booking_db_pool_wait_seconds_total{alias="default"} 2.5', text)
+
+        self.assertNotIn('booking_db_pool_connections{', self.registry.render())
+
+
+class SQLiteProductionProfileTests(APITestCase):
+    def test_connections_open_with_wal_and_immediate_transactions(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        wrapper = type(connections['default'])(
+            dict(connections['default'].settings_dict, NAME=os.path.join(tmp_dir.name, 'prod.sqlite3'),
+                 OPTIONS=settings.SQLITE_PRODUCTION_OPTIONS),
+            alias='sqlite-production',
+        )
+        self.addCleanup(wrapper.close)
+        with wrapper.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            self.assertEqual(cursor.fetchone()[0], 'wal')
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)
+        self.assertEqual(wrapper.transaction_mode, 'IMMEDIATE')
+
+    def test_serialized_writes_queue_within_the_process(self):
+        entered, release = threading.Event(), threading.Event()
+        order = []
+
+        def first():
+            with serialized_writes():
+                order.append('first')
+                entered.set()
+                release.wait(5)
+                order.append('first done')
+
+        def second():
+            entered.wait(5)
+            with serialized_writes():
+                order.append('second')
+
+        with self.settings(BOOKING_SERIALIZE_WRITES=True):
+            threads = [threading.Thread(target=first), threading.Thread(target=second)]
+            for thread in threads:
+                thread.start()
+            entered.wait(5)
+            time.sleep(0.05)
+            release.set()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(order, ['first', 'first done', 'second'])
+
+        # Off by default: nothing is held.
+        with serialized_writes(), serialized_writes():
+            pass
+
+
+@override_settings(BOOKING_READ_REPLICAS=['replica_a', 'replica_b'])
+class ReplicaRoutingTests(BookingAPITestCase):
+    """
+    Two SQLite files stand in for the replicas, each holding different data
+    so that every answer shows which database served it. They are added
+    once the test databases exist, then allowed for these tests only.
+    """
+    replicas = ('replica_a', 'replica_b')
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.tmp_dir = tempfile.TemporaryDirectory()
+        cls.databases = cls.databases | set(cls.replicas)
+        for alias in cls.replicas:
+            connections.settings[alias] = dict(
+                connections['default'].settings_dict, NAME=os.path.join(cls.tmp_dir.name, f'{alias}.sqlite3')
+            )
+            call_command('migrate', database=alias, verbosity=0)
+
+    @classmethod
+    def tearDownClass(cls):
+        for alias in cls.replicas:
+            connections[alias].close()
+            del connections[alias]
+            del connections.settings[alias]
+        cls.databases = cls.databases - set(cls.replicas)
+        cls.tmp_dir.cleanup()
+        super().tearDownClass()
+
+    def setUp(self):
+        super().setUp()
+        for alias in ('default', *self.replicas):
+            yoga = FitnessClass.objects.using(alias).create(
+                name="Yoga Class", instructor="Alice", start_time=timezone.now() + timedelta(days=1), available_slots=5
+            )
+            Booking.objects.using(alias).create(fitness_class=yoga, client_name=alias, client_email="pat@yopmail.com")
+
+    def _booked_by(self):
+        response = self.client.get('/bookings/', {'email': 'pat@yopmail.com'})
+        return [booking['client_name'] for booking in response.data['data']]
+
+    def test_reads_rotate_over_replicas_and_writes_go_to_primary(self):
+        self.assertEqual([self._booked_by() for _ in range(3)], [['replica_a'], ['replica_b'], ['replica_a']])
+
+        response = self.client.post('/book/', {
+            "fitness_class": "Yoga Class", "client_name": "John Doe", "client_email": "john@yopmail.com"
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertTrue(Booking.objects.using('default').filter(client_email="john@yopmail.com").exists())
+        for alias in self.replicas:
+            self.assertFalse(Booking.objects.using(alias).filter(client_email="john@yopmail.com").exists())
+
+    def test_client_reads_the_primary_after_a_write(self):
+        self.client.post('/book/', {
+            "fitness_class": "Yoga Class", "client_name": "Pat", "client_email": "pat@yopmail.com"
+        }, format='json')
+        self.assertEqual(self._booked_by(), ['default', 'Pat'])
+
+        self.client.cookies.clear()
+        self.assertIn(self._booked_by(), (['replica_a'], ['replica_b']))
+
+    async def test_async_view_reads_replicas(self):
+        with self.settings(ROOT_URLCONF=AsyncURLConf):
+            response = await self.async_client.get('/bookings/', {'email': 'pat@yopmail.com'})
+        self.assertIn(response.json()['data'][0]['client_name'], self.replicas)
+
+    def test_lru_strategy_picks_the_replica_unused_longest(self):
+        selector = ReplicaSelector(['a', 'b', 'c'], strategy='lru')
+        self.assertEqual([selector.choose() for _ in range(4)], ['a', 'b', 'c', 'a'])
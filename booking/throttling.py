@@ -0,0 +1,149 @@
+import threading
+import time
+from collections import OrderedDict
+from contextlib import nullcontext
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.throttling import BaseThrottle
+
+
+class BucketStore:
+    """
+    Token buckets kept as one number per key, in the style of GCRA: the
+    time at which the bucket will be full again. A request takes a token
+    from each of its buckets, or from none of them if any one is empty,
+    with a constant amount of work per bucket.
+    """
+    lock = nullcontext()
+
+    def get_many(self, keys):
+        raise NotImplementedError
+
+    def set_many(self, values, timeout):
+        raise NotImplementedError
+
+    def acquire(self, buckets, now=None):
+        """
+        `buckets` is a list of (key, capacity, period) tuples. Returns 0 when
+        a token was taken from every bucket, otherwise the seconds to wait
+        until all of them have one again.
+        """
+        now = time.time() if now is None else now
+        with self.lock:
+            full_at = self.get_many([key for key, _, _ in buckets])
+            updated, wait = {}, 0
+            for key, capacity, period in buckets:
+                # Each token refills in period / capacity seconds; a bucket
+                # may run at most `period` seconds ahead of now (full burst).
+                new_full_at = max(full_at.get(key, now), now) + period / capacity
+                wait = max(wait, new_full_at - now - period)
+                updated[key] = new_full_at
+            if wait > 0:
+                return wait
+            self.set_many(updated, max(period for _, _, period in buckets))
+        return 0
+
+
+class MemoryBucketStore(BucketStore):
+    """
+    Buckets of the current process. The least recently used keys are
+    dropped beyond `max_keys`, which at worst lets those clients start over
+    with a full bucket.
+    """
+
+    def __init__(self, max_keys=100000):
+        self.lock = threading.Lock()
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+
+    def get_many(self, keys):
+        return {key: self._buckets[key] for key in keys if key in self._buckets}
+
+    def set_many(self, values, timeout):
+        for key, value in values.items():
+            self._buckets[key] = value
+            self._buckets.move_to_end(key)
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self._buckets.clear()
+
+
+class CacheBucketStore(BucketStore):
+    """
+    Buckets in a Django cache shared by several workers. Reads and writes
+    are not atomic across workers, so concurrent requests of one client may
+    occasionally both get the last token.
+    """
+
+    def __init__(self, alias='default'):
+        self.alias = alias
+
+    def get_many(self, keys):
+        return caches[self.alias].get_many(keys)
+
+    def set_many(self, values, timeout):
+        caches[self.alias].set_many(values, timeout=int(timeout) + 1)
+
+
+@lru_cache(maxsize=None)
+def get_bucket_store():
+    """
+    Returns the store selected by BOOKING_THROTTLE_STORE: 'memory' (one
+    process) or 'cache' (the BOOKING_THROTTLE_CACHE_ALIAS cache).
+    """
+    if getattr(settings, 'BOOKING_THROTTLE_STORE', 'memory') == 'cache':
+        return CacheBucketStore(getattr(settings, 'BOOKING_THROTTLE_CACHE_ALIAS', 'default'))
+    return MemoryBucketStore()
+
+
+def parse_rate(rate):
+    """
+    Turns '10/min' into (10, 60). The period may be s, sec, m, min, h,
+    hour, d or day.
+    """
+    num, period = rate.split('/')
+    return int(num), {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}[period[0]]
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+    Throttles a view by its `throttle_scope`, with the limits configured in
+    BOOKING_THROTTLE_RATES[scope]: 'client' applies to each caller IP
+    address, 'global' to all callers together. Scopes without limits are
+    not throttled.
+
+    The caller IP is REMOTE_ADDR, or the X-Forwarded-For address added by
+    the last of REST_FRAMEWORK['NUM_PROXIES'] trusted proxies. Client
+    emails are not limited on their own: anyone can send someone else's,
+    which would let them lock that client out.
+    """
+
+    def __init__(self):
+        self.wait_seconds = None
+
+    def allow_request(self, request, view):
+        return self.consume(getattr(view, 'throttle_scope', None), self.get_ident(request))
+
+    def consume(self, scope, ident):
+        limits = getattr(settings, 'BOOKING_THROTTLE_RATES', {}).get(scope)
+        if not limits:
+            return True
+
+        buckets = []
+        if limits.get('client'):
+            capacity, period = parse_rate(limits['client'])
+            buckets.append((f'throttle:{scope}:ip:{ident}', capacity, period))
+        if limits.get('global'):
+            capacity, period = parse_rate(limits['global'])
+            buckets.append((f'throttle:{scope}:global', capacity, period))
+
+        self.wait_seconds = get_bucket_store().acquire(buckets) if buckets else 0
+        return not self.wait_seconds
+
+    def wait(self):
+        return self.wait_seconds
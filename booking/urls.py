@@ -1,8 +1,25 @@
+from django.conf import settings
 from django.urls import path
-from .views import ClassListView, BookClassView, BookingListView
+from .views import ClassListView, BookClassView, BulkBookClassView, BookingListView, SlotAvailabilityStreamView, WaitlistView, CancelBookingView, MetricsView
+from .async_views import AsyncClassListView, AsyncBookClassView, AsyncBookingListView
 
-urlpatterns = [
+sync_urlpatterns = [
     path('classes/', ClassListView.as_view(), name='class-list'),
     path('book/', BookClassView.as_view(), name='book-class'),
     path('bookings/', BookingListView.as_view(), name='booking-list'),
 ]
+
+# Async-native versions of the same endpoints, for ASGI deployments.
+async_urlpatterns = [
+    path('classes/', AsyncClassListView.as_view(), name='class-list'),
+    path('book/', AsyncBookClassView.as_view(), name='book-class'),
+    path('bookings/', AsyncBookingListView.as_view(), name='booking-list'),
+]
+
+urlpatterns = (async_urlpatterns if getattr(settings, 'BOOKING_ASYNC_VIEWS', False) else sync_urlpatterns) + [
+    path('book/bulk/', BulkBookClassView.as_view(), name='bulk-book-class'),
+    path('bookings/<int:booking_id>/cancel/', CancelBookingView.as_view(), name='cancel-booking'),
+    path('waitlist/', WaitlistView.as_view(), name='waitlist'),
+    path('classes/stream/', SlotAvailabilityStreamView.as_view(), name='class-slot-stream'),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
+]
@@ -1,38 +1,125 @@
+import atexit
 import logging
+import logging.handlers
+import queue
+import threading
+from datetime import date
+from functools import lru_cache
 from django.conf import settings
-from datetime import datetime as dt
 import os
 import pytz
 from rest_framework.exceptions import ValidationError
 from django.utils.timezone import make_aware
 
+LOG_FORMAT = ('%(asctime)s %(process)d %(thread)s %(levelname)2s '
+              '%(pathname)s %(funcName)s %(lineno)d %(message)s')
+
+
+class DailyLogFileHandler(logging.FileHandler):
+    """
+    Writes to <LOGS_DIR>/logs/<YYYY-MM-DD>/logs.txt and moves on to the next
+    day's directory as soon as a record from a new day arrives.
+    """
+
+    def __init__(self, logs_dir):
+        self.logs_dir = str(logs_dir)
+        self.current_date = date.today()
+        super().__init__(self._path_for(self.current_date), delay=True)
+
+    def _path_for(self, day):
+        log_dir = os.path.join(self.logs_dir, 'logs', day.strftime('%Y-%m-%d'))
+        os.makedirs(log_dir, exist_ok=True)
+        return os.path.join(log_dir, 'logs.txt')
+
+    def emit(self, record):
+        day = date.fromtimestamp(record.created)
+        if day != self.current_date:
+            self.close()
+            self.current_date = day
+            self.baseFilename = os.path.abspath(self._path_for(day))
+        super().emit(record)
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    Enqueues records without formatting them; the listener thread does the
+    %-interpolation and any traceback rendering.
+    """
+
+    def prepare(self, record):
+        return record
+
 
 class CustomLogger:
+    """
+    Hands out loggers that push records onto an in-process queue. A single
+    listener thread drains the queue into the daily log file (and the
+    console when LOG_TO_CONSOLE is set), so no disk I/O happens on the
+    request thread. Levels come from LOG_LEVEL and per-logger LOG_LEVELS.
+    """
+    _queue_handler = None
+    _listener = None
+    _lock = threading.Lock()
 
     def __init__(self, name):
         self.name = name
 
+    @classmethod
+    def _get_queue_handler(cls):
+        with cls._lock:
+            if cls._queue_handler is None:
+                formatter = logging.Formatter(LOG_FORMAT)
+                handlers = [DailyLogFileHandler(settings.LOGS_DIR)]
+                if getattr(settings, 'LOG_TO_CONSOLE', True):
+                    handlers.append(logging.StreamHandler())
+                handlers[0].setFormatter(formatter)
+
+                log_queue = queue.SimpleQueue()
+                cls._listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+                cls._listener.start()
+                atexit.register(cls._listener.stop)
+                cls._queue_handler = DeferredQueueHandler(log_queue)
+            return cls._queue_handler
+
     def get_custom_logger(self):
-        log_dir = str(settings.LOGS_DIR) + '/logs/' + \
-            str(((dt.today()).strftime('%Y-%m-%d')))
-        if not os.path.exists(log_dir):
-            os.makedirs(log_dir)
-        logging.basicConfig(filename=log_dir + '/logs.txt',
-                            format='%(asctime)s %(process)d %(thread)s %(levelname)2s '
-                                   '%(pathname)s %(funcName)s %(lineno)d %(message)s',
-                            level=logging.INFO)
         logger = logging.getLogger(name=self.name)
-        logger.addHandler(logging.StreamHandler())
+        queue_handler = self._get_queue_handler()
+        if queue_handler not in logger.handlers:
+            logger.addHandler(queue_handler)
+            logger.propagate = False
+        level = getattr(settings, 'LOG_LEVELS', {}).get(self.name, getattr(settings, 'LOG_LEVEL', 'INFO'))
+        logger.setLevel(level)
         return logger
 
 
+# pytz accepts any letter case; names are cached under their canonical
+# spelling so that the cache stays bounded by the number of known zones.
+_CANONICAL_ZONES = {zone.lower(): zone for zone in pytz.all_timezones}
+
+
+@lru_cache(maxsize=None)
+def load_timezone(zone):
+    return pytz.timezone(zone)
+
+
+def get_timezone(tz_name):
+    """
+    Resolves a timezone name, in any letter case, once per process.
+    Unknown names raise pytz.UnknownTimeZoneError and are not cached.
+    """
+    zone = _CANONICAL_ZONES.get(str(tz_name).lower())
+    if zone is None:
+        raise pytz.UnknownTimeZoneError(tz_name)
+    return load_timezone(zone)
+
+
 def validate_timezone(tz_name: str = 'Asia/Kolkata') -> str:
     """
-    Validates if a given timezone name is valid. Defaults to Asia/Kolkata.
+    Validates if a given timezone name is valid and returns its canonical
+    spelling. Defaults to Asia/Kolkata.
     """
     try:
-        pytz.timezone(tz_name)
-        return tz_name
+        return get_timezone(tz_name).zone
     except pytz.UnknownTimeZoneError:
         raise ValidationError("Invalid timezone specified.")
 
@@ -46,6 +133,16 @@ def convert_to_timezone(dt, tz_name='Asia/Kolkata'):
     if dt.tzinfo is None:
         dt = make_aware(dt)
 
-    target_tz = pytz.timezone(tz_name)
+    target_tz = get_timezone(tz_name)
     return dt.astimezone(target_tz)
 
+def format_in_timezone(datetimes, tz_name='Asia/Kolkata', fmt='%Y-%m-%d %H:%M:%S %Z'):
+    """
+    Converts and formats many datetimes in one pass. Returns a dict keyed by
+    the original datetime; repeated values are only formatted once.
+    """
+    formatted = {}
+    for value in datetimes:
+        if value not in formatted:
+            formatted[value] = convert_to_timezone(value, tz_name).strftime(fmt)
+    return formatted
@@ -1,21 +1,60 @@
+import asyncio
+import hmac
+from concurrent import futures
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse, StreamingHttpResponse
+from django.views import View
+from rest_framework.renderers import JSONRenderer
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.exceptions import ValidationError
-from django.utils import timezone
+from rest_framework.settings import api_settings
 
+from booking.batching import GroupCommitTimeout, booking_batcher
+from booking.cache import aget_upcoming_classes, get_upcoming_classes, invalidate_class_listing
+from booking.conditional import (
+    booking_list_validators, make_etag, not_modified_response, set_validators,
+)
+from booking.db import serialized_writes
+from booking.events import format_sse, slot_events
+from booking.idempotency import IDEMPOTENCY_HEADER, invalid_key, replayed, request_fingerprint
+from booking.metrics import registry
+from booking.pagination import BookingKeysetPagination, ClassKeysetPagination
+from booking.renderers import FastJSONRenderer
+from booking.routers import reads_from_replicas
 from booking.utils import CustomLogger, validate_timezone
-from .models import FitnessClass, Booking
-from .serializers import FitnessClassSerializer, BookingSerializer
+from .models import Booking, IdempotencyKey, WaitlistEntry
+from .serializers import (
+    FAST_BOOKING_VALUES, BookingSerializer, BulkBookingSerializer, WaitlistEntrySerializer, fast_booking_rows,
+)
 
 logger = CustomLogger(__name__).get_custom_logger()
 
 
-class ClassListView(APIView):
+class FastJSONMixin:
+    """
+    Swaps DRF's JSONRenderer for FastJSONRenderer when BOOKING_FAST_JSON is
+    enabled; content negotiation is otherwise unchanged.
+    """
+
+    def get_renderers(self):
+        renderers = super().get_renderers()
+        if getattr(settings, 'BOOKING_FAST_JSON', False):
+            renderers = [FastJSONRenderer() if type(renderer) is JSONRenderer else renderer for renderer in renderers]
+        return renderers
+
+
+class ClassListView(FastJSONMixin, APIView):
     """
-    GET /classes/?timezone=Asia/Kolkata
-    Returns upcoming fitness classes converted to the requested timezone.
+    GET /classes/?timezone=Asia/Kolkata&page_size=10&cursor=<next cursor>
+    Returns upcoming fitness classes converted to the requested timezone,
+    one keyset-paginated page at a time.
     """
+    throttle_scope = 'classes'
 
     def get(self, request):
         tz_name = request.GET.get('timezone', 'Asia/Kolkata')
@@ -26,50 +65,193 @@ class ClassListView(APIView):
             return Response({"error": "Invalid timezone"}, status=status.HTTP_400_BAD_REQUEST)
 
         try:
-            now_utc = timezone.now()
-            upcoming_classes = FitnessClass.objects.filter(start_time__gte=now_utc).order_by('start_time')
+            paginator = ClassKeysetPagination(request)
+        except ValidationError as e:
+            return Response({"error": e.detail[0]}, status=status.HTTP_400_BAD_REQUEST)
 
-            serializer = FitnessClassSerializer(upcoming_classes, many=True, context={'timezone': tz_name})
-            logger.info(f"Returned {len(upcoming_classes)} classes for timezone {tz_name}")
+        try:
+            entries, last_modified = get_upcoming_classes(tz_name)
+            etag = make_etag(tz_name, paginator.page_size, request.GET.get(paginator.cursor_query_param, ''),
+                             len(entries), last_modified)
+            not_modified = not_modified_response(request, etag, last_modified)
+            if not_modified is not None:
+                return not_modified
 
-            return Response({
+            upcoming_classes = paginator.paginate_entries(entries)
+            logger.info("Returned %d classes for timezone %s", len(upcoming_classes), tz_name)
+
+            return set_validators(Response({
                 "message": "Classes fetched successfully for the specified timezone.",
-                "data": serializer.data
-            }, status=status.HTTP_200_OK)
+                "next": paginator.get_next_link(),
+                "data": upcoming_classes
+            }, status=status.HTTP_200_OK), etag, last_modified)
 
         except Exception as e:
-            logger.error(f"Error fetching classes for timezone: {tz_name}", exc_info=True)
+            logger.error("Error fetching classes for timezone: %s", tz_name, exc_info=True)
             return Response({
                 "message": "An error occurred while retrieving classes.",
                 "error": str(e)
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+def waitlist_response(entry):
+    """
+    Returns the (data, status) answer for a client sent to the waitlist,
+    who may have been promoted to a booking right away.
+    """
+    if entry.booking is not None:
+        logger.info("Booking successful for class ID %s by %s", entry.fitness_class_id, entry.client_email)
+        return {
+            "message": "Booking successful.",
+            "booking_id": entry.booking.id
+        }, status.HTTP_201_CREATED
+
+    logger.info("Waitlisted %s for class ID %s at position %d", entry.client_email, entry.fitness_class_id,
+                entry.position)
+    return {
+        "message": "Class is full; you have been added to the waitlist.",
+        "waitlist_id": entry.id,
+        "position": entry.position
+    }, status.HTTP_202_ACCEPTED
+
+
+def booking_response(booking):
+    """
+    Returns the (data, status) answer for a booking made.
+    """
+    if booking.pk is None:
+        # Taken from the slot counter; the row is written by its next flush.
+        logger.info("Booking accepted for class ID %s by %s", booking.fitness_class_id, booking.client_email)
+        return {
+            "message": "Booking successful. It will be listed shortly."
+        }, status.HTTP_202_ACCEPTED
+
+    logger.info("Booking successful for class ID %s by %s", booking.fitness_class_id, booking.client_email)
+    return {
+        "message": "Booking successful.",
+        "booking_id": booking.id
+    }, status.HTTP_201_CREATED
+
+
+def _batched_answer(booking):
+    if booking is None:
+        raise ValidationError({api_settings.NON_FIELD_ERRORS_KEY: ["No available slots for this class."]})
+    return (*booking_response(booking), {})
+
+
+def batched_booking(validated_data):
+    """
+    Books through the group-commit batcher (booking.batching), waiting for
+    the batch to commit, and returns the (data, status, headers) answer.
+    Raises GroupCommitTimeout after BOOKING_GROUP_COMMIT_TIMEOUT seconds;
+    the request is then withdrawn unless its batch is already running.
+    """
+    future = booking_batcher.submit(validated_data)
+    try:
+        booking = future.result(timeout=getattr(settings, 'BOOKING_GROUP_COMMIT_TIMEOUT', 5))
+    except futures.TimeoutError:
+        future.cancel()
+        raise GroupCommitTimeout()
+    return _batched_answer(booking)
+
+
+async def abatched_booking(validated_data):
+    future = asyncio.wrap_future(booking_batcher.submit(validated_data))
+    try:
+        # Cancelling the wrapper on timeout also withdraws the request.
+        booking = await asyncio.wait_for(future, getattr(settings, 'BOOKING_GROUP_COMMIT_TIMEOUT', 5))
+    except asyncio.TimeoutError:
+        raise GroupCommitTimeout()
+    return _batched_answer(booking)
+
+
+def group_commit_timeout_response():
+    logger.error("Group commit gave no answer within BOOKING_GROUP_COMMIT_TIMEOUT.")
+    return {
+        "message": "The booking service is busy. Check GET /bookings/ before trying again."
+    }, status.HTTP_503_SERVICE_UNAVAILABLE, {'Retry-After': '1'}
+
+
+def save_booking(save, key=None, fingerprint=None):
+    """
+    Runs `save`, which books the class or queues the client, and returns
+    the (data, status, headers) answer. With an Idempotency-Key the answer
+    is stored in the same transaction, so it exists exactly when the
+    booking does.
+    """
+    try:
+        with serialized_writes(), transaction.atomic():
+            booking = save()
+            if isinstance(booking, WaitlistEntry):
+                data, status_code = waitlist_response(booking)
+            else:
+                data, status_code = booking_response(booking)
+            if key:
+                IdempotencyKey.objects.create(
+                    key=key, fingerprint=fingerprint, status_code=status_code, response=data
+                )
+    except IntegrityError:
+        record = IdempotencyKey.objects.find(key) if key else None
+        if record is None:
+            raise
+        # A concurrent retry with the same key committed first; this one was rolled back.
+        logger.info("Replaying booking for concurrent %s %s", IDEMPOTENCY_HEADER, key)
+        return replayed(record, fingerprint)
+    return data, status_code, {}
+
+
 class BookClassView(APIView):
     """
     POST /book/
-    Body: {fitness_class, client_name, client_email}
-    Validates availability and creates a booking.
+    Body: {fitness_class, client_name, client_email, waitlist: false}
+    Validates availability and creates a booking. With `waitlist`, a full
+    class queues the client instead (202) and reports their position.
+    A retry sent with the same Idempotency-Key header gets the first
+    answer back without booking again. Other bookings go through the
+    group-commit batcher when BOOKING_GROUP_COMMIT is on.
     """
+    throttle_scope = 'book'
 
     def post(self, request):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        fingerprint = None
+        if key is not None:
+            error = invalid_key(key)
+            if error:
+                return Response({"message": error}, status=status.HTTP_400_BAD_REQUEST)
+            fingerprint = request_fingerprint(request.data)
+            record = IdempotencyKey.objects.find(key)
+            if record is not None:
+                logger.info("Replaying booking for %s %s", IDEMPOTENCY_HEADER, key)
+                data, status_code, headers = replayed(record, fingerprint)
+                return Response(data, status=status_code, headers=headers)
+
         serializer = BookingSerializer(data=request.data)
 
         if not serializer.is_valid():
-            logger.error(f"Invalid booking request: {serializer.errors}")
+            logger.error("Invalid booking request: %s", serializer.errors)
             return Response({
                 "message": "Booking request is not valid.",
                 "errors": serializer.errors
             }, status=status.HTTP_400_BAD_REQUEST)
 
         try:
-            booking = serializer.save()
-            logger.info(f"Booking successful for class ID {booking.fitness_class.id} by {booking.client_email}")
+            if key is None and booking_batcher.handles(serializer.validated_data):
+                data, status_code, headers = batched_booking(serializer.validated_data)
+            else:
+                data, status_code, headers = save_booking(serializer.save, key, fingerprint)
+            return Response(data, status=status_code, headers=headers)
+
+        except GroupCommitTimeout:
+            data, status_code, headers = group_commit_timeout_response()
+            return Response(data, status=status_code, headers=headers)
 
+        except ValidationError as e:
+            logger.warning("Booking rejected: %s", e.detail)
             return Response({
-                "message": "Booking successful.",
-                "booking_id": booking.id
-            }, status=status.HTTP_201_CREATED)
+                "message": "Booking request is not valid.",
+                "errors": e.detail
+            }, status=status.HTTP_400_BAD_REQUEST)
 
         except Exception as e:
             logger.error("Error occurred during booking.", exc_info=True)
@@ -79,34 +261,274 @@ class BookClassView(APIView):
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
-class BookingListView(APIView):
+class BulkBookClassView(APIView):
+    """
+    POST /book/bulk/
+    Body: {bookings: [{fitness_class, client_name, client_email}, ...], atomic: true}
+    Books many clients at once and reports the outcome of every booking.
+    """
+    throttle_scope = 'book'
+
+    def post(self, request):
+        serializer = BulkBookingSerializer(data=request.data)
+
+        if not serializer.is_valid():
+            logger.error("Invalid bulk booking request: %s", serializer.errors)
+            return Response({
+                "message": "Booking request is not valid.",
+                "errors": serializer.errors
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            with serialized_writes():
+                results = serializer.save()
+            booked = sum(1 for result in results if result["status"] == "booked")
+            if booked:
+                # bulk_create bypasses post_save, so the listing is invalidated here.
+                invalidate_class_listing()
+            logger.info("Bulk booking made %d of %d bookings", booked, len(results))
+
+            if booked == len(results):
+                message, status_code = "Booking successful.", status.HTTP_201_CREATED
+            elif booked:
+                message, status_code = "Some bookings could not be made.", status.HTTP_207_MULTI_STATUS
+            else:
+                message, status_code = "No bookings were made.", status.HTTP_400_BAD_REQUEST
+
+            return Response({
+                "message": message,
+                "booked": booked,
+                "results": results
+            }, status=status_code)
+
+        except Exception as e:
+            logger.error("Error occurred during bulk booking.", exc_info=True)
+            return Response({
+                "message": "An error occurred while processing your booking.",
+                "error": str(e)
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class CancelBookingView(APIView):
+    """
+    POST /bookings/<booking_id>/cancel/
+    Body: {client_email}
+    Cancels the client's booking. Its slot goes back to the class, or to
+    the head of the class's waitlist.
+    """
+    throttle_scope = 'cancel'
+
+    def post(self, request, booking_id):
+        email = request.data.get('client_email')
+        if not email:
+            logger.warning("Missing 'client_email' in cancellation request.")
+            return Response({
+                "message": "client_email is required."
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            bookings = Booking.objects.filter(pk=booking_id).for_email(str(email))
+            if not bookings.exists():
+                return Response({
+                    "message": "Booking not found."
+                }, status=status.HTTP_404_NOT_FOUND)
+
+            with serialized_writes():
+                cancelled = bookings.cancel()
+            if not cancelled:
+                return Response({
+                    "message": "Booking is already cancelled."
+                }, status=status.HTTP_400_BAD_REQUEST)
+
+            # The slot is restored with an UPDATE, which bypasses post_save.
+            invalidate_class_listing()
+            logger.info("Booking %s cancelled by %s", booking_id, email)
+
+            return Response({
+                "message": "Booking cancelled.",
+                "booking_id": booking_id
+            }, status=status.HTTP_200_OK)
+
+        except Exception as e:
+            logger.error("Error occurred while cancelling booking %s.", booking_id, exc_info=True)
+            return Response({
+                "message": "An error occurred while cancelling your booking.",
+                "error": str(e)
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class WaitlistView(APIView):
     """
-    GET /bookings/?email=client@example.com
-    Returns bookings made by the specified email.
+    GET /waitlist/?email=client@example.com
+    Returns the classes the client is queued for, with their position in
+    each queue.
     """
+    throttle_scope = 'waitlist'
 
+    @reads_from_replicas
     def get(self, request):
         email = request.GET.get('email')
         if not email:
-            logger.warning("Missing 'email' parameter in booking list request.")
+            logger.warning("Missing 'email' parameter in waitlist request.")
             return Response({
                 "message": "Email parameter is required."
             }, status=status.HTTP_400_BAD_REQUEST)
 
         try:
-            bookings = Booking.objects.filter(client_email__iexact=email)
-            serializer = BookingSerializer(bookings, many=True)
-            logger.info(f"Returned {len(bookings)} bookings for email {email}")
+            entries = (
+                WaitlistEntry.objects.for_email(email)
+                .select_related('fitness_class').with_position()
+            )
+            data = WaitlistEntrySerializer(entries, many=True).data
+            logger.info("Returned %d waitlist entries for email %s", len(data), email)
 
             return Response({
-                "message": "Bookings details fetched successfully.",
-                "count": len(bookings),
-                "data": serializer.data
+                "message": "Waitlist details fetched successfully.",
+                "data": data
             }, status=status.HTTP_200_OK)
 
         except Exception as e:
-            logger.error(f"Error fetching bookings for email {email}", exc_info=True)
+            logger.error("Error fetching waitlist for email %s", email, exc_info=True)
+            return Response({
+                "message": "An error occurred while retrieving the waitlist.",
+                "error": str(e)
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class BookingListView(FastJSONMixin, APIView):
+    """
+    GET /bookings/?email=client@example.com&page_size=10&cursor=<next cursor>
+    Returns bookings made by the specified email, one keyset-paginated page
+    at a time. `count` is the total number of active bookings for the email;
+    cancelled bookings are left out.
+    """
+    throttle_scope = 'bookings'
+
+    @reads_from_replicas
+    def get(self, request):
+        email = request.GET.get('email')
+        if not email:
+            logger.warning("Missing 'email' parameter in booking list request.")
+            return Response({
+                "message": "Email parameter is required."
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            paginator = BookingKeysetPagination(request)
+        except ValidationError as e:
+            return Response({"error": e.detail[0]}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            bookings = Booking.objects.for_email(email)
+            # The validator aggregate also provides the total count. It spans
+            # cancelled bookings too, so a cancellation changes Last-Modified;
+            # so does a deletion, through its stamp.
+            last_modified, count = booking_list_validators(bookings, email)
+            etag = make_etag(email.lower(), paginator.page_size, request.GET.get(paginator.cursor_query_param, ''),
+                             count, last_modified)
+            not_modified = not_modified_response(request, etag, last_modified)
+            if not_modified is not None:
+                return not_modified
+
+            if getattr(settings, 'BOOKING_FAST_JSON', False):
+                page = paginator.paginate_queryset(bookings.active().values(*FAST_BOOKING_VALUES))
+                data = fast_booking_rows(page)
+            else:
+                page = paginator.paginate_queryset(bookings.active().select_related('fitness_class'))
+                data = BookingSerializer(page, many=True).data
+            logger.info("Returned %d bookings for email %s", len(page), email)
+
+            return set_validators(Response({
+                "message": "Bookings details fetched successfully.",
+                "count": count,
+                "next": paginator.get_next_link(),
+                "data": data
+            }, status=status.HTTP_200_OK), etag, last_modified)
+
+        except Exception as e:
+            logger.error("Error fetching bookings for email %s", email, exc_info=True)
             return Response({
                 "message": "An error occurred while retrieving bookings.",
                 "error": str(e)
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class SlotAvailabilityStreamView(View):
+    """
+    GET /classes/stream/
+    Server-Sent Events stream of available slots for upcoming classes: one
+    `snapshot` event with every class on connect, then a `slots` event
+    ({id, available_slots}) whenever a class's count changes. Every stream
+    is fed by the in-process SlotEventHub rather than by its own queries.
+    Under asgi.py the stream is served from the event loop.
+    """
+
+    def get(self, request):
+        heartbeat = getattr(settings, 'BOOKING_SSE_HEARTBEAT', 15)
+        if isinstance(request, ASGIRequest):
+            stream = self.astream(heartbeat)
+        else:
+            stream = self.stream(heartbeat)
+
+        response = StreamingHttpResponse(stream, content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+    @staticmethod
+    def snapshot(entries):
+        return [{"id": item["id"], "available_slots": item["available_slots"]} for _, _, item in entries]
+
+    def stream(self, heartbeat):
+        # Subscribe before taking the snapshot so no change falls in between.
+        subscriber = slot_events.subscribe()
+        try:
+            entries, _ = get_upcoming_classes('Asia/Kolkata')
+            yield format_sse('snapshot', self.snapshot(entries))
+            while True:
+                events = subscriber.wait(heartbeat)
+                for event in events:
+                    yield format_sse('slots', event)
+                if not events:
+                    yield ': keep-alive\n\n'
+        finally:
+            slot_events.unsubscribe(subscriber)
+
+    async def astream(self, heartbeat):
+        subscriber = slot_events.subscribe(asyncio.get_running_loop())
+        try:
+            entries, _ = await aget_upcoming_classes('Asia/Kolkata')
+            yield format_sse('snapshot', self.snapshot(entries))
+            while True:
+                events = await subscriber.await_events(heartbeat)
+                for event in events:
+                    yield format_sse('slots', event)
+                if not events:
+                    yield ': keep-alive\n\n'
+        finally:
+            slot_events.unsubscribe(subscriber)
+
+
+class MetricsView(View):
+    """
+    GET /metrics/
+    Request metrics recorded by RequestMetricsMiddleware, in the Prometheus
+    text format. Only served to the addresses in
+    BOOKING_METRICS_ALLOWED_IPS or with "Authorization: Bearer
+    <BOOKING_METRICS_TOKEN>"; with neither set, nobody gets them.
+    """
+
+    def get(self, request):
+        if not self.allowed(request):
+            logger.warning("Refused /metrics/ to %s", request.META.get('REMOTE_ADDR'))
+            return HttpResponse(status=status.HTTP_403_FORBIDDEN)
+        return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+    @staticmethod
+    def allowed(request):
+        if request.META.get('REMOTE_ADDR') in getattr(settings, 'BOOKING_METRICS_ALLOWED_IPS', ()):
+            return True
+        token = getattr(settings, 'BOOKING_METRICS_TOKEN', None)
+        return bool(token) and hmac.compare_digest(
+            request.headers.get('Authorization', '').encode(), f'Bearer {token}'.encode()
+        )
@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'fitness_studio.settings')
+# Lets settings pick their ASGI defaults, such as BOOKING_CONN_MAX_AGE.
+os.environ['BOOKING_ASGI'] = '1'
 
 application = get_asgi_application()
@@ -11,11 +11,25 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
 from pathlib import Path
+import atexit
 import os
+import shutil
+import sys
+import tempfile
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 LOGS_DIR = os.path.join(BASE_DIR, 'logs')
+if sys.argv[1:2] == ['test']:
+    # The suite logs to a throwaway directory, not the repo's logs/.
+    LOGS_DIR = tempfile.mkdtemp(prefix='fitness-studio-test-logs-')
+    atexit.register(shutil.rmtree, LOGS_DIR, ignore_errors=True)
+
+# Levels for loggers handed out by booking.utils.CustomLogger. LOG_LEVELS
+# overrides the default per logger name, e.g. {'booking.views': 'WARNING'}.
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+LOG_LEVELS = {}
+LOG_TO_CONSOLE = True
 
 
 # Quick-start development settings - unsuitable for production
@@ -43,6 +57,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'booking.middleware.RequestMetricsMiddleware',
+    'booking.middleware.PrimaryPinningMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -71,6 +87,10 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'fitness_studio.wsgi.application'
 
+# Serve /classes/, /book/ and /bookings/ with the async-native views in
+# booking.async_views. Only worth enabling when running under asgi.py.
+BOOKING_ASYNC_VIEWS = os.environ.get('BOOKING_ASYNC_VIEWS', '').lower() in ('1', 'true', 'yes')
+
 
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
@@ -82,6 +102,124 @@ DATABASES = {
     }
 }
 
+# BOOKING_DB_ENGINE=postgresql switches the primary to PostgreSQL, configured
+# with the usual POSTGRES_* variables.
+BOOKING_DB_ENGINE = os.environ.get('BOOKING_DB_ENGINE', 'sqlite').lower()
+if BOOKING_DB_ENGINE == 'postgresql':
+    DATABASES['default'] = {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': os.environ.get('POSTGRES_DB', 'fitness_studio'),
+        'USER': os.environ.get('POSTGRES_USER', 'postgres'),
+        'PASSWORD': os.environ.get('POSTGRES_PASSWORD', ''),
+        'HOST': os.environ.get('POSTGRES_HOST', 'localhost'),
+        'PORT': os.environ.get('POSTGRES_PORT', '5432'),
+    }
+
+# Read replicas: extra DATABASES aliases that the read-only endpoints
+# (/bookings/ and /waitlist/) read from; writes always go to 'default'. For
+# local testing, BOOKING_READ_REPLICAS=replica1,replica2 adds SQLite copies
+# db.replica1.sqlite3, ... (refresh them with `manage.py refresh_replicas`).
+BOOKING_READ_REPLICAS = [alias for alias in os.environ.get('BOOKING_READ_REPLICAS', '').split(',') if alias]
+for _alias in BOOKING_READ_REPLICAS:
+    DATABASES.setdefault(_alias, {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / f'db.{_alias}.sqlite3',
+        'TEST': {'MIRROR': 'default'},
+    })
+
+DATABASE_ROUTERS = ['booking.routers.ReadReplicaRouter']
+
+# How the replica of each request is picked: 'round_robin' or 'lru' (least
+# recently used).
+BOOKING_REPLICA_STRATEGY = 'round_robin'
+
+# Seconds a client keeps reading from the primary after a write, so that it
+# sees its own bookings despite replication lag.
+BOOKING_PRIMARY_PIN_SECONDS = 10
+
+# SQLite production profile, enabled with BOOKING_SQLITE_PRODUCTION=1:
+# - WAL, so readers never block the writer or each other.
+# - synchronous=NORMAL, which is durable at each checkpoint under WAL.
+# - a 64 MB page cache and 256 MB of memory-mapped I/O.
+# - transactions start with BEGIN IMMEDIATE, taking the write lock up front
+#   rather than failing when a read turns into a write.
+# - writers wait up to 20 seconds for the lock.
+# - booking writes are queued within the process (BOOKING_SERIALIZE_WRITES).
+# Compare it with stock settings: python manage.py bench_sqlite_writes
+SQLITE_PRODUCTION_OPTIONS = {
+    'transaction_mode': 'IMMEDIATE',
+    'timeout': 20,
+    'init_command': (
+        'PRAGMA journal_mode=WAL;'
+        'PRAGMA synchronous=NORMAL;'
+        'PRAGMA cache_size=-64000;'
+        'PRAGMA mmap_size=268435456;'
+        'PRAGMA temp_store=MEMORY;'
+    ),
+}
+
+BOOKING_SQLITE_PRODUCTION = os.environ.get('BOOKING_SQLITE_PRODUCTION', '').lower() in ('1', 'true', 'yes')
+if BOOKING_SQLITE_PRODUCTION and BOOKING_DB_ENGINE == 'sqlite':
+    DATABASES['default']['OPTIONS'] = SQLITE_PRODUCTION_OPTIONS
+
+# Run booking, cancellation and bulk booking transactions one at a time
+# within this process (see booking.db.serialized_writes).
+BOOKING_SERIALIZE_WRITES = BOOKING_SQLITE_PRODUCTION
+
+# Group commit for POST /book/ (booking.batching), off by default: requests
+# are collected for BOOKING_GROUP_COMMIT_WINDOW seconds, up to
+# BOOKING_GROUP_COMMIT_MAX_BATCH, and booked together in one transaction.
+# Compare it with one transaction per booking: manage.py bench_group_commit
+# Classes held by BOOKING_SLOT_COUNTER below skip it and use the counter.
+# A request without an answer after BOOKING_GROUP_COMMIT_TIMEOUT seconds
+# gets 503.
+BOOKING_GROUP_COMMIT = os.environ.get('BOOKING_GROUP_COMMIT', '').lower() in ('1', 'true', 'yes')
+BOOKING_GROUP_COMMIT_WINDOW = 0.002
+BOOKING_GROUP_COMMIT_MAX_BATCH = 256
+BOOKING_GROUP_COMMIT_TIMEOUT = 5
+
+# Reservation engine for flash sales (booking.slots), off by default:
+# 'memory' keeps the free slots of the classes starting within
+# BOOKING_SLOT_COUNTER_HORIZON seconds in this process, 'cache' in the
+# BOOKING_SLOT_COUNTER_CACHE_ALIAS cache shared by every worker (Redis, not
+# Memcached). POST /book/ then answers 202 and the bookings are written
+# every BOOKING_SLOT_FLUSH_INTERVAL seconds, BOOKING_SLOT_FLUSH_BATCH at a
+# time. Reload the counters with `manage.py reconcile_slots`.
+BOOKING_SLOT_COUNTER = os.environ.get('BOOKING_SLOT_COUNTER') or None
+BOOKING_SLOT_COUNTER_CACHE_ALIAS = 'default'
+BOOKING_SLOT_COUNTER_HORIZON = 24 * 60 * 60
+BOOKING_SLOT_FLUSH_INTERVAL = 0.2
+BOOKING_SLOT_FLUSH_BATCH = 500
+
+# Connection reuse. Each thread keeps its connection open for
+# BOOKING_CONN_MAX_AGE seconds instead of opening one per request, and
+# checks it still works before reusing it. Under ASGI every request runs its
+# queries in a new thread, so persistent connections would only pile up:
+# they default to off there, use a pool instead. asgi.py sets BOOKING_ASGI.
+BOOKING_ASGI = os.environ.get('BOOKING_ASGI', '').lower() in ('1', 'true', 'yes')
+BOOKING_CONN_MAX_AGE = int(os.environ.get('BOOKING_CONN_MAX_AGE', '0' if BOOKING_ASGI else '60'))
+
+# PostgreSQL only: BOOKING_DB_POOL=1 shares a psycopg connection pool
+# (pip install "psycopg[pool]") between the threads of each process, and
+# checks every connection as it is checked out. Replaces BOOKING_CONN_MAX_AGE.
+BOOKING_DB_POOL = os.environ.get('BOOKING_DB_POOL', '').lower() in ('1', 'true', 'yes')
+BOOKING_DB_POOL_OPTIONS = {
+    'min_size': int(os.environ.get('BOOKING_DB_POOL_MIN_SIZE', '2')),
+    'max_size': int(os.environ.get('BOOKING_DB_POOL_MAX_SIZE', '10')),
+    # Seconds a request waits for a free connection before failing.
+    'timeout': int(os.environ.get('BOOKING_DB_POOL_TIMEOUT', '10')),
+}
+if BOOKING_DB_POOL and BOOKING_DB_ENGINE == 'postgresql':
+    from psycopg_pool import ConnectionPool
+
+    DATABASES['default']['OPTIONS'] = {
+        'pool': dict(BOOKING_DB_POOL_OPTIONS, check=ConnectionPool.check_connection),
+    }
+
+for _db in DATABASES.values():
+    _db.setdefault('CONN_MAX_AGE', 0 if 'pool' in _db.get('OPTIONS', {}) else BOOKING_CONN_MAX_AGE)
+    _db.setdefault('CONN_HEALTH_CHECKS', True)
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -104,8 +242,76 @@ AUTH_PASSWORD_VALIDATORS = [
 REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 10,
+    'DEFAULT_THROTTLE_CLASSES': ['booking.throttling.TokenBucketThrottle'],
+    # Reverse proxies in front of the app. With 0, throttling keys on
+    # REMOTE_ADDR and ignores the client-controlled X-Forwarded-For header.
+    'NUM_PROXIES': int(os.environ.get('BOOKING_NUM_PROXIES', 0)),
 }
 
+# Upper bound for the `page_size` query parameter of the keyset-paginated
+# /classes/ and /bookings/ endpoints (PAGE_SIZE above is the default).
+BOOKING_MAX_PAGE_SIZE = 100
+
+# Maximum number of bookings accepted by one POST /book/bulk/ request.
+BOOKING_BULK_MAX_ITEMS = 500
+
+# Build /classes/ and /bookings/ from .values() rows without per-row
+# serializer instances and render them with orjson when it is installed.
+# The response bytes are the same as with the regular serializers.
+BOOKING_FAST_JSON = os.environ.get('BOOKING_FAST_JSON', '').lower() in ('1', 'true', 'yes')
+
+# Seconds between keep-alive comments on an idle /classes/stream/ connection.
+BOOKING_SSE_HEARTBEAT = 15
+
+# Seconds the answer to a POST /book/ sent with an Idempotency-Key header is
+# kept for replay. Expired keys are removed by `manage.py purge_idempotency_keys`.
+BOOKING_IDEMPOTENCY_TTL = 24 * 60 * 60
+
+
+# Who may read GET /metrics/: client addresses (REMOTE_ADDR) and/or a token
+# sent as "Authorization: Bearer <token>". Nobody by default.
+BOOKING_METRICS_ALLOWED_IPS = [ip for ip in os.environ.get('BOOKING_METRICS_ALLOWED_IPS', '').split(',') if ip]
+BOOKING_METRICS_TOKEN = os.environ.get('BOOKING_METRICS_TOKEN') or None
+
+# Requests taking at least this many milliseconds are logged with their
+# query and rendering figures by RequestMetricsMiddleware; None disables it.
+BOOKING_SLOW_REQUEST_MS = 500
+
+# Token-bucket rate limits per endpoint ("throttle scope"). 'client' limits
+# each IP address; '10/min' allows bursts of 10 requests, refilled over a
+# minute. A 'global' limit for all callers together caps the whole service,
+# so none is set by default: add one (e.g. 'global': '60000/min') only as a
+# safety net sized well above peak traffic.
+BOOKING_THROTTLE_RATES = {
+    'classes': {'client': '120/min'},
+    'book': {'client': '10/min'},
+    'bookings': {'client': '30/min'},
+    'waitlist': {'client': '30/min'},
+    'cancel': {'client': '10/min'},
+}
+
+# Where the buckets live: 'memory' for a single process, 'cache' to share
+# them between workers through the BOOKING_THROTTLE_CACHE_ALIAS cache.
+BOOKING_THROTTLE_STORE = 'memory'
+BOOKING_THROTTLE_CACHE_ALIAS = 'default'
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# Any Django cache backend can be used; point BOOKING_CACHE_ALIAS at a shared
+# backend (e.g. Redis/Memcached) when running several workers.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+BOOKING_CACHE_ALIAS = 'default'
+
+# Seconds a serialized upcoming-class listing is kept per timezone.
+BOOKING_CLASS_CACHE_TIMEOUT = 300
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/5.2/topics/i18n/